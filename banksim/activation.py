@@ -12,8 +12,17 @@ class MultiStepActivation:
         self.central_bank = None
         self.clearing_house = None
         self.banks = []
-        self.depositors = []
-        self.corporate_clients = []
+        self.depositors = None
+        self.corporate_clients = None
+        # DepositInsurer, if the deposit insurance fund is active
+        self.deposit_insurer = None
+
+        # compiled shock schedule of a stress test, applied at the start of every cycle
+        self.shocks = None
+        # EventLog where agents record failures, bailouts, runs, etc.
+        self.event_log = None
+        # ExposureHistory where the interbank lending matrix is stored at the end of every cycle
+        self.exposure_history = None
 
     def add_central_bank(self, central_bank):
         self.central_bank = central_bank
@@ -24,20 +33,40 @@ class MultiStepActivation:
     def add_bank(self, bank):
         self.banks.append(bank)
 
-    def add_depositor(self, depositor):
-        self.depositors.append(depositor)
+    def add_depositors(self, depositors):
+        self.depositors = depositors
+
+    def add_corporate_clients(self, corporate_clients):
+        self.corporate_clients = corporate_clients
+
+    def add_deposit_insurer(self, deposit_insurer):
+        self.deposit_insurer = deposit_insurer
+
+    def add_shocks(self, shocks):
+        self.shocks = shocks
+
+    def add_event_log(self, event_log):
+        self.event_log = event_log
+
+    def add_exposure_history(self, exposure_history):
+        self.exposure_history = exposure_history
 
-    def add_corporate_client(self, corporate_client):
-        self.corporate_clients.append(corporate_client)
+    def record_events(self, event_type, banks, amounts):
+        # banks are indices, amounts one per bank or a single value
+        if self.event_log is not None:
+            self.event_log.record(self.cycle, event_type, banks, amounts)
 
     @property
     def agents(self):
-        # The order is important
-        return itertools.chain(self.depositors, self.banks, [self.clearing_house], [self.central_bank],
-                               self.corporate_clients)
+        # The order is important. Depositors and corporate clients act as whole populations.
+        deposit_insurer = [self.deposit_insurer] if self.deposit_insurer is not None else []
+        return itertools.chain([self.depositors], self.banks, [self.clearing_house], [self.central_bank],
+                               deposit_insurer, [self.corporate_clients])
 
     def reset_cycle(self):
         self.cycle += 1
+        if self.shocks is not None:
+            self.shocks.apply(self.model, self.cycle)
         for _ in self.agents:
             _.reset()
 
@@ -55,3 +84,5 @@ class MultiStepActivation:
         self.period = 2
         for _ in self.agents:
             _.period_2()
+        if self.exposure_history is not None:
+            self.exposure_history.record(self.cycle, self.clearing_house.interbankLendingMatrix)
@@ -1,8 +1,8 @@
 from copy import copy
 
 import numpy as np
-from mesa import Agent
 
+from banksim.core import Agent
 from banksim.exogeneous_factors import BankSizeDistribution, ExogenousFactors
 from banksim.strategies.bank_ewa_strategy import BankEWAStrategy
 from banksim.util import Util
@@ -18,8 +18,10 @@ class Bank(Agent):
 
         self.interbankHelper = InterbankHelper()
         self.guaranteeHelper = GuaranteeHelper()
-        self.depositors = []  # Depositors
-        self.corporateClients = []  # CorporateClients
+        # Position among the model's banks, which also locates its depositors and corporate clients
+        self.index = None
+        self.numberDepositors = 0
+        self.numberCorporateClients = 0
 
         self.liquidityNeeds = 0
         self.bankRunOccurred = False
@@ -30,21 +32,48 @@ class Bank(Agent):
 
         self.isIntelligent = is_intelligent
         if self.isIntelligent:
-            self.strategiesOptionsInformation = BankEWAStrategy.bank_ewa_strategy_list()
+            # EWA information, in the same order as BankEWAStrategy.bank_ewa_strategy_list()
+            number_strategies = BankEWAStrategy.get_number_strategies()
+            self.strategyA = np.zeros(number_strategies)
+            self.strategyP = np.zeros(number_strategies)
+            self.strategyF = np.zeros(number_strategies)
+            self.strategyProfit = np.zeros(number_strategies)
+            self.strategyProfitPercentage = np.zeros(number_strategies)
+            self.strategyProfitPercentageDamped = np.zeros(number_strategies)
             self.currentlyChosenStrategy = None
             self.EWADampingFactor = ewa_damping_factor
 
+    @property
+    def depositors(self):
+        return self.model.schedule.depositors.get_bank_agents(self.index)
+
+    @property
+    def corporateClients(self):
+        return self.model.schedule.corporate_clients.get_bank_agents(self.index)
+
+    @property
+    def strategiesOptionsInformation(self):
+        # Snapshot of the EWA information, one BankEWAStrategy per option
+        strategies = BankEWAStrategy.bank_ewa_strategy_list()
+        for i, strategy in enumerate(strategies):
+            strategy.A, strategy.P, strategy.F = self.strategyA[i], self.strategyP[i], self.strategyF[i]
+            strategy.strategyProfit = self.strategyProfit[i]
+            strategy.strategyProfitPercentage = self.strategyProfitPercentage[i]
+            strategy.strategyProfitPercentageDamped = self.strategyProfitPercentageDamped[i]
+        return strategies
+
     def update_strategy_choice_probability(self):
-        list_a = np.array([0.9999 * s.A + s.strategyProfitPercentageDamped for s in self.strategiesOptionsInformation])
+        list_a = 0.9999 * self.strategyA + self.strategyProfitPercentageDamped
         _exp = np.exp(list_a)
-        list_p = _exp / np.sum(_exp)
-        list_f = np.cumsum(list_p)
-        for i, strategy in enumerate(self.strategiesOptionsInformation):
-            strategy.A, strategy.P, strategy.F = list_a[i], list_p[i], list_f[i]
+        self.strategyA = list_a
+        self.strategyP = _exp / np.sum(_exp)
+        self.strategyF = np.cumsum(self.strategyP)
 
     def pick_new_strategy(self):
         probability_threshold = Util.get_random_uniform(1)
-        self.currentlyChosenStrategy = [s for s in self.strategiesOptionsInformation if s.F > probability_threshold][0]
+        # first strategy whose cumulative probability is above the threshold
+        i = min(np.searchsorted(self.strategyF, probability_threshold, side='right'), len(self.strategyF) - 1)
+        self.currentlyChosenStrategy = BankEWAStrategy(*divmod(i, BankEWAStrategy.get_number_beta_options()))
 
     def reset(self):
         self.liquidityNeeds = 0
@@ -57,21 +86,19 @@ class Bank(Agent):
     def setup_balance_sheet_intelligent(self, strategy=None):
         if strategy is None:
             strategy = self.currentlyChosenStrategy
-        self.balanceSheet.liquidAssets = self.initialSize * strategy.get_beta_value()
+        self.balanceSheet.liquidAssets = self.initialSize * BankEWAStrategy.get_beta_values()[strategy.betaIndex]
         self.balanceSheet.nonFinancialSectorLoan = self.initialSize - self.balanceSheet.liquidAssets
         self.balanceSheet.interbankLoan = 0
         self.balanceSheet.discountWindowLoan = 0
-        self.balanceSheet.deposits = self.initialSize * (strategy.get_alpha_value() - 1)
+        self.balanceSheet.deposits = self.initialSize * (BankEWAStrategy.get_alpha_values()[strategy.alphaIndex] - 1)
         self.liquidityNeeds = 0
         self.setup_balance_sheet()
 
     def setup_balance_sheet(self):
-        loan_per_coporate_client = self.balanceSheet.nonFinancialSectorLoan / len(self.corporateClients)
-        for corporateClient in self.corporateClients:
-            corporateClient.loanAmount = loan_per_coporate_client
-        deposit_per_depositor = -self.balanceSheet.deposits / len(self.depositors)
-        for depositor in self.depositors:
-            depositor.make_deposit(deposit_per_depositor)
+        loan_per_coporate_client = self.balanceSheet.nonFinancialSectorLoan / self.numberCorporateClients
+        self.model.schedule.corporate_clients.grant_loans(self.index, loan_per_coporate_client)
+        deposit_per_depositor = -self.balanceSheet.deposits / self.numberDepositors
+        self.model.schedule.depositors.make_deposits(self.index, deposit_per_depositor)
 
     def get_capital_adequacy_ratio(self):
         if self.is_solvent():
@@ -89,36 +116,31 @@ class Bank(Agent):
         current_capital_ratio = self.get_capital_adequacy_ratio()
         if current_capital_ratio <= minimum_capital_ratio_required:
             adjustment_factor = current_capital_ratio / minimum_capital_ratio_required
-            for corporateClient in self.corporateClients:
-                original_loan_amount = corporateClient.loanAmount
-                new_loan_amount = original_loan_amount * adjustment_factor
-                corporateClient.loanAmount = new_loan_amount
-                self.balanceSheet.liquidAssets += (original_loan_amount - new_loan_amount)
+            self.balanceSheet.liquidAssets += self.model.schedule.corporate_clients.scale_loans(
+                self.index, adjustment_factor)
 
             self.update_non_financial_sector_loans()
 
     def update_non_financial_sector_loans(self):
-        self.balanceSheet.nonFinancialSectorLoan = sum(
-            client.loanAmount for client in self.corporateClients)
+        self.balanceSheet.nonFinancialSectorLoan = self.model.schedule.corporate_clients.get_total_loans(self.index)
 
     def get_real_sector_risk_weighted_assets(self):
         if ExogenousFactors.standardCorporateClients:
             return self.balanceSheet.nonFinancialSectorLoan * ExogenousFactors.CorporateLoanRiskWeight
         else:
-            for corporateClient in self.corporateClients:
-                if corporateClient.probabilityOfDefault == ExogenousFactors.retailCorporateClientDefaultRate:
-                    return corporateClient.loanAmount * ExogenousFactors.retailCorporateLoanRiskWeight
-                elif corporateClient.probabilityOfDefault == ExogenousFactors.wholesaleCorporateClientDefaultRate:
-                    return corporateClient.loanAmount * ExogenousFactors.wholesaleCorporateLoanRiskWeight
-                else:
-                    # default risk weight
-                    return corporateClient.loanAmount * ExogenousFactors.CorporateLoanRiskWeight
-
-    def withdraw_deposit(self, amount_to_withdraw):
-        if amount_to_withdraw > 0:
-            self.withdrawalsCounter += 1
-        self.liquidityNeeds -= amount_to_withdraw
-        return amount_to_withdraw
+            corporate_clients = self.model.schedule.corporate_clients
+            loan_amount = corporate_clients.get_first_loan_amount(self.index)
+            if corporate_clients.probabilityOfDefault == ExogenousFactors.retailCorporateClientDefaultRate:
+                return loan_amount * ExogenousFactors.retailCorporateLoanRiskWeight
+            elif corporate_clients.probabilityOfDefault == ExogenousFactors.wholesaleCorporateClientDefaultRate:
+                return loan_amount * ExogenousFactors.wholesaleCorporateLoanRiskWeight
+            else:
+                # default risk weight
+                return loan_amount * ExogenousFactors.CorporateLoanRiskWeight
+
+    def withdraw_deposits(self, total_amount_withdrawn, number_withdrawals):
+        self.withdrawalsCounter += number_withdrawals
+        self.liquidityNeeds -= total_amount_withdrawn
 
     def use_liquid_assets_to_pay_depositors_back(self):
         if self.needs_liquidity():
@@ -137,12 +159,10 @@ class Bank(Agent):
     def calculate_deposits_interest(self):
         deposits_interest_rate = 1 + self.model.depositInterestRate
         self.balanceSheet.deposits *= deposits_interest_rate
-        for depositor in self.depositors:
-            depositor.deposit.amount *= deposits_interest_rate
+        self.model.schedule.depositors.accrue_interest(self.index, deposits_interest_rate)
 
     def collect_loans(self):
-        self.balanceSheet.nonFinancialSectorLoan = sum(
-            client.pay_loan_back() for client in self.corporateClients)
+        self.balanceSheet.nonFinancialSectorLoan = self.model.schedule.corporate_clients.pay_loans_back(self.index)
 
     def offers_liquidity(self):
         return self.liquidityNeeds > 0
@@ -158,22 +178,23 @@ class Bank(Agent):
         self.balanceSheet.deposits -= amount
         self.liquidityNeeds -= amount
 
-    def use_non_liquid_assets_to_pay_depositors_back(self):
+    def use_non_liquid_assets_to_pay_depositors_back(self, discount_rate=None):
+        if discount_rate is None:
+            discount_rate = ExogenousFactors.illiquidAssetDiscountRate
         if self.needs_liquidity():
             liquidity_needed = -self.liquidityNeeds
-            total_loans_to_sell = liquidity_needed * (1 + ExogenousFactors.illiquidAssetDiscountRate)
+            total_loans_to_sell = liquidity_needed * (1 + discount_rate)
             if self.balanceSheet.nonFinancialSectorLoan > total_loans_to_sell:
                 amount_sold = total_loans_to_sell
                 self.liquidityNeeds = 0
                 self.balanceSheet.deposits += liquidity_needed
             else:
                 amount_sold = self.balanceSheet.nonFinancialSectorLoan
-                self.liquidityNeeds += amount_sold / (1 + ExogenousFactors.illiquidAssetDiscountRate)
+                self.liquidityNeeds += amount_sold / (1 + discount_rate)
                 self.balanceSheet.deposits += liquidity_needed - self.liquidityNeeds
             proportion_of_illiquid_assets_sold = amount_sold / self.balanceSheet.nonFinancialSectorLoan
 
-            for firm in self.corporateClients:
-                firm.loanAmount *= 1 - proportion_of_illiquid_assets_sold
+            self.model.schedule.corporate_clients.scale_loans(self.index, 1 - proportion_of_illiquid_assets_sold)
             self.balanceSheet.nonFinancialSectorLoan -= amount_sold
 
     def get_profit(self):
@@ -187,7 +208,8 @@ class Bank(Agent):
         if self.isIntelligent:
             strategy = self.currentlyChosenStrategy
 
-            self.bankRunOccurred = (self.withdrawalsCounter > ExogenousFactors.numberDepositorsPerBank / 2)
+            # a bank run is judged against the bank's own depositors, not the average bank
+            self.bankRunOccurred = (self.withdrawalsCounter > self.numberDepositors / 2)
 
             if self.bankRunOccurred:
                 original_loans = self.auxBalanceSheet.nonFinancialSectorLoan
@@ -211,6 +233,11 @@ class Bank(Agent):
             strategy.strategyProfitPercentage = -strategy.strategyProfit / self.auxBalanceSheet.capital
             strategy.strategyProfitPercentageDamped = strategy.strategyProfitPercentage * self.EWADampingFactor
 
+            i = strategy.alphaIndex * BankEWAStrategy.get_number_beta_options() + strategy.betaIndex
+            self.strategyProfit[i] = strategy.strategyProfit
+            self.strategyProfitPercentage[i] = strategy.strategyProfitPercentage
+            self.strategyProfitPercentageDamped[i] = strategy.strategyProfitPercentageDamped
+
     def liquidate(self):
         #  first, sell assets...
         self.balanceSheet.liquidAssets += self.balanceSheet.nonFinancialSectorLoan
@@ -227,24 +254,24 @@ class Bank(Agent):
             self.balanceSheet.liquidAssets += self.balanceSheet.discountWindowLoan
             self.balanceSheet.discountWindowLoan = 0
         else:
-            self.balanceSheet.liquidAssets = 0
+            # whatever there is goes to the central bank, before the assets are zeroed
             self.balanceSheet.discountWindowLoan += self.balanceSheet.liquidAssets
+            self.balanceSheet.liquidAssets = 0
 
         # ...2nd, interbank loans...
         if self.is_interbank_debtor():
             if self.balanceSheet.liquidAssets > abs(self.balanceSheet.interbankLoan):
-                self.balanceSheet.interbankLoan = 0
+                # pay the debt back before zeroing it
                 self.balanceSheet.liquidAssets += self.balanceSheet.interbankLoan
+                self.balanceSheet.interbankLoan = 0
             else:
-                self.balanceSheet.liquidAssets = 0
                 self.balanceSheet.interbankLoan += self.balanceSheet.liquidAssets
+                self.balanceSheet.liquidAssets = 0
 
         # ... finally, if there is any money left, it is proportionally divided among depositors.
         percentage_deposits_payable = self.balanceSheet.liquidAssets / np.absolute(self.balanceSheet.deposits)
         self.balanceSheet.deposits *= percentage_deposits_payable
-
-        for depositor in self.depositors:
-            depositor.deposit.amount *= percentage_deposits_payable
+        self.model.schedule.depositors.apply_haircut(self.index, percentage_deposits_payable)
 
         self.balanceSheet.liquidAssets = 0
 
@@ -302,6 +329,8 @@ class GuaranteeHelper:
 
 
 class BalanceSheet:
+    fields = ('deposits', 'discountWindowLoan', 'interbankLoan', 'nonFinancialSectorLoan', 'liquidAssets')
+
     def __init__(self):
         self.deposits = 0
         self.discountWindowLoan = 0
@@ -324,3 +353,17 @@ class BalanceSheet:
     @property
     def liabilities(self):
         return self.deposits + self.discountWindowLoan + np.min(self.interbankLoan, 0)
+
+    @staticmethod
+    def stack(balance_sheets):
+        # One balance sheet whose fields are arrays, one entry per balance sheet
+        stacked = BalanceSheet()
+        for field in BalanceSheet.fields:
+            setattr(stacked, field, np.array([getattr(_, field) for _ in balance_sheets], dtype=float))
+        return stacked
+
+    def unstack(self, balance_sheets):
+        # Writes the entries of a stacked balance sheet back
+        for field in BalanceSheet.fields:
+            for balance_sheet, value in zip(balance_sheets, getattr(self, field)):
+                setattr(balance_sheet, field, value)
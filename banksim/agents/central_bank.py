@@ -1,7 +1,10 @@
 import numpy as np
-from mesa import Agent
 
+from banksim.agents.bank import BalanceSheet
+from banksim.core import Agent
+from banksim.events import EventType
 from banksim.exogeneous_factors import ExogenousFactors
+from banksim.fire_sale import FireSaleMarket
 from banksim.strategies.central_bank_ewa_strategy import CentralBankEWAStrategy
 from banksim.util import Util
 
@@ -18,24 +21,42 @@ class CentralBank(Agent):
 
         self.insolvencyPerCycleCounter = 0
         self.insolvencyDueToContagionPerCycleCounter = 0
+        # banks found insolvent this cycle, by index
+        self.insolvent = np.zeros(model.numberBanks, dtype=bool)
 
         self.isIntelligent = is_intelligent
         if self.isIntelligent:
-            self.strategiesOptionsInformation = CentralBankEWAStrategy.central_bank_ewa_strategy_list()
+            # EWA information, in the same order as CentralBankEWAStrategy.central_bank_ewa_strategy_list()
+            number_options = CentralBankEWAStrategy.get_number_alpha_options()
+            self.strategyA = np.zeros(number_options)
+            self.strategyP = np.zeros(number_options)
+            self.strategyF = np.zeros(number_options)
+            self.strategyProfit = np.zeros(number_options)
             self.currentlyChosenStrategy = None
             self.EWADampingFactor = ewa_damping_factor
 
+    @property
+    def strategiesOptionsInformation(self):
+        # Snapshot of the EWA information, one CentralBankEWAStrategy per option
+        strategies = CentralBankEWAStrategy.central_bank_ewa_strategy_list()
+        for i, strategy in enumerate(strategies):
+            strategy.A, strategy.P, strategy.F = self.strategyA[i], self.strategyP[i], self.strategyF[i]
+            strategy.strategyProfit = self.strategyProfit[i]
+        return strategies
+
     def update_strategy_choice_probability(self):
-        list_a = np.array([0.9999 * s.A + s.strategyProfit for s in self.strategiesOptionsInformation])
-        _exp = np.exp(list_a)
-        list_p = _exp / np.sum(_exp)
-        list_f = np.cumsum(list_p)
-        for i, strategy in enumerate(self.strategiesOptionsInformation):
-            strategy.A, strategy.P, strategy.F = list_a[i], list_p[i], list_f[i]
+        list_a = 0.9999 * self.strategyA + self.strategyProfit
+        # the profit is in the order of the number of banks, so shift by the maximum to keep np.exp finite
+        _exp = np.exp(list_a - np.max(list_a))
+        self.strategyA = list_a
+        self.strategyP = _exp / np.sum(_exp)
+        self.strategyF = np.cumsum(self.strategyP)
 
     def pick_new_strategy(self):
         probability_threshold = Util.get_random_uniform(1)
-        self.currentlyChosenStrategy = [s for s in self.strategiesOptionsInformation if s.F > probability_threshold][0]
+        # first strategy whose cumulative probability is above the threshold (the last one, against rounding)
+        i = min(np.searchsorted(self.strategyF, probability_threshold, side='right'), len(self.strategyF) - 1)
+        self.currentlyChosenStrategy = CentralBankEWAStrategy(int(i))
 
     def observe_banks_capital_adequacy(self, banks):
         for bank in banks:
@@ -47,6 +68,8 @@ class CentralBank(Agent):
             if not bank.is_liquid():
                 loan_amount = self.get_discount_window_lend(bank, bank.liquidityNeeds)
                 bank.receive_discount_window_loan(loan_amount)
+                if loan_amount != 0:
+                    self.model.schedule.record_events(EventType.DiscountWindowLoan, bank.index, -loan_amount)
 
     def get_discount_window_lend(self, bank, amount_needed):
         # when should not bank be eligible for such loans?
@@ -70,25 +93,62 @@ class CentralBank(Agent):
         return False
 
     @staticmethod
-    def make_banks_sell_non_liquid_assets(banks):
-        for bank in banks:
-            if not bank.is_liquid():
-                bank.use_non_liquid_assets_to_pay_depositors_back()
+    def are_banks_too_big_to_fail(banks):
+        # one draw per bank, as is_bank_too_big_to_fail
+        if ExogenousFactors.isTooBigToFailPolicyActive:
+            random_uniform = Util.get_random_uniform(1, len(banks))
+            return random_uniform < 2 * np.array([bank.marketShare for bank in banks])
+        return np.zeros(len(banks), dtype=bool)
+
+    def make_banks_sell_non_liquid_assets(self, banks):
+        balance_sheet = BalanceSheet.stack([bank.balanceSheet for bank in banks])
+        liquidity_needs = np.array([bank.liquidityNeeds for bank in banks], dtype=float)
+        liquidity_needs, amount_sold = CentralBank.sell_non_liquid_assets(
+            balance_sheet, liquidity_needs, liquidity_needs < 0, self.model.schedule.corporate_clients)
+        self.record_events(EventType.FireSale, amount_sold)
+        balance_sheet.unstack([bank.balanceSheet for bank in banks])
+        for bank, bank_liquidity_needs in zip(banks, liquidity_needs):
+            bank.liquidityNeeds = bank_liquidity_needs
+
+    def record_events(self, event_type, amounts, banks=None):
+        # events of the banks with a positive amount, among 'banks' (a mask) if given
+        banks = amounts > 0 if banks is None else banks
+        self.model.schedule.record_events(event_type, np.flatnonzero(banks), amounts[banks])
+
+    @staticmethod
+    def sell_non_liquid_assets(balance_sheet, liquidity_needs, banks, corporate_clients):
+        # All banks sell at the same time, and the loans of their clients are reduced in proportion;
+        # returns the new liquidity needs and the face value sold by each bank
+        liquidity_needs, proportion_sold, amount_sold = FireSaleMarket.sell(balance_sheet, liquidity_needs, banks)
+        corporate_clients.scale_all_loans(1 - proportion_sold)
+        return liquidity_needs, amount_sold
 
     @staticmethod
-    def bailout(bank):
-        if not bank.is_liquid():
-            liquidity_needs = -bank.liquidityNeeds
-            bank.balanceSheet.liquidAssets += liquidity_needs
-            bank.liquidityNeeds = 0
-        if bank.is_insolvent():
-            capital_shortfall = bank.balanceSheet.capital
-            bank.balanceSheet.liquidAssets += capital_shortfall
+    def bailout(balance_sheet, liquidity_needs, banks):
+        # Masked over a stacked balance sheet; returns the new liquidity needs
+        bs = balance_sheet
+        illiquid = banks & (liquidity_needs < 0)
+        bs.liquidAssets = np.where(illiquid, bs.liquidAssets - liquidity_needs, bs.liquidAssets)
+        liquidity_needs = np.where(illiquid, 0, liquidity_needs)
+        capital_shortfall = bs.capital
+        bs.liquidAssets = np.where(banks & (capital_shortfall > 0), bs.liquidAssets + capital_shortfall,
+                                   bs.liquidAssets)
+        return liquidity_needs
 
     @staticmethod
-    def punish_illiquidity(bank):
+    def punish_illiquidity(balance_sheet, liquidity_needs, corporate_clients):
         # is there anything else to do?
-        bank.use_non_liquid_assets_to_pay_depositors_back()
+        return CentralBank.sell_non_liquid_assets(balance_sheet, liquidity_needs, liquidity_needs < 0,
+                                                  corporate_clients)
+
+    @staticmethod
+    def punish_insolvencies(balance_sheet, banks):
+        # Masked over a stacked balance sheet; returns the number of banks punished
+        insolvency_penalty = 0.5
+        bs = balance_sheet
+        bs.nonFinancialSectorLoan = np.where(banks, bs.nonFinancialSectorLoan * (1 - insolvency_penalty),
+                                             bs.nonFinancialSectorLoan)
+        return np.sum(banks, axis=-1)
 
     def punish_insolvency(self, bank):
         insolvency_penalty = 0.5
@@ -96,7 +156,9 @@ class CentralBank(Agent):
         self.insolvencyPerCycleCounter += 1
 
     def punish_contagion_insolvency(self, bank):
+        self.model.schedule.record_events(EventType.ContagionInsolvency, bank.index, bank.balanceSheet.capital)
         self.insolvencyDueToContagionPerCycleCounter += 1
+        self.insolvent[bank.index] = True
         self.punish_insolvency(bank)
 
     def calculate_final_utility(self, banks):
@@ -107,16 +169,66 @@ class CentralBank(Agent):
             potential_total_size = len(banks)
             ratio = strategy.totalLoans / potential_total_size
             strategy.strategyProfit = ratio - (potential_total_size * strategy.numberInsolvencies)
+            self.strategyProfit[strategy.alphaIndex] = strategy.strategyProfit
 
     @staticmethod
     def get_total_real_sector_loans(banks):
         return sum([bank.balanceSheet.nonFinancialSectorLoan for bank in banks])
 
+    def liquidate_insolvent_banks(self, banks):
+        balance_sheet = BalanceSheet.stack([bank.balanceSheet for bank in banks])
+        insolvent = balance_sheet.capital > 0
+        deposits = balance_sheet.deposits
+        percentage_deposits_payable = CentralBank.liquidate(balance_sheet, insolvent)
+        self.record_events(EventType.Liquidation, deposits * (percentage_deposits_payable - 1), insolvent)
+        balance_sheet.unstack([bank.balanceSheet for bank in banks])
+        depositors = self.model.schedule.depositors
+        deposit_insurer = self.model.schedule.deposit_insurer
+        if deposit_insurer is not None:
+            # claims are on the deposits before the haircuts
+            positions, payouts = deposit_insurer.pay_insured_depositors(np.flatnonzero(insolvent),
+                                                                        percentage_deposits_payable)
+        depositors.apply_haircuts(percentage_deposits_payable)
+        if deposit_insurer is not None:
+            depositors.receive_payouts(positions, payouts)
+
     @staticmethod
-    def liquidate_insolvent_banks(banks):
-        for bank in banks:
-            if bank.is_insolvent():
-                bank.liquidate()
+    def liquidate(balance_sheet, banks):
+        """
+        Bank.liquidate over the banks of a stacked balance sheet: assets are sold and liabilities resolved in
+        order of subordination. Returns the percentage of deposits payable by bank (1 if not liquidated).
+        """
+        bs = balance_sheet
+        #  first, sell assets...
+        liquid_assets = bs.liquidAssets + bs.nonFinancialSectorLoan
+        interbank_creditor = bs.interbankLoan >= 0
+        liquid_assets = np.where(interbank_creditor, liquid_assets + bs.interbankLoan, liquid_assets)
+        interbank_loan = np.where(interbank_creditor, 0, bs.interbankLoan)
+
+        # then, resolve liabilities, in order of subordination...
+
+        #  ...1st, discountWindowLoan...
+        pays_discount_window = liquid_assets > np.abs(bs.discountWindowLoan)
+        discount_window_loan = np.where(pays_discount_window, 0, bs.discountWindowLoan + liquid_assets)
+        liquid_assets = np.where(pays_discount_window, liquid_assets + bs.discountWindowLoan, 0)
+
+        # ...2nd, interbank loans...
+        interbank_debtor = interbank_loan < 0
+        pays_interbank = liquid_assets > np.abs(interbank_loan)
+        liquid_assets, interbank_loan = (
+            np.where(interbank_debtor, np.where(pays_interbank, liquid_assets + interbank_loan, 0), liquid_assets),
+            np.where(interbank_debtor, np.where(pays_interbank, 0, interbank_loan + liquid_assets), interbank_loan))
+
+        # ... finally, if there is any money left, it is proportionally divided among depositors.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentage_deposits_payable = np.where(banks, liquid_assets / np.absolute(bs.deposits), 1)
+        bs.deposits = bs.deposits * percentage_deposits_payable
+
+        bs.liquidAssets = np.where(banks, 0, bs.liquidAssets)
+        bs.nonFinancialSectorLoan = np.where(banks, 0, bs.nonFinancialSectorLoan)
+        bs.interbankLoan = np.where(banks, interbank_loan, bs.interbankLoan)
+        bs.discountWindowLoan = np.where(banks, discount_window_loan, bs.discountWindowLoan)
+        return percentage_deposits_payable
 
     @property
     def banks(self):
@@ -125,12 +237,14 @@ class CentralBank(Agent):
     def reset(self):
         self.insolvencyPerCycleCounter = 0
         self.insolvencyDueToContagionPerCycleCounter = 0
+        self.insolvent[:] = False
 
     def period_0(self):
         if self.isIntelligent:
             self.update_strategy_choice_probability()
             self.pick_new_strategy()
-            self.minimumCapitalAdequacyRatio = self.currentlyChosenStrategy.get_alpha_value()
+            self.minimumCapitalAdequacyRatio = float(
+                CentralBankEWAStrategy.get_alpha_values()[self.currentlyChosenStrategy.alphaIndex])
         if ExogenousFactors.isCapitalRequirementActive:
             self.observe_banks_capital_adequacy(self.banks)
 
@@ -140,25 +254,36 @@ class CentralBank(Agent):
             self.organize_discount_window_lending(self.banks)
         # ... if everything so far isn't enough, banks will sell illiquid assets at discount prices.
         if ExogenousFactors.banksMaySellNonLiquidAssetsAtDiscountPrices:
-            CentralBank.make_banks_sell_non_liquid_assets(self.banks)
+            self.make_banks_sell_non_liquid_assets(self.banks)
 
     def period_2(self):
-        for bank in self.banks:
-            if CentralBank.is_bank_too_big_to_fail(bank):
-                CentralBank.bailout(bank)
-            if not bank.is_liquid():
-                CentralBank.punish_illiquidity(bank)
-            if not bank.is_solvent():
-                self.punish_insolvency(bank)
+        banks = self.banks
+        corporate_clients = self.model.schedule.corporate_clients
+
+        balance_sheet = BalanceSheet.stack([bank.balanceSheet for bank in banks])
+        liquidity_needs = np.array([bank.liquidityNeeds for bank in banks], dtype=float)
+        too_big_to_fail = CentralBank.are_banks_too_big_to_fail(banks)
+        liquid_assets = balance_sheet.liquidAssets
+        liquidity_needs = CentralBank.bailout(balance_sheet, liquidity_needs, too_big_to_fail)
+        self.record_events(EventType.Bailout, balance_sheet.liquidAssets - liquid_assets)
+        # banks still illiquid sell their assets together
+        liquidity_needs, amount_sold = CentralBank.punish_illiquidity(balance_sheet, liquidity_needs, corporate_clients)
+        self.record_events(EventType.FireSale, amount_sold)
+        insolvent = balance_sheet.capital > 0
+        self.record_events(EventType.Insolvency, balance_sheet.capital, insolvent)
+        self.insolvencyPerCycleCounter += int(CentralBank.punish_insolvencies(balance_sheet, insolvent))
+        self.insolvent |= insolvent
+        balance_sheet.unstack([bank.balanceSheet for bank in banks])
+        for bank, bank_liquidity_needs in zip(banks, liquidity_needs):
+            bank.liquidityNeeds = bank_liquidity_needs
 
         if self.model.interbankLendingMarketAvailable:
-            self.model.schedule.clearing_house.interbank_contagion(self.banks, self)
+            self.model.schedule.clearing_house.interbank_contagion(banks, self)
 
-        for bank in self.banks:
+        for bank in banks:
             bank.calculate_profit(self.minimumCapitalAdequacyRatio)
 
-        self.calculate_final_utility(self.banks)
-        CentralBank.liquidate_insolvent_banks(self.banks)
+        self.calculate_final_utility(banks)
+        self.liquidate_insolvent_banks(banks)
 
-        for depositor in self.model.schedule.depositors:
-            depositor.calculate_final_utility()
+        self.model.schedule.depositors.calculate_final_utility()
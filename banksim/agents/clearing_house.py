@@ -1,7 +1,9 @@
 import numpy as np
-from mesa import Agent
 
+from banksim.core import Agent
 from banksim.exogeneous_factors import ExogenousFactors, InterbankPriority
+from banksim.kernels import Kernels
+from banksim.strategies.bank_ewa_strategy import BankEWAStrategy
 from banksim.util import Util
 
 
@@ -56,32 +58,15 @@ class ClearingHouse(Agent):
         for i, bank in enumerate(self.banksNeedingLiquidity):
             bank.interbankHelper.priorityOrder = i
 
-        iterator_lenders = iter(self.banksOfferingLiquidity)
-        iterator_borrowers = iter(self.banksNeedingLiquidity)
-
-        if len(self.banksOfferingLiquidity) > 0 and len(self.banksNeedingLiquidity) > 0:
-            lender = next(iterator_lenders)
-            borrower = next(iterator_borrowers)
-            while True:
-                try:
-                    amount_offered = lender.interbankHelper.amountLiquidityLeftToBorrowOrLend
-                    amount_requested = abs(borrower.interbankHelper.amountLiquidityLeftToBorrowOrLend)
-                    amount_lent = min(amount_offered, amount_requested)
-                    lender.interbankHelper.amountLiquidityLeftToBorrowOrLend -= amount_lent
-                    borrower.interbankHelper.amountLiquidityLeftToBorrowOrLend += amount_lent
-
-                    lender_id = (lender.unique_id - self.numberBanks) % self.numberBanks
-                    borrower_id = (borrower.unique_id - self.numberBanks) % self.numberBanks
-
-                    self.interbankLendingMatrix[lender_id, borrower_id] = amount_lent
-                    self.interbankLendingMatrix[borrower_id, lender_id] = -amount_lent
-
-                    if lender.interbankHelper.amountLiquidityLeftToBorrowOrLend == 0:
-                        lender = next(iterator_lenders)
-                    if borrower.interbankHelper.amountLiquidityLeftToBorrowOrLend == 0:
-                        borrower = next(iterator_borrowers)
-                except StopIteration:
-                    break
+        # lenders lend to borrowers in priority order, on arrays by bank index
+        all_banks = self.model.schedule.banks
+        amount_left = np.array([bank.interbankHelper.amountLiquidityLeftToBorrowOrLend for bank in all_banks],
+                               dtype=float)
+        Kernels.match_lenders_and_borrowers(np.array([bank.index for bank in self.banksOfferingLiquidity], dtype=int),
+                                            np.array([bank.index for bank in self.banksNeedingLiquidity], dtype=int),
+                                            amount_left, self.interbankLendingMatrix)
+        for bank, amount in zip(all_banks, amount_left.tolist()):
+            bank.interbankHelper.amountLiquidityLeftToBorrowOrLend = amount
 
         for bank in banks:
             bank.balanceSheet.interbankLoan = self.get_interbank_market_position(bank)
@@ -98,14 +83,18 @@ class ClearingHouse(Agent):
             bank.liquidityNeeds = bank.interbankHelper.amountLiquidityLeftToBorrowOrLend
 
     def get_interbank_market_position(self, bank):
-        bank_id_adjusted = (bank.unique_id - self.numberBanks) % self.numberBanks
-        return np.sum(self.interbankLendingMatrix[bank_id_adjusted, :])
+        return np.sum(self.interbankLendingMatrix[bank.index, :])
+
+    def get_interbank_market_positions(self):
+        # positions of all banks, by index
+        return np.sum(self.interbankLendingMatrix, axis=1)
 
     def sort_queues_by_risk(self, simulation, bank_id_simulating, strategy_simulated):
 
         def bank_to_alpha_beta(_bank):
             strategy = _bank.interbankHelper.riskSorting
-            return strategy.get_alpha_value(), strategy.get_beta_value()
+            return BankEWAStrategy.get_alpha_values()[strategy.alphaIndex], \
+                BankEWAStrategy.get_beta_values()[strategy.betaIndex]
 
         for bank in self.banksOfferingLiquidity:
             if simulation and bank.unique_id == bank_id_simulating:
@@ -119,8 +108,10 @@ class ClearingHouse(Agent):
             else:
                 bank.interbankHelper.riskSorting = bank.currentlyChosenStrategy
 
-        self.banksOfferingLiquidity.sort(key=bank_to_alpha_beta).reverse()
-        self.banksNeedingLiquidity.sort(key=bank_to_alpha_beta).reverse()
+        self.banksOfferingLiquidity.sort(key=bank_to_alpha_beta)
+        self.banksOfferingLiquidity.reverse()
+        self.banksNeedingLiquidity.sort(key=bank_to_alpha_beta)
+        self.banksNeedingLiquidity.reverse()
 
     def interbank_clearing_guarantee(self, banks):
         self.calculate_total_and_biggest_interbank_debt(banks)
@@ -191,33 +182,32 @@ class ClearingHouse(Agent):
     def interbank_contagion(self, banks, central_bank):
         self.reset_vetor_recuperacao()
         for bank in banks:
-
-            bank_id = (bank.unique_id - self.numberBanks) % self.numberBanks
-
             if not bank.is_solvent() and bank.is_interbank_debtor():
                 if self.clearingGuaranteeAvailable:
                     _max = max(0, -self.totalCollateralDeficit - self.totalCollateralSurplus)
-                    self.vetor_recuperacao[bank_id] = (self.totalInterbankDebt + _max) / self.totalInterbankDebt
+                    self.vetor_recuperacao[bank.index] = (self.totalInterbankDebt + _max) / self.totalInterbankDebt
                 else:
-                    self.vetor_recuperacao[bank_id] = (bank.balanceSheet.interbankLoan + min(
+                    self.vetor_recuperacao[bank.index] = (bank.balanceSheet.interbankLoan + min(
                         -bank.balanceSheet.interbankLoan,
                         bank.balanceSheet.capital)) / bank.balanceSheet.interbankLoan
 
-        for i in range(self.numberBanks):
-            for j in range(i, self.numberBanks):
-                self.interbankLendingMatrix[i, j] *= self.vetor_recuperacao[j]
-                self.interbankLendingMatrix[j, i] = -self.interbankLendingMatrix[i, j]
+        # Lenders (positive entries) recover what their borrower (column) can pay back,
+        # and borrowers (negative entries) owe what they themselves (row) can pay back.
+        matrix = self.interbankLendingMatrix
+        matrix[:, :] = np.where(matrix > 0, matrix * self.vetor_recuperacao[np.newaxis, :],
+                                matrix * self.vetor_recuperacao[:, np.newaxis])
 
+        positions = self.get_interbank_market_positions()
         for bank in banks:
-            bank_id = (bank.unique_id - self.numberBanks) % self.numberBanks
-            bank.balanceSheet.interbankLoan = np.sum(self.interbankLendingMatrix[bank_id, :])
+            bank.balanceSheet.interbankLoan = positions[bank.index]
             if bank.is_insolvent():
                 central_bank.punish_contagion_insolvency(bank)
 
     def accrue_interest(self, banks, interbank_rate):
         np.multiply(self.interbankLendingMatrix, (1 + interbank_rate), out=self.interbankLendingMatrix)
+        positions = self.get_interbank_market_positions()
         for bank in banks:
-            bank.balanceSheet.interbankLoan = self.get_interbank_market_position(bank)
+            bank.balanceSheet.interbankLoan = positions[bank.index]
 
     def period_0(self):
         pass
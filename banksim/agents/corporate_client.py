@@ -1,39 +1,93 @@
-from mesa import Agent
+import numpy as np
 
+from banksim.core import Agent
 from banksim.util import Util
 
 
-class CorporateClient(Agent):
+class CorporateClientPopulation:
+    """
+    State of every corporate client (firm) in the economy, kept in preallocated arrays.
 
-    def __init__(self, default_rate, loss_given_default, loan_interest_rate, bank, model):
-        super().__init__(Util.get_unique_id(), model)
+    Firms are stored contiguously by bank: bank i owns the positions [offsets[i], offsets[i + 1]).
+    The population takes part in the schedule as a single agent, and CorporateClient objects are only
+    created on demand (e.g. for visualization or inspection).
+    """
 
-        # Bank Reference
-        self.bank = bank
+    def __init__(self, number_corporate_clients_per_bank, default_rate, loss_given_default, loan_interest_rate,
+                 model):
+        self.model = model
+        self.offsets = Util.get_offsets(number_corporate_clients_per_bank)
+        self.numberCorporateClients = int(self.offsets[-1])
+        self.bankIndex = np.repeat(np.arange(len(number_corporate_clients_per_bank)),
+                                   number_corporate_clients_per_bank)
 
-        self.loanAmount = 0
-        self.percentageRepaid = 0
+        self.loanAmount = np.zeros(self.numberCorporateClients)
+        self.percentageRepaid = np.zeros(self.numberCorporateClients)
 
         self.probabilityOfDefault = default_rate
         self.lossGivenDefault = loss_given_default
         self.loanInterestRate = loan_interest_rate
 
-    def pay_loan_back(self, simulation=False):
+        self._agents = [None] * self.numberCorporateClients
+
+    def __len__(self):
+        return self.numberCorporateClients
+
+    def __getitem__(self, index):
+        if self._agents[index] is None:
+            self._agents[index] = CorporateClient(self, index, self.model)
+        return self._agents[index]
+
+    def __iter__(self):
+        return (self[i] for i in range(self.numberCorporateClients))
+
+    def get_slice(self, bank_index):
+        return slice(self.offsets[bank_index], self.offsets[bank_index + 1])
+
+    def get_bank_agents(self, bank_index):
+        _slice = self.get_slice(bank_index)
+        return [self[i] for i in range(_slice.start, _slice.stop)]
+
+    def grant_loans(self, bank_index, amount):
+        self.loanAmount[self.get_slice(bank_index)] = amount
+
+    def scale_loans(self, bank_index, factor):
+        _slice = self.get_slice(bank_index)
+        original_loan_amount = self.loanAmount[_slice].copy()
+        self.loanAmount[_slice] *= factor
+        # total reduction of the loans
+        return Util.ordered_sum(original_loan_amount - self.loanAmount[_slice])
+
+    def scale_all_loans(self, factors):
+        # one factor per bank
+        self.loanAmount *= factors[self.bankIndex]
+
+    def get_first_loan_amount(self, bank_index):
+        return self.loanAmount[self.offsets[bank_index]]
+
+    def get_total_loans(self, bank_index):
+        return Util.ordered_sum(self.loanAmount[self.get_slice(bank_index)])
+
+    def pay_loans_back(self, bank_index, simulation=False):
+        _slice = self.get_slice(bank_index)
+        loan_amount = self.loanAmount[_slice]
         if simulation:
             # if under simulation, assume last percetageRepaid used
-            amount_paid = self.percentageRepaid * self.loanAmount
+            amount_paid = self.percentageRepaid[_slice] * loan_amount
         else:
-            amount_paid = self.loanAmount * (1 - self.lossGivenDefault) \
-                if Util.get_random_uniform(1) <= self.probabilityOfDefault \
-                else self.loanAmount * (1 + self.loanInterestRate)
-            self.percentageRepaid = 0 if self.loanAmount == 0 else amount_paid / self.loanAmount
+            defaulted = Util.get_random_uniform(1, len(loan_amount)) <= self.probabilityOfDefault
+            amount_paid = np.where(defaulted,
+                                   loan_amount * (1 - self.lossGivenDefault),
+                                   loan_amount * (1 + self.loanInterestRate))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.percentageRepaid[_slice] = np.where(loan_amount == 0, 0, amount_paid / loan_amount)
 
-        self.loanAmount = amount_paid
-        return amount_paid
+        self.loanAmount[_slice] = amount_paid
+        return Util.ordered_sum(amount_paid)
 
     def reset(self):
-        self.loanAmount = 0
-        self.percentageRepaid = 0
+        self.loanAmount[:] = 0
+        self.percentageRepaid[:] = 0
 
     def period_0(self):
         pass
@@ -43,3 +97,38 @@ class CorporateClient(Agent):
 
     def period_2(self):
         pass
+
+
+class CorporateClient(Agent):
+    """
+    View of a single corporate client of a CorporateClientPopulation, created on demand.
+    """
+
+    def __init__(self, population, index, model):
+        super().__init__(Util.get_unique_id(), model)
+        self.population = population
+        self.index = index
+
+    @property
+    def bank(self):
+        return self.model.schedule.banks[self.population.bankIndex[self.index]]
+
+    @property
+    def loanAmount(self):
+        return self.population.loanAmount[self.index]
+
+    @property
+    def percentageRepaid(self):
+        return self.population.percentageRepaid[self.index]
+
+    @property
+    def probabilityOfDefault(self):
+        return self.population.probabilityOfDefault
+
+    @property
+    def lossGivenDefault(self):
+        return self.population.lossGivenDefault
+
+    @property
+    def loanInterestRate(self):
+        return self.population.loanInterestRate
@@ -0,0 +1,100 @@
+import numpy as np
+
+from banksim.core import Agent
+from banksim.events import EventType
+from banksim.util import Util
+
+
+class DepositInsurer(Agent):
+    """
+    Deposit insurance fund, financed by the banks and paying the insured depositors of liquidated banks.
+
+    Each cycle, every bank pays a premium on its insured deposits (each deposit up to 'coverage'), at
+    'premium_rate' plus up to 'risk_premium_rate' as its capital adequacy ratio falls below
+    'capital_benchmark'. When banks are liquidated, the fund pays their depositors the insured part of what
+    they lose. If the claims exceed the fund, each one is paid in the same proportion and the fund is
+    insolvent for the cycle: its balance never goes negative, and the rest is left unpaid.
+    """
+
+    def __init__(self, coverage, premium_rate, risk_premium_rate, capital_benchmark, initial_balance, model):
+        super().__init__(Util.get_unique_id(), model)
+
+        self.coverage = coverage
+        self.premiumRate = premium_rate
+        self.riskPremiumRate = risk_premium_rate
+        self.capitalBenchmark = capital_benchmark
+
+        self.fundBalance = initial_balance
+        self.totalPremiums = 0
+        self.totalPayouts = 0
+        # cycles in which the fund could not pay every claim
+        self.insolvencyCounter = 0
+
+        # this cycle
+        self.premiumsCollected = 0
+        self.payouts = 0
+        self.unpaidClaims = 0
+
+    def get_premium_rates(self, capital_adequacy_ratio):
+        shortfall = np.clip(1 - np.asarray(capital_adequacy_ratio) / self.capitalBenchmark, 0, 1)
+        return self.premiumRate + self.riskPremiumRate * shortfall
+
+    def get_insured_deposits(self, depositors, number_banks):
+        # insured deposits of every bank
+        return Util.sum_by_group(np.minimum(depositors.deposit, self.coverage), depositors.bankIndex, number_banks)
+
+    def collect_premiums(self, banks):
+        capital_adequacy_ratio = np.array([bank.get_capital_adequacy_ratio() for bank in banks], dtype=float)
+        premiums = self.get_premium_rates(capital_adequacy_ratio) * \
+            self.get_insured_deposits(self.model.schedule.depositors, len(banks))
+        for bank, premium in zip(banks, premiums):
+            bank.balanceSheet.liquidAssets -= premium
+        self.premiumsCollected = float(np.sum(premiums))
+        self.totalPremiums += self.premiumsCollected
+        self.fundBalance += self.premiumsCollected
+
+    def pay_insured_depositors(self, banks, percentage_deposits_payable):
+        """
+        Claims of the depositors of the liquidated 'banks' (indices), on their deposits before the haircuts
+        (percentage_deposits_payable, by bank). Only the depositors of those banks are looked at. Returns the
+        positions of the depositors and what the fund pays each of them.
+        """
+        depositors = self.model.schedule.depositors
+        positions = Util.get_positions(depositors.offsets, banks)
+        bank_index = depositors.bankIndex[positions]
+        losses = np.maximum(1 - percentage_deposits_payable[bank_index], 0)
+        claims = np.minimum(depositors.deposit[positions], self.coverage) * losses
+
+        total_claims = float(np.sum(claims))
+        if total_claims > self.fundBalance:
+            payouts = claims * (self.fundBalance / total_claims)
+            self.insolvencyCounter += 1
+        else:
+            payouts = claims
+        self.payouts = float(np.sum(payouts))
+        self.unpaidClaims = total_claims - self.payouts
+        self.totalPayouts += self.payouts
+        self.fundBalance = max(self.fundBalance - self.payouts, 0)
+
+        bank_payouts = Util.sum_by_group(payouts, bank_index, len(percentage_deposits_payable))[banks]
+        self.model.schedule.record_events(EventType.DepositInsurancePayout, banks, bank_payouts)
+        return positions, payouts
+
+    def is_solvent(self):
+        return self.unpaidClaims == 0
+
+    def reset(self):
+        self.premiumsCollected = 0
+        self.payouts = 0
+        self.unpaidClaims = 0
+
+    def period_0(self):
+        # banks have set up their balance sheets by now
+        self.collect_premiums(self.model.schedule.banks)
+
+    def period_1(self):
+        pass
+
+    def period_2(self):
+        # payouts are made by the central bank, when it liquidates banks
+        pass
@@ -1,106 +1,250 @@
-import math
-
 import numpy as np
-from mesa import Agent
 
+from banksim.agents.bank import BalanceSheet
+from banksim.bank_run import SequentialBankRun
+from banksim.core import Agent
+from banksim.events import EventType
 from banksim.exogeneous_factors import ExogenousFactors
 from banksim.strategies.depositor_ewa_strategy import DepositorEWAStrategy
 from banksim.util import Util
 
 
-class Depositor(Agent):
-
-    def __init__(self, is_intelligent, ewa_damping_factor, bank, model):
-        super().__init__(Util.get_unique_id(), model)
+class DepositorPopulation:
+    """
+    State of every depositor in the economy, kept in preallocated arrays.
 
-        # Bank Reference
-        self.bank = bank
+    Depositors are stored contiguously by bank: bank i owns the positions [offsets[i], offsets[i + 1]).
+    The population takes part in the schedule as a single agent, and Depositor objects are only created
+    on demand (e.g. for visualization or inspection).
+    """
 
-        self.amountEarlyWithdraw = 0
-        self.amountFinalWithdraw = 0
-        self.safetyTreshold = 0
+    def __init__(self, number_depositors_per_bank, is_intelligent, ewa_damping_factor, model):
+        self.model = model
+        self.offsets = Util.get_offsets(number_depositors_per_bank)
+        self.numberDepositors = int(self.offsets[-1])
+        self.bankIndex = np.repeat(np.arange(len(number_depositors_per_bank)), number_depositors_per_bank)
 
-        self.initialDeposit = Deposit()
-        self.deposit = self.initialDeposit
+        n = self.numberDepositors
+        self.initialDeposit = np.zeros(n)
+        self.deposit = np.zeros(n)
+        self.lastPercentageWithdrawn = np.zeros(n)
+        self.amountEarlyWithdraw = np.zeros(n)
+        self.amountFinalWithdraw = np.zeros(n)
+        self.safetyTreshold = np.zeros(n)
+        # fraction of their deposits the depositors of each bank withdraw at least, set by a stress test
+        self.withdrawalSpike = None
 
         self.isIntelligent = is_intelligent
         if self.isIntelligent:
-            self.strategiesOptionsInformation = DepositorEWAStrategy.depositor_ewa_strategy_list()
-            self.currentlyChosenStrategy = None
+            number_options = DepositorEWAStrategy.get_number_alpha_options()
             self.EWADampingFactor = ewa_damping_factor
+            # EWA information, one row per depositor and one column per strategy
+            self.strategyA = np.zeros((n, number_options))
+            self.strategyP = np.zeros((n, number_options))
+            self.strategyProfit = np.zeros((n, number_options))
+            self.strategyInsolvencyCounter = np.zeros((n, number_options), dtype=np.int64)
+            self.currentlyChosenStrategy = np.zeros(n, dtype=np.int64)
+
+        self._agents = [None] * n
+
+    def __len__(self):
+        return self.numberDepositors
+
+    def __getitem__(self, index):
+        if self._agents[index] is None:
+            self._agents[index] = Depositor(self, index, self.model)
+        return self._agents[index]
+
+    def __iter__(self):
+        return (self[i] for i in range(self.numberDepositors))
+
+    def get_slice(self, bank_index):
+        return slice(self.offsets[bank_index], self.offsets[bank_index + 1])
+
+    def get_bank_agents(self, bank_index):
+        _slice = self.get_slice(bank_index)
+        return [self[i] for i in range(_slice.start, _slice.stop)]
 
     def update_strategy_choice_probability(self):
-        list_a = np.array([s.A + s.strategyProfit for s in self.strategiesOptionsInformation])
+        list_a = self.strategyA + self.strategyProfit
         _exp = np.exp(list_a)
-        list_p = _exp / np.sum(_exp)
-        list_f = np.cumsum(list_p)
-        for i, strategy in enumerate(self.strategiesOptionsInformation):
-            strategy.A, strategy.P, strategy.F = list_a[i], list_p[i], list_f[i]
+        self.strategyA = list_a
+        self.strategyP = _exp / np.sum(_exp, axis=1, keepdims=True)
 
     def pick_new_strategy(self):
-        probability_threshold = Util.get_random_uniform(1)
-        self.currentlyChosenStrategy = [s for s in self.strategiesOptionsInformation if s.F > probability_threshold][0]
-
-    def make_deposit(self, amount):
-        self.initialDeposit.amount = amount
-        self.deposit = Deposit(amount, self.initialDeposit.lastPercentageWithdrawn)
-
-    def withdraw_deposit(self, simulation=False):
-        if self.isIntelligent:
-            # Smart depositor
-            bank_car = self.bank.get_capital_adequacy_ratio()
-            shock = 0 if bank_car > self.safetyTreshold else ExogenousFactors.amountWithdrawn
+        probability_threshold = Util.get_random_uniform(1, self.numberDepositors)
+        list_f = np.cumsum(self.strategyP, axis=1)
+        # first strategy whose cumulative probability is above the threshold
+        chosen = np.sum(list_f <= probability_threshold[:, np.newaxis], axis=1)
+        self.currentlyChosenStrategy = np.minimum(chosen, DepositorEWAStrategy.get_number_alpha_options() - 1)
+
+    def make_deposits(self, bank_index, amount):
+        _slice = self.get_slice(bank_index)
+        self.initialDeposit[_slice] = amount
+        self.deposit[_slice] = amount
+        self.lastPercentageWithdrawn[_slice] = 0
+
+    def withdraw_deposits(self, banks):
+        if self.isIntelligent and ExogenousFactors.areBankRunsSequential:
+            shock = self.get_sequential_shock(banks)
+        elif self.isIntelligent:
+            # Smart depositors
+            bank_car = np.array([bank.get_capital_adequacy_ratio() for bank in banks])[self.bankIndex]
+            shock = np.where(bank_car > self.safetyTreshold, 0, ExogenousFactors.amountWithdrawn)
         else:
-            if simulation:
-                # if in simulation, uses last real withdrawal by this depositor
-                shock = self.deposit.lastPercentageWithdrawn
-            else:
-                # Simulating a Diamond & Dribvig banksim...
-                shock = ExogenousFactors.amountWithdrawn if Util.get_random_uniform(
-                    1) < ExogenousFactors.probabilityofWithdrawal else 0
-        self.deposit.lastPercentageWithdrawn = shock
-        amount_depositor_wish_to_withdraw = self.deposit.amount * shock
-        amount_withdrawn = self.bank.withdraw_deposit(amount_depositor_wish_to_withdraw)
-        self.deposit.amount -= amount_withdrawn
-        self.amountEarlyWithdraw = amount_withdrawn
+            # Simulating a Diamond & Dribvig banksim...
+            random_uniform = Util.get_random_uniform(1, self.numberDepositors)
+            shock = np.where(random_uniform < ExogenousFactors.probabilityofWithdrawal,
+                             ExogenousFactors.amountWithdrawn, 0)
+        if self.withdrawalSpike is not None:
+            shock = np.maximum(shock, self.withdrawalSpike[self.bankIndex])
+        self.withdraw(shock, banks)
+
+    def get_sequential_shock(self, banks):
+        # Depositors of each bank decide in random order, seeing the withdrawals of those before them
+        bank_run = SequentialBankRun.from_balance_sheet(
+            BalanceSheet.stack([bank.balanceSheet for bank in banks]),
+            np.array([bank.get_real_sector_risk_weighted_assets() for bank in banks], dtype=float))
+        order = SequentialBankRun.get_order(Util.get_random_uniform(1, self.numberDepositors), self.bankIndex)
+        withdraws = np.zeros(self.numberDepositors, dtype=bool)
+        withdraws[order] = bank_run.get_withdrawals(self.bankIndex[order],
+                                                    self.deposit[order] * ExogenousFactors.amountWithdrawn,
+                                                    self.safetyTreshold[order])
+        return np.where(withdraws, ExogenousFactors.amountWithdrawn, 0)
+
+    def withdraw(self, shock, banks):
+        # shock is the fraction of its deposit each depositor withdraws
+        self.lastPercentageWithdrawn[:] = shock
+        amount_withdrawn = self.deposit * shock
+        self.deposit -= amount_withdrawn
+        self.amountEarlyWithdraw[:] = amount_withdrawn
+
+        number_withdrawals = np.bincount(self.bankIndex[amount_withdrawn > 0], minlength=len(banks))
+        total_withdrawn = Util.sum_by_group(amount_withdrawn, self.bankIndex, len(banks))
+        for bank, count, total in zip(banks, number_withdrawals, total_withdrawn):
+            bank.withdraw_deposits(total, count)
+        # a run, as judged by Bank.calculate_profit
+        bank_run = number_withdrawals > np.diff(self.offsets) / 2
+        self.model.schedule.record_events(EventType.BankRun, np.flatnonzero(bank_run), total_withdrawn[bank_run])
+
+    def accrue_interest(self, bank_index, deposits_interest_rate):
+        self.deposit[self.get_slice(bank_index)] *= deposits_interest_rate
+
+    def apply_haircut(self, bank_index, percentage_deposits_payable):
+        self.deposit[self.get_slice(bank_index)] *= percentage_deposits_payable
+
+    def apply_haircuts(self, percentage_deposits_payable):
+        # one percentage per bank
+        self.deposit *= percentage_deposits_payable[self.bankIndex]
+
+    def receive_payouts(self, positions, payouts):
+        # from the deposit insurance fund
+        self.deposit[positions] += payouts
 
     def calculate_final_utility(self):
         if self.isIntelligent:
+            rows = np.arange(self.numberDepositors)
             strategy = self.currentlyChosenStrategy
-            self.amountFinalWithdraw = self.deposit.amount
+            self.amountFinalWithdraw[:] = self.deposit
             final_consumption = self.amountEarlyWithdraw + self.amountFinalWithdraw
 
-            if final_consumption < self.initialDeposit.amount:
-                if ExogenousFactors.isDepositInsuranceAvailable:
-                    final_consumption = self.initialDeposit.amount * (1 + ExogenousFactors.depositInterestRate)
-                else:
-                    strategy.insolvencyCounter += 1
+            lost_money = final_consumption < self.initialDeposit
+            # with a deposit insurance fund, depositors only get what the fund pays them
+            if ExogenousFactors.isDepositInsuranceAvailable and not ExogenousFactors.isDepositInsuranceFundActive:
+                final_consumption = np.where(
+                    lost_money, self.initialDeposit * (1 + ExogenousFactors.depositInterestRate), final_consumption)
+            else:
+                self.strategyInsolvencyCounter[rows[lost_money], strategy[lost_money]] += 1
 
-            amount = self.initialDeposit.amount
-            profit = 100 * math.log(final_consumption / amount)
-            strategy.finalConsumption = final_consumption
-            strategy.strategyProfit = profit
-            strategy.amountEarlyWithdraw = self.amountEarlyWithdraw
-            strategy.amountFinalWithdraw = self.amountFinalWithdraw
+            # a depositor who lost everything gets an infinitely bad profit instead of a math domain error
+            with np.errstate(divide='ignore'):
+                profit = 100 * np.log(final_consumption / self.initialDeposit)
+            self.strategyProfit[rows, strategy] = profit
 
     def reset(self):
-        self.deposit = self.initialDeposit
+        self.deposit[:] = self.initialDeposit
+        self.lastPercentageWithdrawn[:] = 0
 
     def period_0(self):
         if self.isIntelligent:
             self.update_strategy_choice_probability()
             self.pick_new_strategy()
-            self.safetyTreshold = self.currentlyChosenStrategy.get_alpha_value()
+            self.safetyTreshold[:] = DepositorEWAStrategy.get_alpha_values()[self.currentlyChosenStrategy]
 
     def period_1(self):
         #  Liquidity Shock
         if ExogenousFactors.areBankRunsPossible:
-            self.withdraw_deposit()
+            self.withdraw_deposits(self.model.schedule.banks)
+        elif self.withdrawalSpike is not None:
+            self.withdraw(self.withdrawalSpike[self.bankIndex], self.model.schedule.banks)
 
     def period_2(self):
         pass
 
 
+class Depositor(Agent):
+    """
+    View of a single depositor of a DepositorPopulation, created on demand.
+    """
+
+    def __init__(self, population, index, model):
+        super().__init__(Util.get_unique_id(), model)
+        self.population = population
+        self.index = index
+
+    @property
+    def bank(self):
+        return self.model.schedule.banks[self.population.bankIndex[self.index]]
+
+    @property
+    def isIntelligent(self):
+        return self.population.isIntelligent
+
+    @property
+    def initialDeposit(self):
+        return Deposit(self.population.initialDeposit[self.index])
+
+    @property
+    def deposit(self):
+        return Deposit(self.population.deposit[self.index], self.population.lastPercentageWithdrawn[self.index])
+
+    @property
+    def amountEarlyWithdraw(self):
+        return self.population.amountEarlyWithdraw[self.index]
+
+    @property
+    def amountFinalWithdraw(self):
+        return self.population.amountFinalWithdraw[self.index]
+
+    @property
+    def safetyTreshold(self):
+        return self.population.safetyTreshold[self.index]
+
+    @property
+    def strategiesOptionsInformation(self):
+        return np.array([self.get_strategy(a) for a in range(DepositorEWAStrategy.get_number_alpha_options())],
+                        dtype=DepositorEWAStrategy)
+
+    @property
+    def currentlyChosenStrategy(self):
+        return self.get_strategy(self.population.currentlyChosenStrategy[self.index])
+
+    def get_strategy(self, alpha_index):
+        # Snapshot of the EWA information of one strategy
+        population, i = self.population, self.index
+        strategy = DepositorEWAStrategy(alpha_index)
+        strategy.A = population.strategyA[i, alpha_index]
+        strategy.P = population.strategyP[i, alpha_index]
+        strategy.F = np.sum(population.strategyP[i, :alpha_index + 1])
+        strategy.strategyProfit = population.strategyProfit[i, alpha_index]
+        strategy.insolvencyCounter = population.strategyInsolvencyCounter[i, alpha_index]
+        if alpha_index == population.currentlyChosenStrategy[i]:
+            strategy.amountEarlyWithdraw = self.amountEarlyWithdraw
+            strategy.amountFinalWithdraw = self.amountFinalWithdraw
+            strategy.finalConsumption = self.amountEarlyWithdraw + self.amountFinalWithdraw
+        return strategy
+
+
 class Deposit:
     def __init__(self, amount=0, last_percentage_withdrawn=0):
         self.amount = amount
@@ -0,0 +1,96 @@
+import numpy as np
+
+from banksim.exogeneous_factors import ExogenousFactors
+
+
+class SequentialBankRun:
+    """
+    Withdrawals of intelligent depositors who decide one after the other, each seeing the capital adequacy
+    ratio of its bank after paying back those before it.
+
+    A bank pays withdrawals out of its liquid assets and, once they are used up, sells loans at a discount
+    (illiquidAssetDiscountRate), so its ratio falls with every withdrawal beyond its liquid assets, and that
+    can push the next depositors below their safety thresholds: a run feeds on itself.
+
+    The decisions are found for all banks at once by passes over the depositors in decision order: a pass
+    takes the cumulative withdrawals (by bank) of the decisions of the previous pass and compares the ratio
+    they leave with every threshold. The first pass gives the independent decisions of the simultaneous
+    mode, every pass settles at least one more depositor of each bank, and a cascade usually settles within
+    a pass per wave of withdrawals, so the work is a few vector operations over the depositors.
+
+    Bank arrays may have leading axes (e.g. the replications of a BankingEnsemble): they are flattened,
+    and depositors refer to banks by their position in the flattened arrays.
+    """
+
+    def __init__(self, liquid_assets, loans, capital, real_sector_risk_weighted_assets,
+                 interbank_risk_weighted_assets, discount_rate=None):
+        self.liquidAssets = np.ravel(liquid_assets)
+        self.loans = np.ravel(loans)
+        self.capital = np.ravel(capital)
+        self.realSectorRiskWeightedAssets = np.ravel(real_sector_risk_weighted_assets)
+        self.interbankRiskWeightedAssets = np.ravel(interbank_risk_weighted_assets)
+        self.discountRate = ExogenousFactors.illiquidAssetDiscountRate if discount_rate is None else discount_rate
+
+    @classmethod
+    def from_balance_sheet(cls, balance_sheet, real_sector_risk_weighted_assets):
+        return cls(*cls.get_bank_data(balance_sheet, real_sector_risk_weighted_assets))
+
+    @staticmethod
+    def get_bank_data(balance_sheet, real_sector_risk_weighted_assets):
+        # What depositors see of each bank, one array per argument of SequentialBankRun
+        interbank_loan = np.asarray(balance_sheet.interbankLoan)
+        return (balance_sheet.liquidAssets, balance_sheet.nonFinancialSectorLoan, balance_sheet.capital,
+                real_sector_risk_weighted_assets,
+                np.where(interbank_loan >= 0, interbank_loan * ExogenousFactors.InterbankLoanRiskWeight, 0))
+
+    def get_capital_adequacy_ratio(self, banks, withdrawn):
+        """
+        Ratio of banks[i] after paying withdrawn[i] back, as Bank.get_capital_adequacy_ratio would give it.
+        """
+        liquid_assets = self.liquidAssets[banks]
+        loans = self.loans[banks]
+        # loans sold at a discount for what the liquid assets do not cover
+        loans_sold = np.minimum(np.maximum(withdrawn - liquid_assets, 0) * (1 + self.discountRate), loans)
+        capital = self.capital[banks] + loans_sold * (self.discountRate / (1 + self.discountRate))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loans_left = np.where(loans > 0, 1 - loans_sold / loans, 1)
+        liquid_assets_left = liquid_assets - np.minimum(withdrawn, np.maximum(liquid_assets, 0))
+        total_risk_weighted_assets = liquid_assets_left * ExogenousFactors.CashRiskWeight + \
+            self.realSectorRiskWeightedAssets[banks] * loans_left + self.interbankRiskWeightedAssets[banks]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            capital_adequacy_ratio = -capital / total_risk_weighted_assets
+        return np.where((capital <= 0) & (total_risk_weighted_assets != 0), capital_adequacy_ratio, 0)
+
+    @staticmethod
+    def get_amount_withdrawn_before(banks, amounts):
+        # Withdrawals of the depositors before each one at its bank (banks sorted), by cumulative sums
+        cumulative = np.cumsum(amounts)
+        first = np.flatnonzero(np.r_[True, banks[1:] != banks[:-1]])
+        before_bank = cumulative[first] - amounts[first]
+        before = cumulative - amounts - np.repeat(before_bank, np.diff(np.r_[first, len(banks)]))
+        return np.maximum(before, 0)
+
+    def get_withdrawals(self, banks, amounts, safety_treshold):
+        """
+        Which depositors withdraw. Depositors are given in decision order and sorted by bank, with the
+        amount each one would withdraw and its safety threshold: it withdraws if the ratio of its bank
+        after the withdrawals before it is not above the threshold.
+        """
+        number_depositors = len(banks)
+        withdraws = np.zeros(number_depositors, dtype=bool)
+        if number_depositors == 0:
+            return withdraws
+        # the decisions of the first k depositors of every bank are final after k passes
+        maximum_passes = int(np.max(np.bincount(banks))) + 1
+        for _ in range(maximum_passes):
+            withdrawn = SequentialBankRun.get_amount_withdrawn_before(banks, np.where(withdraws, amounts, 0))
+            decisions = self.get_capital_adequacy_ratio(banks, withdrawn) <= safety_treshold
+            if np.array_equal(decisions, withdraws):
+                break
+            withdraws = decisions
+        return withdraws
+
+    @staticmethod
+    def get_order(random_uniform, banks):
+        # Decision order: depositors sorted by bank and, within a bank, by a uniform draw each
+        return np.lexsort((random_uniform, banks))
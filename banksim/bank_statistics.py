@@ -0,0 +1,155 @@
+import numpy as np
+
+from banksim.agents.bank import BalanceSheet
+from banksim.strategies.bank_ewa_strategy import BankEWAStrategy
+
+
+class RunningMoments:
+    """
+    Count, mean, variance, minimum and maximum of a stream of arrays of a given shape, element by element,
+    in O(shape) memory: Welford's update, generalized to batches and to merging accumulators (Chan et al.),
+    so that accumulators of different replications or processes combine into the moments of all their
+    observations.
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+
+    def update(self, values):
+        # one observation of the given shape, or a batch of them along a leading axis
+        values = np.asarray(values, dtype=float)
+        if values.ndim == self.mean.ndim:
+            values = values[np.newaxis]
+        batch_mean = np.mean(values, axis=0)
+        batch_m2 = np.sum((values - batch_mean) ** 2, axis=0) if len(values) > 1 else 0
+        self.add(len(values), batch_mean, batch_m2, np.min(values, axis=0), np.max(values, axis=0))
+
+    def merge(self, other):
+        self.add(other.count, other.mean, other.m2, other.minimum, other.maximum)
+
+    def add(self, count, mean, m2, minimum, maximum):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / total)
+        self.count = total
+        self.minimum = np.minimum(self.minimum, minimum)
+        self.maximum = np.maximum(self.maximum, maximum)
+
+    @property
+    def variance(self):
+        # sample variance, nan with fewer than two observations
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+        return self.m2 / (self.count - 1)
+
+    @property
+    def standardDeviation(self):
+        return np.sqrt(self.variance)
+
+
+class BankStatistics:
+    """
+    Distribution of the state of every bank over a run, for runs too long to keep time series: mean,
+    standard deviation, minimum and maximum of the capital, capital adequacy ratio, liquidity needs and
+    interbank position at the end of each cycle, how often the bank failed, and how many cycles it spent
+    in each strategy (intelligent banks only).
+
+    update(model) takes the banks of a BankingModel or BankingEnsemble after each cycle, as a few array
+    operations over all banks; the replications of an ensemble are pooled, bank by bank. Memory is
+    O(banks * strategies), whatever the number of cycles, and statistics of other replications or
+    processes (of the same number of banks) can be merged in.
+    """
+
+    fields = ('capital', 'capitalAdequacyRatio', 'liquidityNeeds', 'interbankPosition')
+
+    def __init__(self, number_banks, number_strategies=0):
+        self.numberBanks = number_banks
+        self.moments = RunningMoments((len(BankStatistics.fields), number_banks))
+        self.failures = np.zeros(number_banks, dtype=np.int64)
+        self.strategyCycles = np.zeros((number_banks, number_strategies), dtype=np.int64)
+
+    @property
+    def numberObservations(self):
+        # cycles observed, times replications for ensembles
+        return self.moments.count
+
+    def observe(self, capital, capital_adequacy_ratio, liquidity_needs, interbank_position, failed, strategy=None):
+        """
+        State of the banks at the end of a cycle, given by bank, or by replication and bank.
+        """
+        self.moments.update(np.stack([capital, capital_adequacy_ratio, liquidity_needs, interbank_position],
+                                     axis=-2))
+        failed = np.asarray(failed, dtype=bool).reshape(-1, self.numberBanks)
+        self.failures += np.sum(failed, axis=0)
+        if strategy is not None and self.strategyCycles.shape[1] > 0:
+            strategy = np.asarray(strategy).reshape(-1, self.numberBanks)
+            banks = np.broadcast_to(np.arange(self.numberBanks), strategy.shape)
+            np.add.at(self.strategyCycles, (banks.ravel(), strategy.ravel()), 1)
+
+    def update(self, model):
+        if hasattr(model, 'schedule'):
+            self.observe(*BankStatistics.get_model_observations(model))
+        else:
+            self.observe(*BankStatistics.get_ensemble_observations(model))
+
+    @staticmethod
+    def get_model_observations(model):
+        banks = model.schedule.banks
+        bs = BalanceSheet.stack([bank.balanceSheet for bank in banks])
+        capital_adequacy_ratio = np.array([bank.get_capital_adequacy_ratio() for bank in banks], dtype=float)
+        liquidity_needs = np.array([bank.liquidityNeeds for bank in banks], dtype=float)
+        strategy = None
+        if all(bank.isIntelligent for bank in banks):
+            number_beta_options = BankEWAStrategy.get_number_beta_options()
+            strategies = [bank.currentlyChosenStrategy for bank in banks]
+            strategy = np.array([s.alphaIndex * number_beta_options + s.betaIndex for s in strategies])
+        return (bs.capital, capital_adequacy_ratio, liquidity_needs, bs.interbankLoan,
+                model.schedule.central_bank.insolvent, strategy)
+
+    @staticmethod
+    def get_ensemble_observations(ensemble):
+        bs = ensemble.balanceSheet
+        strategy = ensemble.bankChosenStrategy if ensemble.areBanksIntelligent else None
+        return (bs.capital, ensemble.get_capital_adequacy_ratio(), ensemble.liquidityNeeds, bs.interbankLoan,
+                ensemble.get_flags('insolvent'), strategy)
+
+    @classmethod
+    def for_model(cls, model):
+        # statistics sized for the banks (and strategies) of a BankingModel or BankingEnsemble
+        return cls(model.numberBanks, BankEWAStrategy.get_number_strategies())
+
+    def merge(self, other):
+        if other.numberBanks != self.numberBanks or other.strategyCycles.shape != self.strategyCycles.shape:
+            raise ValueError('Statistics of different banks or strategies cannot be merged')
+        self.moments.merge(other.moments)
+        self.failures += other.failures
+        self.strategyCycles += other.strategyCycles
+        return self
+
+    def get_summary(self):
+        """
+        One row per bank: mean, standard deviation, minimum and maximum of every field, failure frequency and,
+        if strategies were observed, the strategy the bank spent most cycles in and the share of those cycles.
+        """
+        import pandas as pd
+
+        moments = self.moments
+        columns = {}
+        for i, field in enumerate(BankStatistics.fields):
+            columns[field + 'Mean'] = moments.mean[i]
+            columns[field + 'Std'] = moments.standardDeviation[i]
+            columns[field + 'Min'] = moments.minimum[i]
+            columns[field + 'Max'] = moments.maximum[i]
+        observations = max(self.numberObservations, 1)
+        columns['failureFrequency'] = self.failures / observations
+        if np.any(self.strategyCycles):
+            columns['modalStrategy'] = np.argmax(self.strategyCycles, axis=1)
+            columns['modalStrategyShare'] = np.max(self.strategyCycles, axis=1) / observations
+        return pd.DataFrame(columns, index=pd.RangeIndex(self.numberBanks, name='bank'))
@@ -0,0 +1,127 @@
+import copy
+import multiprocessing
+
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.model import BankingModel
+
+
+class ReplicationResult:
+    """
+    Outcome of one replication: the cycle it stopped at and the share of banks that became insolvent
+    (in total and due to contagion) in each cycle, unless those were written to a SharedMetrics.
+    'run' is the position of the replication in the seeds given to BatchRunner.run, which may repeat seeds.
+    """
+
+    def __init__(self, seed, stop_cycle, converged, insolvencies, contagions, run=None):
+        self.seed = seed
+        self.run = run
+        self.stopCycle = stop_cycle
+        self.converged = converged
+        self.insolvencies = insolvencies
+        self.contagions = contagions
+
+
+class BatchRunner:
+    """
+    Runs independent replications of one scenario, one seed each, over a pool of worker processes.
+
+    Every replication is a separate task, so with a stopping rule the replications that settle early free
+    their worker for the next seed instead of waiting for the slowest one. With a ResultCache, replications
+    already run are read back instead of simulated again.
+    """
+
+    def __init__(self, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None,
+                 stopping_rule=None, processes=None, cache=None):
+        self.simulation_type = simulation_type
+        self.exogenous_factors = exogenous_factors
+        self.number_of_banks = number_of_banks
+        self.stopping_rule = stopping_rule
+        self.processes = processes
+        self.cache = cache
+
+    def run(self, seeds, cycles, metrics=None):
+        """
+        Results as replications finish, not necessarily in the order of the seeds.
+
+        With a SharedMetrics (one run per seed, in the same order), workers write the per-cycle metrics
+        straight into it and the results carry no series.
+        """
+        seeds = list(seeds)
+        tasks = []
+        keys = {}
+        for run, seed in enumerate(seeds):
+            if self.cache is not None:
+                keys[seed] = self.cache.get_key(self.simulation_type, self.exogenous_factors, self.number_of_banks,
+                                                seed, cycles, self.stopping_rule)
+                result = self.cache.get(keys[seed])
+                if result is not None:
+                    result.run = run
+                    if metrics is not None:
+                        for cycle, cycle_metrics in enumerate(zip(result.insolvencies, result.contagions), 1):
+                            metrics.write_cycle(run, cycle, cycle_metrics)
+                        metrics.finish_run(run, result.stopCycle)
+                    yield result
+                    continue
+            tasks.append((self.simulation_type, self.exogenous_factors, self.number_of_banks, seed, cycles,
+                          self.stopping_rule, metrics, run))
+        if not tasks:
+            return
+
+        if self.processes == 1:
+            results = map(run_replication, tasks)
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            results = pool.imap_unordered(run_replication, tasks, chunksize=1)
+        try:
+            for result in results:
+                if self.cache is not None:
+                    if metrics is not None:
+                        values = metrics.values[result.run, :result.stopCycle]
+                        self.cache.put(keys[result.seed], ReplicationResult(
+                            result.seed, result.stopCycle, result.converged, values[:, 0].tolist(),
+                            values[:, 1].tolist(), result.run))
+                    else:
+                        self.cache.put(keys[result.seed], result)
+                yield result
+        finally:
+            if self.processes != 1:
+                pool.terminate()
+
+    def run_all(self, seeds, cycles):
+        # Results in the order of the seeds
+        seeds = list(seeds)
+        results = [None] * len(seeds)
+        for result in self.run(seeds, cycles):
+            results[result.run] = result
+        return results
+
+
+def run_replication(task):
+    simulation_type, exogenous_factors, number_of_banks, seed, cycles, stopping_rule, metrics, run = task
+    # a worker process runs many replications, so settings must not leak from the previous one
+    ExogenousFactors.reset()
+    model = BankingModel(simulation_type, exogenous_factors, number_of_banks, seed)
+    stopping_rule = copy.deepcopy(stopping_rule)
+    if stopping_rule is not None:
+        stopping_rule.reset()
+
+    insolvencies, contagions = [], []
+    central_bank = model.schedule.central_bank
+    converged = False
+    for i in range(cycles):
+        model.step()
+        insolvency_rate = central_bank.insolvencyPerCycleCounter / model.numberBanks
+        contagion_rate = central_bank.insolvencyDueToContagionPerCycleCounter / model.numberBanks
+        if metrics is None:
+            insolvencies.append(insolvency_rate)
+            contagions.append(contagion_rate)
+        else:
+            metrics.write_cycle(run, model.schedule.cycle, (insolvency_rate, contagion_rate))
+        if stopping_rule is not None and stopping_rule.update(model):
+            converged = True
+            break
+    model.running = False
+    if metrics is not None:
+        metrics.finish_run(run, model.schedule.cycle)
+        return ReplicationResult(seed, model.schedule.cycle, converged, None, None, run)
+    return ReplicationResult(seed, model.schedule.cycle, converged, insolvencies, contagions, run)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from enum import Enum
+
+import numpy as np
+
+from banksim.exogeneous_factors import ExogenousFactors, SimulationType
+from banksim.model import BankingModel
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where eviction is not serialized between processes
+    fcntl = None
+
+
+class ResultCache:
+    """
+    On-disk cache of simulation results, keyed by a hash of everything that determines them: the resolved
+    exogenous factors (simulation type and overrides applied), seed, number of cycles, stopping rule and
+    code version.
+
+    Each entry has a summary (e.g. a ReplicationResult) and, optionally, full outputs (any picklable object).
+    Files are written to a temporary name and renamed, so concurrent readers never see a partial entry, and
+    a hit refreshes the modification time used for LRU eviction down to max_entries and max_size (bytes).
+    """
+
+    summarySuffix = '.summary.pkl'
+    fullSuffix = '.full.pkl'
+    _codeVersion = None
+
+    def __init__(self, directory, max_entries=None, max_size=None):
+        self.directory = directory
+        self.maxEntries = max_entries
+        self.maxSize = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def get_code_version(cls):
+        # Hash of the package sources and of NumPy's version, which determines the random streams
+        if cls._codeVersion is None:
+            digest = hashlib.sha256(np.__version__.encode())
+            package = os.path.dirname(os.path.abspath(__file__))
+            for root, dirs, files in sorted(os.walk(package)):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith('.py'):
+                        path = os.path.join(root, name)
+                        digest.update(os.path.relpath(path, package).encode())
+                        with open(path, 'rb') as f:
+                            digest.update(f.read())
+            cls._codeVersion = digest.hexdigest()
+        return cls._codeVersion
+
+    @staticmethod
+    def get_resolved_settings(simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None):
+        # The factors a model built with these arguments would use, leaving the current ones untouched
+        current_settings = ExogenousFactors.get_settings()
+        try:
+            ExogenousFactors.reset()
+            BankingModel.update_exogeneous_factors_by_simulation_type(SimulationType[simulation_type])
+            BankingModel.update_exogeneous_factors(exogenous_factors, number_of_banks)
+            return ExogenousFactors.get_settings()
+        finally:
+            ExogenousFactors.set_settings(current_settings)
+
+    @staticmethod
+    def get_key(simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None, seed=None, cycles=None,
+                stopping_rule=None):
+        def canonical(value):
+            if isinstance(value, Enum):
+                return '{}.{}'.format(type(value).__name__, value.name)
+            if isinstance(value, np.generic):
+                return value.item()
+            if hasattr(value, 'get_settings'):
+                # e.g. a stopping rule, identified by its class and settings
+                return {'class': type(value).__name__, 'settings': value.get_settings()}
+            return repr(value)
+
+        configuration = {
+            'settings': ResultCache.get_resolved_settings(simulation_type, exogenous_factors, number_of_banks),
+            'simulationType': simulation_type,
+            'seed': seed,
+            'cycles': cycles,
+            'stoppingRule': stopping_rule,
+            'codeVersion': ResultCache.get_code_version()}
+        text = json.dumps(configuration, sort_keys=True, default=canonical)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get_path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def get(self, key):
+        # Summary stored for the key, or None
+        path = self.get_path(key, self.summarySuffix)
+        summary = self._load(path)
+        if summary is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return summary
+
+    def get_full(self, key):
+        # Full outputs stored for the key, or None
+        return self._load(self.get_path(key, self.fullSuffix))
+
+    def __contains__(self, key):
+        return os.path.exists(self.get_path(key, self.summarySuffix))
+
+    def put(self, key, summary, full=None):
+        # full outputs first, so an entry is visible only when complete
+        if full is not None:
+            self._dump(full, self.get_path(key, self.fullSuffix))
+        self._dump(summary, self.get_path(key, self.summarySuffix))
+        self.evict()
+
+    def evict(self):
+        if self.maxEntries is None and self.maxSize is None:
+            return
+        with self._lock():
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(self.summarySuffix):
+                    continue
+                key = name[:-len(self.summarySuffix)]
+                try:
+                    last_used = os.path.getmtime(self.get_path(key, self.summarySuffix))
+                    size = os.path.getsize(self.get_path(key, self.summarySuffix))
+                    if os.path.exists(self.get_path(key, self.fullSuffix)):
+                        size += os.path.getsize(self.get_path(key, self.fullSuffix))
+                except OSError:
+                    continue
+                entries.append((last_used, size, key))
+
+            # least recently used first
+            entries.sort()
+            number_entries = len(entries)
+            total_size = sum(size for _, size, _ in entries)
+            for last_used, size, key in entries:
+                if (self.maxEntries is None or number_entries <= self.maxEntries) and \
+                        (self.maxSize is None or total_size <= self.maxSize):
+                    break
+                self.remove(key)
+                number_entries -= 1
+                total_size -= size
+
+    def remove(self, key):
+        for suffix in (self.summarySuffix, self.fullSuffix):
+            try:
+                os.remove(self.get_path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.summarySuffix):
+                self.remove(name[:-len(self.summarySuffix)])
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            # missing, or removed by another process in the meantime
+            return None
+
+    def _dump(self, value, path):
+        handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def _lock(self):
+        return _FileLock(os.path.join(self.directory, '.lock'))
+
+
+class _FileLock:
+    # Exclusive lock between processes, held while evicting
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
@@ -0,0 +1,243 @@
+import multiprocessing
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.model import BankingModel
+
+
+class Calibration:
+    """
+    Simulated method of moments: finds the exogenous factors within 'bounds' whose simulated moments are
+    closest to 'targets', e.g.
+
+        Calibration(targets={'insolvencies': 0.02, 'interbankVolume': 0.3},
+                    bounds={'probabilityofWithdrawal': (0.05, 0.3), 'illiquidAssetDiscountRate': (0.05, 0.4)})
+
+    A candidate is evaluated on the same seeds as every other one (common random numbers), so differences
+    in the objective come from the factors and not from the draws, and the objective is smooth enough for
+    a surrogate. The distance is sum(weight * (moment - target)^2), with weights 1 / target^2 by default.
+
+    The optimizer fits a quadratic surrogate to the candidates evaluated so far and proposes, in batches
+    evaluated in parallel, the candidates it predicts best within a trust region around the best one (plus
+    some random ones there), growing the region when a batch improves and shrinking it otherwise.
+    With a ResultCache, replications already run are not run again; with a checkpoint file, the state is
+    saved after every batch and a calibration run again with the same settings resumes from it.
+    """
+
+    momentNames = ('insolvencies', 'contagions', 'insolvenciesStd', 'interbankVolume', 'interbankParticipation')
+
+    def __init__(self, targets, bounds, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None,
+                 cycles=200, burn_in=50, seeds=(0, 1, 2, 3), weights=None, processes=None, cache=None,
+                 checkpoint=None, seed=0):
+        for name in targets:
+            if name not in self.momentNames:
+                raise ValueError('Unknown moment {}, expected one of {}'.format(name, ', '.join(self.momentNames)))
+        settings = ExogenousFactors.get_settings()
+        for factor, (low, high) in bounds.items():
+            if factor not in settings:
+                raise ValueError('Unknown exogenous factor {}'.format(factor))
+            if not low < high:
+                raise ValueError('Empty bounds for {}: {}, {}'.format(factor, low, high))
+        if burn_in >= cycles:
+            raise ValueError('burn_in must be smaller than cycles')
+
+        self.targets = dict(targets)
+        self.bounds = {factor: (float(low), float(high)) for factor, (low, high) in bounds.items()}
+        self.factors = sorted(self.bounds)
+        self.simulation_type = simulation_type
+        self.exogenous_factors = dict(exogenous_factors or {})
+        self.number_of_banks = number_of_banks
+        self.cycles = cycles
+        self.burnIn = burn_in
+        self.seeds = list(seeds)
+        self.weights = {name: weights[name] if weights and name in weights else 1 / max(value ** 2, 1e-12)
+                        for name, value in self.targets.items()}
+        self.processes = processes
+        self.cache = cache
+        self.checkpoint = checkpoint
+
+        # optimizer state, saved in the checkpoint
+        self.randomState = np.random.RandomState(seed)
+        self.radius = 0.5
+        self.history = []
+
+    def get_settings(self):
+        # What determines the moments of a replication besides the model itself (part of the cache keys)
+        return {'burnIn': self.burnIn, 'moments': self.momentNames}
+
+    def get_factors(self, point):
+        # Exogenous factors of a point of the unit cube
+        factors = dict(self.exogenous_factors)
+        for factor, u in zip(self.factors, point):
+            low, high = self.bounds[factor]
+            factors[factor] = low + float(u) * (high - low)
+        return factors
+
+    def get_objective(self, moments):
+        return sum(weight * (moments[name] - self.targets[name]) ** 2 for name, weight in self.weights.items())
+
+    def evaluate(self, points, pool=None):
+        """
+        Moments (averaged over the seeds) and objective of each point of the unit cube.
+        """
+        candidates = [self.get_factors(point) for point in points]
+        moments = {}
+        tasks, keys = [], {}
+        for i, factors in enumerate(candidates):
+            for seed in self.seeds:
+                if self.cache is not None:
+                    keys[i, seed] = self.cache.get_key(self.simulation_type, factors, self.number_of_banks, seed,
+                                                       self.cycles, self)
+                    result = self.cache.get(keys[i, seed])
+                    if result is not None:
+                        moments[i, seed] = result
+                        continue
+                tasks.append((i, self.simulation_type, factors, self.number_of_banks, seed, self.cycles,
+                              self.burnIn))
+
+        results = map(simulate_moments, tasks) if pool is None else pool.imap_unordered(simulate_moments, tasks)
+        for i, seed, result in results:
+            moments[i, seed] = result
+            if self.cache is not None:
+                self.cache.put(keys[i, seed], result)
+
+        evaluations = []
+        for i, factors in enumerate(candidates):
+            mean_moments = dict(zip(self.momentNames, np.mean([moments[i, seed] for seed in self.seeds], axis=0)))
+            evaluations.append({'point': [float(u) for u in points[i]],
+                                'factors': {factor: factors[factor] for factor in self.factors},
+                                'moments': {name: float(value) for name, value in mean_moments.items()},
+                                'objective': float(self.get_objective(mean_moments))})
+        return evaluations
+
+    @staticmethod
+    def get_surrogate_features(points):
+        # Quadratic in every factor, without cross terms: 2 * factors + 1 coefficients
+        points = np.atleast_2d(points)
+        return np.hstack([np.ones((len(points), 1)), points, points ** 2])
+
+    def fit_surrogate(self, points, objectives):
+        # Ridge regression, so that a few points are enough for a first fit
+        features = Calibration.get_surrogate_features(points)
+        ridge = 1e-6 * np.eye(features.shape[1])
+        return np.linalg.solve(features.T @ features + ridge, features.T @ objectives)
+
+    def propose(self, batch_size):
+        dimension = len(self.factors)
+        points = np.array([evaluation['point'] for evaluation in self.history])
+        objectives = np.array([evaluation['objective'] for evaluation in self.history])
+        best = points[np.argmin(objectives)]
+        low, high = np.clip(best - self.radius, 0, 1), np.clip(best + self.radius, 0, 1)
+
+        # a quarter of the batch explores the trust region at random, the rest follows the surrogate
+        number_random = max(1, batch_size // 4)
+        sample = low + self.randomState.random_sample((1000 * dimension, dimension)) * (high - low)
+        coefficients = self.fit_surrogate(points, objectives)
+        predicted = Calibration.get_surrogate_features(sample) @ coefficients
+        surrogate = sample[np.argsort(predicted)[:batch_size - number_random]]
+        random = low + self.randomState.random_sample((number_random, dimension)) * (high - low)
+        return np.vstack([surrogate, random])
+
+    def get_initial_design(self, number_points):
+        # Latin hypercube: one point in each of number_points slices of every factor
+        dimension = len(self.factors)
+        slices = np.array([self.randomState.permutation(number_points) for _ in range(dimension)]).T
+        return (slices + self.randomState.random_sample((number_points, dimension))) / number_points
+
+    def run(self, iterations=20, batch_size=None):
+        """
+        Runs the initial design and 'iterations' batches of candidates (counting those run before a
+        checkpoint). Returns the best evaluation: its factors, moments and objective.
+        """
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            self.load_checkpoint()
+        processes = self.processes or os.cpu_count()
+        if batch_size is None:
+            batch_size = max(processes, 4)
+        pool = None if processes == 1 else multiprocessing.Pool(processes)
+        try:
+            if not self.history:
+                number_points = max(batch_size, 2 * len(self.factors) + 2)
+                self.history += self.evaluate(self.get_initial_design(number_points), pool)
+                self.save_checkpoint()
+            # the initial design counts as the first iteration
+            while self.get_number_iterations(batch_size) < iterations:
+                best_objective = self.get_best()['objective']
+                self.history += self.evaluate(self.propose(batch_size), pool)
+                if self.get_best()['objective'] < best_objective:
+                    self.radius = min(0.5, 2 * self.radius)
+                else:
+                    self.radius = max(1e-3, self.radius / 2)
+                self.save_checkpoint()
+        finally:
+            if pool is not None:
+                pool.terminate()
+        return self.get_best()
+
+    def get_number_iterations(self, batch_size):
+        number_points = max(batch_size, 2 * len(self.factors) + 2)
+        return 1 + (len(self.history) - number_points) // batch_size
+
+    def get_best(self):
+        return min(self.history, key=lambda evaluation: evaluation['objective'])
+
+    def get_checkpoint_settings(self):
+        # A checkpoint only resumes a calibration of the same problem
+        return {'targets': self.targets, 'bounds': self.bounds, 'weights': self.weights,
+                'simulationType': self.simulation_type, 'exogenousFactors': self.exogenous_factors,
+                'numberOfBanks': self.number_of_banks, 'cycles': self.cycles, 'burnIn': self.burnIn,
+                'seeds': self.seeds}
+
+    def save_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        state = {'settings': self.get_checkpoint_settings(), 'history': self.history, 'radius': self.radius,
+                 'randomState': self.randomState.get_state()}
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        # written to a temporary file and renamed, so an interrupted save leaves the previous checkpoint
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.checkpoint)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def load_checkpoint(self):
+        with open(self.checkpoint, 'rb') as f:
+            state = pickle.load(f)
+        if state['settings'] != self.get_checkpoint_settings():
+            raise ValueError('Checkpoint {} is for a different calibration'.format(self.checkpoint))
+        self.history = state['history']
+        self.radius = state['radius']
+        self.randomState.set_state(state['randomState'])
+
+
+def simulate_moments(task):
+    i, simulation_type, exogenous_factors, number_of_banks, seed, cycles, burn_in = task
+    # a worker process runs many replications, so settings must not leak from the previous one
+    ExogenousFactors.reset()
+    model = BankingModel(simulation_type, exogenous_factors, number_of_banks, seed)
+    central_bank = model.schedule.central_bank
+    clearing_house = model.schedule.clearing_house
+
+    statistics = np.zeros((cycles - burn_in, 4))
+    for cycle in range(cycles):
+        model.step()
+        if cycle >= burn_in:
+            # the lending matrix has each loan twice, once positive (lender) and once negative (borrower)
+            matrix = clearing_house.interbankLendingMatrix
+            statistics[cycle - burn_in] = (central_bank.insolvencyPerCycleCounter / model.numberBanks,
+                                           central_bank.insolvencyDueToContagionPerCycleCounter / model.numberBanks,
+                                           np.sum(matrix[matrix > 0]) / model.numberBanks,
+                                           np.mean(np.any(matrix != 0, axis=1)))
+    model.running = False
+
+    insolvencies, contagions, volume, participation = statistics.T
+    return i, seed, [float(np.mean(insolvencies)), float(np.mean(contagions)), float(np.std(insolvencies)),
+                     float(np.mean(volume)), float(np.mean(participation))]
@@ -0,0 +1,102 @@
+import argparse
+import csv
+import sys
+import time
+
+import numpy as np
+
+from banksim.batch import BatchRunner
+from banksim.cache import ResultCache
+from banksim.convergence import ConvergenceMonitor
+from banksim.scenario import Scenario
+from banksim.shared_metrics import SharedMetrics
+
+
+def run_scenario(scenario, log=sys.stderr):
+    """
+    Runs every replication of a Scenario headless, writing its outputs as replications finish.
+    Returns the number of cycles run per second.
+    """
+    stopping_rule = ConvergenceMonitor(**scenario.stopping_rule) if scenario.stopping_rule else None
+    cache = ResultCache(scenario.cache) if scenario.cache else None
+    runner = BatchRunner(scenario.simulation_type, scenario.exogenous_factors, scenario.number_of_banks,
+                         stopping_rule, scenario.processes, cache)
+    seeds, cycles, outputs = scenario.seeds, scenario.cycles, scenario.outputs
+
+    metrics = SharedMetrics(len(seeds), cycles) if 'aggregate' in outputs else None
+    files, writers = {}, {}
+    headers = {'summary': ('seed', 'stop_cycle', 'converged', 'mean_insolvencies', 'mean_contagions'),
+               'series': ('seed', 'cycle', 'insolvencies', 'contagions')}
+    try:
+        for name, header in headers.items():
+            if name in outputs:
+                files[name] = open(outputs[name], 'w', newline='')
+                writers[name] = csv.writer(files[name])
+                writers[name].writerow(header)
+
+        start = time.perf_counter()
+        total_cycles = 0
+        for result in runner.run(seeds, cycles, metrics):
+            total_cycles += result.stopCycle
+            if metrics is not None:
+                values = metrics.values[result.run, :result.stopCycle]
+                insolvencies, contagions = values[:, 0], values[:, 1]
+            else:
+                insolvencies, contagions = result.insolvencies, result.contagions
+
+            if 'summary' in writers:
+                writers['summary'].writerow((result.seed, result.stopCycle, result.converged,
+                                             np.mean(insolvencies), np.mean(contagions)))
+                files['summary'].flush()
+            if 'series' in writers:
+                writers['series'].writerows(
+                    (result.seed, cycle, insolvency, contagion)
+                    for cycle, (insolvency, contagion) in enumerate(zip(insolvencies, contagions), 1))
+                files['series'].flush()
+        elapsed = time.perf_counter() - start
+
+        if metrics is not None:
+            write_aggregate(metrics, outputs['aggregate'])
+    finally:
+        for f in files.values():
+            f.close()
+        if metrics is not None:
+            metrics.close()
+
+    throughput = total_cycles / elapsed if elapsed > 0 else float('inf')
+    if log is not None:
+        print('{} replications, {} cycles in {:.2f}s: {:.1f} cycles/sec'.format(
+            len(seeds), total_cycles, elapsed, throughput), file=log)
+    return throughput
+
+
+def write_aggregate(metrics, path):
+    # up to the last cycle any replication ran
+    number_cycles = int(np.max(metrics.stopCycles, initial=0))
+    columns, header = [], ['cycle']
+    for metric in SharedMetrics.metricNames:
+        lower, upper = metrics.get_confidence_band(metric)
+        columns += [metrics.get_mean(metric), *metrics.get_quantiles(metric, (0.05, 0.5, 0.95)), lower, upper]
+        header += [metric + suffix for suffix in ('_mean', '_q05', '_median', '_q95', '_ci_lower', '_ci_upper')]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows([cycle, *row]
+                         for cycle, row in enumerate(np.transpose(columns)[:number_cycles].tolist(), 1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m banksim', description='Runs a BankSim scenario headless.')
+    parser.add_argument('scenario', help='YAML or TOML scenario file')
+    parser.add_argument('--processes', type=int, help='number of worker processes, overriding the scenario')
+    parser.add_argument('--quiet', action='store_true', help='do not report throughput')
+    args = parser.parse_args(argv)
+
+    try:
+        scenario = Scenario.from_file(args.scenario)
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(str(e))
+    if args.processes is not None:
+        scenario.processes = args.processes
+    run_scenario(scenario, log=None if args.quiet else sys.stderr)
+    return 0
@@ -0,0 +1,62 @@
+from collections import deque
+
+import numpy as np
+
+
+class ConvergenceMonitor:
+    """
+    Stopping rule for BankingModel.run_model, based on rolling statistics of the model.
+
+    Every cycle it records the share of banks that became insolvent, the share of banks that became
+    insolvent due to contagion (both out of all banks) and the entropy of the strategy distributions (banks,
+    central bank and depositors). The model has settled when the mean of each statistic over the last window
+    differs by at most tolerance from its mean over the window before it. Checks start after minimum_cycles,
+    raised to 2 * window if smaller, since both windows must be full.
+    """
+
+    def __init__(self, window=50, tolerance=1e-3, minimum_cycles=100):
+        if window < 1:
+            raise ValueError('window must be at least 1, not {}'.format(window))
+        self.window = window
+        self.tolerance = tolerance
+        self.minimumCycles = max(minimum_cycles, 2 * window)
+
+        self.history = deque(maxlen=2 * window)
+        self.numberCycles = 0
+        self.stopCycle = None
+
+    def get_settings(self):
+        return {'window': self.window, 'tolerance': self.tolerance, 'minimumCycles': self.minimumCycles}
+
+    def reset(self):
+        self.history.clear()
+        self.numberCycles = 0
+        self.stopCycle = None
+
+    @staticmethod
+    def get_statistics(model):
+        central_bank = model.schedule.central_bank
+        return (central_bank.insolvencyPerCycleCounter / model.numberBanks,
+                central_bank.insolvencyDueToContagionPerCycleCounter / model.numberBanks) + \
+            tuple(model.get_strategy_entropy())
+
+    def update(self, model):
+        # Records the statistics of the cycle just run; returns True when the model has settled
+        return self.observe(ConvergenceMonitor.get_statistics(model), model.schedule.cycle)
+
+    def observe(self, statistics, cycle=None):
+        self.history.append(statistics)
+        self.numberCycles += 1
+        if self.numberCycles < self.minimumCycles:
+            return False
+        history = np.array(self.history)
+        previous_mean = np.mean(history[:self.window], axis=0)
+        last_mean = np.mean(history[self.window:], axis=0)
+        if np.all(np.abs(last_mean - previous_mean) <= self.tolerance):
+            self.stopCycle = self.numberCycles if cycle is None else cycle
+            return True
+        return False
+
+    @property
+    def converged(self):
+        return self.stopCycle is not None
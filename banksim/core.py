@@ -0,0 +1,40 @@
+import datetime as dt
+import random
+
+import numpy as np
+
+
+class Model:
+    """
+    Base class of the models, with the interface (and seeding) of mesa.Model, so that the simulation engine
+    imports only NumPy. banksim.mesa_adapter makes a BankingModel a mesa.Model for Mesa's tools.
+    """
+
+    def __init__(self, seed=None):
+        # seeds Python's and NumPy's global generators, as mesa.Model does
+        self.seed = dt.datetime.now() if seed is None else seed
+        random.seed(seed)
+        np.random.seed(seed)
+
+        self.running = True
+        self.schedule = None
+
+    def run_model(self):
+        while self.running:
+            self.step()
+
+    def step(self):
+        pass
+
+
+class Agent:
+    """
+    Base class of the agents, with the interface of mesa.Agent.
+    """
+
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+
+    def step(self):
+        pass
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+from banksim.exogeneous_factors import SimulationType
+from banksim.model import BankingModel
+
+
+class MinMaxBuckets:
+    """
+    Downsampled history of a few series: at most 'capacity' buckets, each keeping the first and last cycle,
+    minimum, maximum and mean of every series. When full, neighbouring buckets are merged in pairs, so
+    memory and the size of a snapshot stay bounded however long the simulation runs.
+    """
+
+    def __init__(self, number_series, capacity=512):
+        self.numberSeries = number_series
+        self.capacity = capacity - capacity % 2
+        self.width = 1
+        self.buckets = []
+
+    def add(self, cycle, values):
+        if self.buckets and self.buckets[-1]['count'] < self.width:
+            bucket = self.buckets[-1]
+            bucket['last'] = cycle
+            bucket['min'] = [min(a, b) for a, b in zip(bucket['min'], values)]
+            bucket['max'] = [max(a, b) for a, b in zip(bucket['max'], values)]
+            bucket['sum'] = [a + b for a, b in zip(bucket['sum'], values)]
+            bucket['count'] += 1
+            return
+        if len(self.buckets) == self.capacity:
+            self.buckets = [MinMaxBuckets.merge(*self.buckets[i:i + 2]) for i in range(0, self.capacity, 2)]
+            self.width *= 2
+        self.buckets.append({'first': cycle, 'last': cycle, 'min': list(values), 'max': list(values),
+                             'sum': list(values), 'count': 1})
+
+    @staticmethod
+    def merge(a, b):
+        return {'first': a['first'], 'last': b['last'],
+                'min': [min(x, y) for x, y in zip(a['min'], b['min'])],
+                'max': [max(x, y) for x, y in zip(a['max'], b['max'])],
+                'sum': [x + y for x, y in zip(a['sum'], b['sum'])],
+                'count': a['count'] + b['count']}
+
+    def snapshot(self):
+        return [{'first': b['first'], 'last': b['last'], 'min': b['min'], 'max': b['max'],
+                 'mean': [s / b['count'] for s in b['sum']]} for b in self.buckets]
+
+
+class DashboardState:
+    """
+    What the simulation thread publishes and the server reads: a downsampled history, the most recent
+    per-cycle points (for deltas) and the banks and interbank network of the last cycle.
+    """
+
+    seriesNames = ('insolvencies', 'contagions')
+
+    def __init__(self, recent_points=4096, capacity=512):
+        self.lock = threading.Lock()
+        self.history = MinMaxBuckets(len(self.seriesNames), capacity)
+        self.recent = deque(maxlen=recent_points)
+        self.cycle = 0
+        self.banks = []
+        self.network = []
+        self.finished = False
+
+    def record(self, model):
+        central_bank = model.schedule.central_bank
+        values = (central_bank.insolvencyPerCycleCounter / model.numberBanks,
+                  central_bank.insolvencyDueToContagionPerCycleCounter / model.numberBanks)
+        banks = [{'liquidAssets': b.balanceSheet.liquidAssets,
+                  'nonFinancialSectorLoan': b.balanceSheet.nonFinancialSectorLoan,
+                  'interbankLoan': b.balanceSheet.interbankLoan,
+                  'deposits': b.balanceSheet.deposits,
+                  'discountWindowLoan': b.balanceSheet.discountWindowLoan,
+                  'capital': b.balanceSheet.capital} for b in model.schedule.banks]
+        # lender -> borrower, from the positive entries of the lending matrix
+        matrix = model.schedule.clearing_house.interbankLendingMatrix
+        lenders, borrowers = np.nonzero(matrix > 0)
+        network = list(zip(lenders.tolist(), borrowers.tolist(), matrix[lenders, borrowers].tolist()))
+
+        cycle = model.schedule.cycle
+        with self.lock:
+            self.history.add(cycle, values)
+            self.recent.append((cycle,) + values)
+            self.cycle = cycle
+            self.banks = [{key: float(value) for key, value in bank.items()} for bank in banks]
+            self.network = network
+
+    def get_history_message(self):
+        with self.lock:
+            return self.cycle, {'type': 'history', 'series': self.seriesNames, 'cycle': self.cycle,
+                                'buckets': self.history.snapshot(), 'banks': self.banks, 'network': self.network,
+                                'finished': self.finished}
+
+    def get_delta_message(self, last_cycle, last_finished=False):
+        # None if nothing new since the client saw last_cycle and last_finished; a history message if it fell
+        # behind the recent points
+        with self.lock:
+            if self.cycle == last_cycle and self.finished == last_finished:
+                return last_cycle, None
+            if not self.recent or self.recent[0][0] > last_cycle + 1:
+                behind = True
+            else:
+                behind = False
+                points = [point for point in self.recent if point[0] > last_cycle]
+                message = {'type': 'delta', 'cycle': self.cycle, 'points': points, 'banks': self.banks,
+                           'network': self.network, 'finished': self.finished}
+        if behind:
+            return self.get_history_message()
+        return self.cycle, message
+
+
+class Dashboard:
+    """
+    Live view of a running BankingModel, served over HTTP with server-sent events.
+
+    The model runs in its own thread and only publishes into a DashboardState; each browser is fed by its
+    own asyncio task, 'interval' seconds apart, with the cycles it has not seen yet. A slow browser only
+    receives bigger (or, if far behind, downsampled) updates: it never slows the model down.
+    """
+
+    page = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.html')
+
+    def __init__(self, model, cycles, interval=0.2, host='127.0.0.1', port=8522):
+        self.model = model
+        self.cycles = cycles
+        self.interval = interval
+        self.host = host
+        self.port = port
+        self.state = DashboardState()
+        self.stopEvent = threading.Event()
+
+    def run_model(self):
+        for _ in range(self.cycles):
+            if self.stopEvent.is_set():
+                break
+            self.model.step()
+            self.state.record(self.model)
+        with self.state.lock:
+            self.state.finished = True
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            path = request_line[1] if len(request_line) > 1 else '/'
+            if path == '/events':
+                await self.stream_events(writer)
+            elif path == '/':
+                with open(self.page, 'rb') as f:
+                    body = f.read()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n'
+                             b'Content-Length: %d\r\nConnection: close\r\n\r\n' % len(body) + body)
+                await writer.drain()
+            else:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream_events(self, writer):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                     b'Connection: keep-alive\r\n\r\n')
+        last_cycle, message = self.state.get_history_message()
+        last_finished = False
+        while True:
+            if message is not None:
+                writer.write(b'data: ' + json.dumps(message).encode() + b'\n\n')
+                # waits for this browser only
+                await writer.drain()
+                last_finished = message['finished']
+                if last_finished:
+                    return
+            await asyncio.sleep(self.interval)
+            last_cycle, message = self.state.get_delta_message(last_cycle, last_finished)
+
+    def serve(self):
+        # until interrupted; an event loop of its own, as asyncio.run and Server.serve_forever need Python 3.7
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(self.handle, self.host, self.port))
+        threading.Thread(target=self.run_model, daemon=True).start()
+        print('Serving on http://{}:{}'.format(self.host, self.port))
+        try:
+            loop.run_forever()
+        finally:
+            self.stopEvent.set()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m banksim.dashboard', description='Live view of a BankSim run.')
+    parser.add_argument('--simulation-type', default='HighSpread', choices=[_.name for _ in SimulationType])
+    parser.add_argument('--banks', type=int, default=10, help='number of banks')
+    parser.add_argument('--cycles', type=int, default=100000)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between updates to the browser')
+    parser.add_argument('--port', type=int, default=8522)
+    args = parser.parse_args(argv)
+
+    model = BankingModel(args.simulation_type, number_of_banks=args.banks, seed=args.seed)
+    try:
+        Dashboard(model, args.cycles, args.interval, port=args.port).serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,674 @@
+import numpy as np
+
+from banksim.agents.bank import BalanceSheet
+from banksim.agents.central_bank import CentralBank
+from banksim.bank_run import SequentialBankRun
+from banksim.exogeneous_factors import ExogenousFactors, BankSizeDistribution, InterbankPriority, SimulationType
+from banksim.fire_sale import FireSaleMarket
+from banksim.kernels import Kernels
+from banksim.model import BankingModel
+from banksim.strategies.bank_ewa_strategy import BankEWAStrategy
+from banksim.strategies.central_bank_ewa_strategy import CentralBankEWAStrategy
+from banksim.strategies.depositor_ewa_strategy import DepositorEWAStrategy
+from banksim.util import Util
+
+
+class BankingEnsemble:
+    """
+    K independent replications of one BankingModel scenario, advanced in lockstep.
+
+    Every piece of state carries a leading replication axis (banks are (K, banks), depositors
+    (K, depositors), ...), so each stage of the cycle is a handful of array operations over all
+    replications. Replication k draws from its own RandomState(seeds[k]) in exactly the same order as
+    BankingModel(seed=seeds[k]), so its results are the ones of the corresponding single run.
+    Only the interbank matching, which is sequential by nature, loops over replications.
+
+    With compact=True, the populations, EWA information and interbank exposures are float32, strategy indices
+    int8/int16 and flags bit-packed, in about half the memory (2.1 times less); results then stay within the
+    error budget of banksim/precision.py rather than matching BankingModel exactly. Balance sheets remain
+    float64.
+    """
+
+    def __init__(self, seeds, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None,
+                 compact=False):
+        self.seeds = list(seeds)
+        self.numberReplications = len(self.seeds)
+        self.random = [np.random.RandomState(seed) for seed in self.seeds]
+        self.cycle = 0
+        self.compact = compact
+        self.floatType = np.float32 if compact else np.float64
+
+        # Simulation data
+        self.simulation_type = SimulationType[simulation_type]
+        BankingModel.update_exogeneous_factors_by_simulation_type(self.simulation_type)
+        BankingModel.update_exogeneous_factors(exogenous_factors, number_of_banks)
+        if ExogenousFactors.isDepositInsuranceFundActive:
+            raise ValueError('The deposit insurance fund is only modelled by BankingModel')
+
+        # Economy data
+        self.numberBanks = ExogenousFactors.numberBanks
+        self.depositInterestRate = ExogenousFactors.depositInterestRate
+        self.interbankInterestRate = ExogenousFactors.interbankInterestRate
+        self.liquidAssetsInterestRate = ExogenousFactors.liquidAssetsInterestRate
+        self.interbankLendingMarketAvailable = ExogenousFactors.interbankLendingMarketAvailable
+
+        k, n = self.numberReplications, self.numberBanks
+
+        # Central Bank
+        self.offersDiscountWindowLending = ExogenousFactors.offersDiscountWindowLending
+        self.minimumCapitalAdequacyRatio = np.full(k, float(ExogenousFactors.minimumCapitalAdequacyRatio))
+        self.insolvencyPerCycleCounter = np.zeros(k, dtype=np.int64)
+        self.insolvencyDueToContagionPerCycleCounter = np.zeros(k, dtype=np.int64)
+        self.isCentralBankIntelligent = not ExogenousFactors.isCentralBankZeroIntelligenceAgent
+        if self.isCentralBankIntelligent:
+            number_options = CentralBankEWAStrategy.get_number_alpha_options()
+            self.centralBankStrategyA = np.zeros((k, number_options))
+            self.centralBankStrategyP = np.zeros((k, number_options))
+            self.centralBankStrategyProfit = np.zeros((k, number_options))
+            self.centralBankChosenStrategy = np.zeros(k, dtype=np.int64)
+
+        # Clearing House
+        self.clearingGuaranteeAvailable = ExogenousFactors.isClearingGuaranteeAvailable
+        self.interbankLendingMatrix = np.zeros((k, n, n), dtype=self.floatType)
+        self.vetor_recuperacao = np.ones((k, n))
+        self.biggestInterbankDebt = np.zeros(k)
+        self.totalInterbankDebt = np.zeros(k)
+        self.totalCollateralDeficit = np.zeros(k)
+        self.totalCollateralSurplus = np.zeros(k)
+
+        # Banks
+        if ExogenousFactors.bankSizeDistribution == BankSizeDistribution.LogNormal:
+            initial_size = np.array([rs.lognormal(-0.5, 1, n) for rs in self.random])
+        else:
+            initial_size = np.ones((k, n))
+        total_size = Util.ordered_sum(initial_size, axis=1)[:, np.newaxis]
+        self.marketShare = initial_size / total_size
+        self.initialSize = initial_size * (n / total_size)
+
+        self.balanceSheet = BalanceSheet()
+        for field in ('deposits', 'discountWindowLoan', 'interbankLoan', 'nonFinancialSectorLoan', 'liquidAssets'):
+            setattr(self.balanceSheet, field, np.zeros((k, n)))
+        self.auxBalanceSheet = None
+        self.liquidityNeeds = np.zeros((k, n))
+        self.withdrawalsCounter = np.zeros((k, n), dtype=np.int64)
+        self.bankRunOccurred = self.get_flags_array((k, n))
+        self.insolvent = self.get_flags_array((k, n))
+
+        self.areBanksIntelligent = not ExogenousFactors.areBanksZeroIntelligenceAgents
+        self.bankEWADampingFactor = ExogenousFactors.DefaultEWADampingFactor
+        if self.areBanksIntelligent:
+            number_strategies = BankEWAStrategy.get_number_strategies()
+            self.bankStrategyA = np.zeros((k, n, number_strategies), dtype=self.floatType)
+            self.bankStrategyP = np.zeros((k, n, number_strategies), dtype=self.floatType)
+            self.bankStrategyProfit = np.zeros((k, n, number_strategies), dtype=self.floatType)
+            self.bankStrategyProfitPercentage = np.zeros((k, n, number_strategies), dtype=self.floatType)
+            self.bankStrategyProfitPercentageDamped = np.zeros((k, n, number_strategies), dtype=self.floatType)
+            self.bankChosenStrategy = np.zeros((k, n), dtype=self.get_index_type(number_strategies, compact))
+
+        # Depositors and Corporate Clients (Firms), contiguous by bank within each replication
+        self.numberDepositors = np.array([Util.apportion(ExogenousFactors.numberDepositorsPerBank * n, share, minimum=1)
+                                          for share in self.marketShare])
+        self.numberCorporateClients = np.array([
+            Util.apportion(ExogenousFactors.numberCorporateClientsPerBank * n, share, minimum=1)
+            for share in self.marketShare])
+        bank_index_type = self.get_index_type(n, compact)
+        self.depositorBank = np.array([np.repeat(np.arange(n), counts) for counts in self.numberDepositors],
+                                      dtype=bank_index_type)
+        self.corporateClientBank = np.array([np.repeat(np.arange(n), counts) for counts in self.numberCorporateClients],
+                                            dtype=bank_index_type)
+        # Group ids (replication, bank) flattened, to add values up by bank with a single np.bincount
+        group_type = np.int32 if compact else np.int64
+        replication_offset = n * np.arange(k, dtype=group_type)[:, np.newaxis]
+        self.depositorGroup = (self.depositorBank + replication_offset).ravel()
+        self.corporateClientGroup = (self.corporateClientBank + replication_offset).ravel()
+        self.firstCorporateClient = np.array([Util.get_offsets(counts)[:-1] for counts in self.numberCorporateClients],
+                                             dtype=group_type)
+
+        shape = self.depositorBank.shape
+        self.initialDeposit = np.zeros(shape, dtype=self.floatType)
+        self.deposit = np.zeros(shape, dtype=self.floatType)
+        self.lastPercentageWithdrawn = np.zeros(shape, dtype=self.floatType)
+        self.amountEarlyWithdraw = np.zeros(shape, dtype=self.floatType)
+        self.amountFinalWithdraw = np.zeros(shape, dtype=self.floatType)
+        self.safetyTreshold = np.zeros(shape, dtype=self.floatType)
+        self.areDepositorsIntelligent = not ExogenousFactors.areDepositorsZeroIntelligenceAgents
+        if self.areDepositorsIntelligent:
+            number_options = DepositorEWAStrategy.get_number_alpha_options()
+            self.depositorStrategyA = np.zeros(shape + (number_options,), dtype=self.floatType)
+            self.depositorStrategyP = np.zeros(shape + (number_options,), dtype=self.floatType)
+            self.depositorStrategyProfit = np.zeros(shape + (number_options,), dtype=self.floatType)
+            self.depositorStrategyInsolvencyCounter = np.zeros(shape + (number_options,),
+                                                               dtype=np.int32 if compact else np.int64)
+            self.depositorChosenStrategy = np.zeros(shape, dtype=self.get_index_type(number_options, compact))
+
+        self.loanAmount = np.zeros(self.corporateClientBank.shape, dtype=self.floatType)
+        self.percentageRepaid = np.zeros(self.corporateClientBank.shape, dtype=self.floatType)
+        if ExogenousFactors.standardCorporateClients:
+            self.probabilityOfDefault = ExogenousFactors.standardCorporateClientDefaultRate
+            self.lossGivenDefault = ExogenousFactors.standardCorporateClientLossGivenDefault
+            self.loanInterestRate = ExogenousFactors.standardCorporateClientLoanInterestRate
+        else:
+            self.probabilityOfDefault = ExogenousFactors.wholesaleCorporateClientDefaultRate
+            self.lossGivenDefault = ExogenousFactors.wholesaleCorporateClientLossGivenDefault
+            self.loanInterestRate = ExogenousFactors.wholesaleCorporateClientLoanInterestRate
+
+    def step(self):
+        self.reset_cycle()
+        self.period_0()
+        self.period_1()
+        self.period_2()
+
+    def run_model(self, n):
+        for i in range(n):
+            self.step()
+
+    # Helpers
+
+    def get_random_uniform(self, size):
+        # one row per replication, each from its own stream
+        return np.array([rs.uniform(0, 1, size) for rs in self.random])
+
+    def sum_by_bank(self, values, groups):
+        k, n = self.numberReplications, self.numberBanks
+        return Util.sum_by_group(values.ravel(), groups, k * n).reshape(k, n)
+
+    @staticmethod
+    def get_index_type(number_options, compact):
+        if not compact:
+            return np.int64
+        for index_type in (np.int8, np.int16):
+            if number_options <= np.iinfo(index_type).max + 1:
+                return index_type
+        return np.int32
+
+    def get_flags_array(self, shape):
+        # booleans, or bits packed along the bank axis in compact mode
+        if self.compact:
+            return np.zeros(shape[:-1] + ((shape[-1] + 7) // 8,), dtype=np.uint8)
+        return np.zeros(shape, dtype=bool)
+
+    def set_flags(self, name, flags):
+        setattr(self, name, np.packbits(flags, axis=-1) if self.compact else flags)
+
+    def get_flags(self, name):
+        flags = getattr(self, name)
+        if self.compact:
+            return np.unpackbits(flags, axis=-1, count=self.numberBanks).astype(bool)
+        return flags
+
+    def get_state_size(self):
+        # bytes held in arrays, e.g. to compare the compact mode with the default one
+        values = list(vars(self).values()) + list(vars(self.balanceSheet).values())
+        if self.auxBalanceSheet is not None:
+            values += list(vars(self.auxBalanceSheet).values())
+        return sum(value.nbytes for value in values if isinstance(value, np.ndarray))
+
+    @staticmethod
+    def choose_strategies(list_p, probability_threshold):
+        # first strategy whose cumulative probability is above the threshold
+        list_f = np.cumsum(list_p, axis=-1)
+        chosen = np.sum(list_f <= probability_threshold[..., np.newaxis], axis=-1)
+        return np.minimum(chosen, list_p.shape[-1] - 1)
+
+    # Cycle
+
+    def reset_cycle(self):
+        self.cycle += 1
+        # Banks
+        self.liquidityNeeds[:] = 0
+        self.bankRunOccurred[:] = False
+        self.insolvent[:] = False
+        self.withdrawalsCounter[:] = 0
+        # Clearing House
+        self.interbankLendingMatrix[:] = 0
+        self.vetor_recuperacao[:] = 1
+        self.biggestInterbankDebt[:] = 0
+        self.totalInterbankDebt[:] = 0
+        self.totalCollateralDeficit[:] = 0
+        self.totalCollateralSurplus[:] = 0
+        # Central Bank
+        self.insolvencyPerCycleCounter[:] = 0
+        self.insolvencyDueToContagionPerCycleCounter[:] = 0
+        self.reset_populations()
+
+    def reset_populations(self):
+        # Depositors
+        self.deposit[:] = self.initialDeposit
+        self.lastPercentageWithdrawn[:] = 0
+        # Corporate Clients
+        self.loanAmount[:] = 0
+        self.percentageRepaid[:] = 0
+
+    def period_0(self):
+        # Depositors
+        if self.areDepositorsIntelligent:
+            self.update_depositor_strategies()
+
+        # Banks
+        if self.areBanksIntelligent:
+            self.update_bank_strategies()
+            self.setup_balance_sheet_intelligent()
+        self.setup_balance_sheet()
+        self.auxBalanceSheet = BalanceSheet()
+        for field, value in vars(self.balanceSheet).items():
+            setattr(self.auxBalanceSheet, field, value.copy())
+
+        # Central Bank
+        if self.isCentralBankIntelligent:
+            self.update_central_bank_strategy()
+        if ExogenousFactors.isCapitalRequirementActive:
+            self.observe_banks_capital_adequacy()
+
+    def period_1(self):
+        #  Liquidity Shock
+        if ExogenousFactors.areBankRunsPossible:
+            self.withdraw_deposits()
+        # First, banks try to use liquid assets to pay early withdrawals...
+        self.use_liquid_assets_to_pay_depositors_back()
+        # ... if needed, they will try interbank market by clearing house.
+        if self.interbankLendingMarketAvailable:
+            self.organize_interbank_market_common()
+            if self.clearingGuaranteeAvailable:
+                self.interbank_clearing_guarantee()
+        # ... if banks still needs liquidity, central bank might rescue...
+        if self.offersDiscountWindowLending:
+            self.organize_discount_window_lending()
+        # ... if everything so far isn't enough, banks will sell illiquid assets at discount prices.
+        if ExogenousFactors.banksMaySellNonLiquidAssetsAtDiscountPrices:
+            self.use_non_liquid_assets_to_pay_depositors_back(self.liquidityNeeds < 0)
+
+    def period_2(self):
+        self.accrue_interest_balance_sheet()
+        self.collect_loans()
+        self.accrue_interbank_interest()
+
+        too_big_to_fail = self.are_banks_too_big_to_fail(np.ones(self.liquidityNeeds.shape, dtype=bool))
+        self.bailout(too_big_to_fail)
+        self.use_non_liquid_assets_to_pay_depositors_back(self.liquidityNeeds < 0)
+        self.punish_insolvency(self.balanceSheet.capital > 0)
+
+        if self.interbankLendingMarketAvailable:
+            self.interbank_contagion()
+
+        self.calculate_profit()
+        self.calculate_central_bank_final_utility()
+        self.liquidate(self.balanceSheet.capital > 0)
+        self.calculate_depositors_final_utility()
+
+    # Banks
+
+    def update_bank_strategies(self):
+        list_a = 0.9999 * self.bankStrategyA + self.bankStrategyProfitPercentageDamped
+        # exponentials in float64 in any mode, so that they overflow as in BankingModel
+        _exp = np.exp(list_a, dtype=np.float64)
+        self.bankStrategyA = list_a
+        self.bankStrategyP = (_exp / np.sum(_exp, axis=2, keepdims=True)).astype(self.floatType, copy=False)
+        probability_threshold = self.get_random_uniform(self.numberBanks)
+        self.bankChosenStrategy = self.choose_strategies(self.bankStrategyP, probability_threshold).astype(
+            self.bankChosenStrategy.dtype, copy=False)
+
+    def setup_balance_sheet_intelligent(self):
+        alpha_index, beta_index = np.divmod(self.bankChosenStrategy, BankEWAStrategy.get_number_beta_options())
+        bs = self.balanceSheet
+        bs.liquidAssets = self.initialSize * BankEWAStrategy.get_beta_values()[beta_index]
+        bs.nonFinancialSectorLoan = self.initialSize - bs.liquidAssets
+        bs.interbankLoan = np.zeros_like(bs.liquidAssets)
+        bs.discountWindowLoan = np.zeros_like(bs.liquidAssets)
+        bs.deposits = self.initialSize * (BankEWAStrategy.get_alpha_values()[alpha_index] - 1)
+        self.liquidityNeeds = np.zeros_like(bs.liquidAssets)
+
+    def setup_balance_sheet(self):
+        loan_per_coporate_client = self.balanceSheet.nonFinancialSectorLoan / self.numberCorporateClients
+        self.loanAmount = np.take_along_axis(loan_per_coporate_client, self.corporateClientBank, axis=1).astype(
+            self.floatType, copy=False)
+        deposit_per_depositor = -self.balanceSheet.deposits / self.numberDepositors
+        self.initialDeposit = np.take_along_axis(deposit_per_depositor, self.depositorBank, axis=1).astype(
+            self.floatType, copy=False)
+        self.deposit = self.initialDeposit.copy()
+        self.lastPercentageWithdrawn[:] = 0
+
+    def get_real_sector_risk_weighted_assets(self):
+        if ExogenousFactors.standardCorporateClients:
+            return self.balanceSheet.nonFinancialSectorLoan * ExogenousFactors.CorporateLoanRiskWeight
+        # the first client of each bank sets the risk weight, as in Bank.get_real_sector_risk_weighted_assets
+        loan_amount = self.get_first_loan_amount()
+        if self.probabilityOfDefault == ExogenousFactors.retailCorporateClientDefaultRate:
+            return loan_amount * ExogenousFactors.retailCorporateLoanRiskWeight
+        elif self.probabilityOfDefault == ExogenousFactors.wholesaleCorporateClientDefaultRate:
+            return loan_amount * ExogenousFactors.wholesaleCorporateLoanRiskWeight
+        else:
+            return loan_amount * ExogenousFactors.CorporateLoanRiskWeight
+
+    def get_first_loan_amount(self):
+        return np.take_along_axis(self.loanAmount, self.firstCorporateClient, axis=1)
+
+    def get_total_loans(self):
+        return self.sum_by_bank(self.loanAmount, self.corporateClientGroup)
+
+    def get_capital_adequacy_ratio(self):
+        bs = self.balanceSheet
+        capital = bs.capital
+        total_risk_weighted_assets = bs.liquidAssets * ExogenousFactors.CashRiskWeight + \
+            self.get_real_sector_risk_weighted_assets()
+        total_risk_weighted_assets = np.where(
+            bs.interbankLoan >= 0,
+            total_risk_weighted_assets + bs.interbankLoan * ExogenousFactors.InterbankLoanRiskWeight,
+            total_risk_weighted_assets)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            capital_adequacy_ratio = -capital / total_risk_weighted_assets
+        return np.where((capital <= 0) & (total_risk_weighted_assets != 0), capital_adequacy_ratio, 0)
+
+    def scale_loans(self, factor):
+        # factor is given by bank; returns the reduction of the loans of each bank
+        original_loan_amount = self.loanAmount
+        self.loanAmount = (original_loan_amount * np.take_along_axis(factor, self.corporateClientBank, axis=1)).astype(
+            self.floatType, copy=False)
+        return self.sum_by_bank(original_loan_amount - self.loanAmount, self.corporateClientGroup)
+
+    def use_liquid_assets_to_pay_depositors_back(self):
+        bs = self.balanceSheet
+        needs_liquidity = self.liquidityNeeds <= 0
+        original_liquid_assets = bs.liquidAssets
+        self.liquidityNeeds = np.where(needs_liquidity, self.liquidityNeeds + original_liquid_assets,
+                                       self.liquidityNeeds)
+        bs.liquidAssets = np.where(needs_liquidity, np.maximum(self.liquidityNeeds, 0), bs.liquidAssets)
+        total_paid = original_liquid_assets - bs.liquidAssets
+        bs.deposits = np.where(needs_liquidity, bs.deposits + total_paid, bs.deposits)
+
+    def use_non_liquid_assets_to_pay_depositors_back(self, banks):
+        # one fire sale market per replication
+        self.liquidityNeeds, proportion_sold, _ = FireSaleMarket.sell(self.balanceSheet, self.liquidityNeeds, banks)
+        self.scale_loans(1 - proportion_sold)
+
+    def accrue_interest_balance_sheet(self):
+        bs = self.balanceSheet
+        bs.discountWindowLoan = bs.discountWindowLoan * (1 + ExogenousFactors.centralBankLendingInterestRate)
+        bs.liquidAssets = bs.liquidAssets * (1 + self.liquidAssetsInterestRate)
+        deposits_interest_rate = 1 + self.depositInterestRate
+        bs.deposits = bs.deposits * deposits_interest_rate
+        self.deposit *= deposits_interest_rate
+
+    def collect_loans(self):
+        defaulted = self.get_random_uniform(self.loanAmount.shape[1]) <= self.probabilityOfDefault
+        amount_paid = np.where(defaulted,
+                               self.loanAmount * (1 - self.lossGivenDefault),
+                               self.loanAmount * (1 + self.loanInterestRate))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.percentageRepaid = np.where(self.loanAmount == 0, 0, amount_paid / self.loanAmount)
+        self.loanAmount = amount_paid
+        self.balanceSheet.nonFinancialSectorLoan = self.sum_by_bank(amount_paid, self.corporateClientGroup)
+
+    def calculate_profit(self):
+        if not self.areBanksIntelligent:
+            return
+        bs, aux = self.balanceSheet, self.auxBalanceSheet
+
+        bank_run_occurred = self.withdrawalsCounter > self.numberDepositors / 2
+        self.set_flags('bankRunOccurred', bank_run_occurred)
+        delta = aux.nonFinancialSectorLoan - bs.nonFinancialSectorLoan
+        bs.nonFinancialSectorLoan = np.where(bank_run_occurred & (delta > 0),
+                                             bs.nonFinancialSectorLoan - delta * 0.02, bs.nonFinancialSectorLoan)
+
+        # BalanceSheet.assets + BalanceSheet.liabilities, interbank loans are counted on both sides
+        resulting_capital = (bs.liquidAssets + bs.nonFinancialSectorLoan + bs.interbankLoan) + \
+            (bs.deposits + bs.discountWindowLoan + bs.interbankLoan)
+        original_capital = (aux.liquidAssets + aux.nonFinancialSectorLoan + aux.interbankLoan) + \
+            (aux.deposits + aux.discountWindowLoan + aux.interbankLoan)
+        if ExogenousFactors.banksHaveLimitedLiability:
+            resulting_capital = np.maximum(resulting_capital, 0)
+        strategy_profit = resulting_capital - original_capital
+
+        if ExogenousFactors.isCapitalRequirementActive:
+            minimum_capital_ratio_required = self.minimumCapitalAdequacyRatio[:, np.newaxis]
+            current_capital_ratio = self.get_capital_adequacy_ratio()
+            strategy_profit = np.where(current_capital_ratio < minimum_capital_ratio_required,
+                                       strategy_profit - (minimum_capital_ratio_required - current_capital_ratio),
+                                       strategy_profit)
+
+        # Return on Equity, based on initial shareholders equity.
+        strategy_profit_percentage = -strategy_profit / aux.capital
+        self.record_bank_profits(strategy_profit, strategy_profit_percentage)
+
+    def record_bank_profits(self, strategy_profit, strategy_profit_percentage):
+        k, n = np.indices(self.bankChosenStrategy.shape)
+        chosen = (k, n, self.bankChosenStrategy)
+        self.bankStrategyProfit[chosen] = strategy_profit
+        self.bankStrategyProfitPercentage[chosen] = strategy_profit_percentage
+        self.bankStrategyProfitPercentageDamped[chosen] = strategy_profit_percentage * self.bankEWADampingFactor
+
+    def liquidate(self, banks):
+        percentage_deposits_payable = CentralBank.liquidate(self.balanceSheet, banks)
+        self.apply_haircuts(percentage_deposits_payable)
+
+    # Depositors
+
+    def update_depositor_strategies(self):
+        list_a = self.depositorStrategyA + self.depositorStrategyProfit
+        _exp = np.exp(list_a, dtype=np.float64)
+        self.depositorStrategyA = list_a
+        self.depositorStrategyP = (_exp / np.sum(_exp, axis=2, keepdims=True)).astype(self.floatType, copy=False)
+        probability_threshold = self.get_random_uniform(self.deposit.shape[1])
+        self.depositorChosenStrategy = self.choose_strategies(self.depositorStrategyP, probability_threshold).astype(
+            self.depositorChosenStrategy.dtype, copy=False)
+        self.safetyTreshold = DepositorEWAStrategy.get_alpha_values()[self.depositorChosenStrategy].astype(
+            self.floatType, copy=False)
+
+    def apply_haircuts(self, percentage_deposits_payable):
+        # one percentage per bank
+        self.deposit *= np.take_along_axis(percentage_deposits_payable, self.depositorBank, axis=1)
+
+    def withdraw_deposits(self):
+        if self.areDepositorsIntelligent and ExogenousFactors.areBankRunsSequential:
+            shock = self.get_sequential_shock()
+        elif self.areDepositorsIntelligent:
+            # Smart depositors
+            bank_car = np.take_along_axis(self.get_capital_adequacy_ratio(), self.depositorBank, axis=1)
+            # thresholds from the strategies, as a float32 threshold would be rounded away from the ratios
+            safety_treshold = DepositorEWAStrategy.get_alpha_values()[self.depositorChosenStrategy]
+            shock = np.where(bank_car > safety_treshold, 0, ExogenousFactors.amountWithdrawn)
+        else:
+            # Simulating a Diamond & Dribvig banksim...
+            random_uniform = self.get_random_uniform(self.deposit.shape[1])
+            shock = np.where(random_uniform < ExogenousFactors.probabilityofWithdrawal,
+                             ExogenousFactors.amountWithdrawn, 0)
+        shock = shock.astype(self.floatType, copy=False)
+        self.lastPercentageWithdrawn = shock
+        amount_withdrawn = self.deposit * shock
+        self.deposit -= amount_withdrawn
+        self.amountEarlyWithdraw = amount_withdrawn
+
+        k, n = self.numberReplications, self.numberBanks
+        withdrawals = self.depositorGroup[amount_withdrawn.ravel() > 0]
+        self.withdrawalsCounter += np.bincount(withdrawals, minlength=k * n).reshape(k, n)
+        self.liquidityNeeds -= self.sum_by_bank(amount_withdrawn, self.depositorGroup)
+
+    def get_sequential_shock(self):
+        # as DepositorPopulation.get_sequential_shock, the banks of every replication being apart
+        bank_run = SequentialBankRun.from_balance_sheet(self.balanceSheet, self.get_real_sector_risk_weighted_assets())
+        order = SequentialBankRun.get_order(self.get_random_uniform(self.deposit.shape[1]).ravel(),
+                                            self.depositorGroup)
+        withdraws = np.zeros(self.depositorGroup.shape, dtype=bool)
+        withdraws[order] = bank_run.get_withdrawals(
+            self.depositorGroup[order],
+            self.deposit.ravel()[order].astype(np.float64) * ExogenousFactors.amountWithdrawn,
+            DepositorEWAStrategy.get_alpha_values()[self.depositorChosenStrategy.ravel()[order]])
+        return np.where(withdraws, ExogenousFactors.amountWithdrawn, 0).reshape(self.deposit.shape)
+
+    def calculate_depositors_final_utility(self):
+        if not self.areDepositorsIntelligent:
+            return
+        self.amountFinalWithdraw = self.deposit.copy()
+        final_consumption = self.amountEarlyWithdraw + self.amountFinalWithdraw
+
+        lost_money = final_consumption < self.initialDeposit
+        k, d = np.indices(self.depositorChosenStrategy.shape)
+        chosen = (k, d, self.depositorChosenStrategy)
+        if ExogenousFactors.isDepositInsuranceAvailable:
+            final_consumption = np.where(
+                lost_money, self.initialDeposit * (1 + ExogenousFactors.depositInterestRate), final_consumption)
+        else:
+            self.depositorStrategyInsolvencyCounter[chosen] += lost_money
+
+        with np.errstate(divide='ignore'):
+            profit = 100 * np.log(final_consumption / self.initialDeposit)
+        self.depositorStrategyProfit[chosen] = profit
+
+    # Clearing House
+
+    def organize_interbank_market_common(self):
+        bs = self.balanceSheet
+        amount_left = self.liquidityNeeds.copy()
+        for k, rs in enumerate(self.random):
+            needs_liquidity = self.liquidityNeeds[k] <= 0
+            banks_offering_liquidity = np.flatnonzero(~needs_liquidity)
+            banks_needing_liquidity = np.flatnonzero(needs_liquidity)
+
+            if ExogenousFactors.interbankPriority == InterbankPriority.Random:
+                rs.shuffle(banks_offering_liquidity)
+                rs.shuffle(banks_needing_liquidity)
+            elif ExogenousFactors.interbankPriority == InterbankPriority.RiskSorted:
+                # sorted by (alpha, beta), then reversed, as in ClearingHouse.sort_queues_by_risk
+                strategy = self.bankChosenStrategy[k]
+                banks_offering_liquidity = banks_offering_liquidity[
+                    np.argsort(strategy[banks_offering_liquidity], kind='stable')[::-1]]
+                banks_needing_liquidity = banks_needing_liquidity[
+                    np.argsort(strategy[banks_needing_liquidity], kind='stable')[::-1]]
+
+            Kernels.match_lenders_and_borrowers(
+                banks_offering_liquidity, banks_needing_liquidity, amount_left[k], self.interbankLendingMatrix[k])
+
+        bs.interbankLoan = np.sum(self.interbankLendingMatrix, axis=2, dtype=np.float64)
+        offers_liquidity = self.liquidityNeeds > 0
+        # if there is any amount left offered, assign it to liquid assets
+        bs.liquidAssets = np.where(offers_liquidity, amount_left, bs.liquidAssets)
+        amount_left = np.where(offers_liquidity, 0, amount_left)
+        # if bank used interbank loan to pay depositors back, adjust deposit account
+        bs.deposits = np.where(bs.interbankLoan < 0, bs.deposits - bs.interbankLoan, bs.deposits)
+        self.liquidityNeeds = amount_left
+
+    def interbank_clearing_guarantee(self):
+        bs = self.balanceSheet
+        interbank_loan = bs.interbankLoan
+        interbank_debtor = interbank_loan < 0
+
+        # total and biggest interbank debt
+        self.biggestInterbankDebt = np.minimum(0, np.min(interbank_loan, axis=1))
+        self.totalInterbankDebt = -Util.ordered_sum(np.where(interbank_debtor, interbank_loan, 0), axis=1)
+
+        # guarantees
+        capital = bs.capital
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = interbank_loan / self.totalInterbankDebt[:, np.newaxis]
+        potential_collateral = self.biggestInterbankDebt[:, np.newaxis] * ratio
+        # both assets can be used as collateral
+        feasible_collateral = np.minimum(potential_collateral, bs.liquidAssets + bs.nonFinancialSectorLoan)
+        # minimize to avoid insolvent bank to use collateral
+        feasible_collateral = np.minimum(feasible_collateral,
+                                         np.maximum(0, -interbank_loan - np.minimum(0, capital)))
+        # interbank debit balance impact
+        outstanding_amount_impact = np.maximum(0, np.minimum(capital + feasible_collateral, -interbank_loan))
+        # residual collateral
+        residual = feasible_collateral - outstanding_amount_impact
+
+        feasible_collateral = np.where(interbank_debtor, feasible_collateral, 0)
+        outstanding_amount_impact = np.where(interbank_debtor, outstanding_amount_impact, 0)
+        residual = np.where(interbank_debtor, residual, 0)
+
+        # total of collateral deficit or surplus
+        self.totalCollateralDeficit = Util.ordered_sum(np.where(residual < 0, residual, 0), axis=1)
+        self.totalCollateralSurplus = Util.ordered_sum(np.where(residual < 0, 0, residual), axis=1)
+
+        # residual collateral redistributed
+        surplus = self.totalCollateralSurplus[:, np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = np.minimum(1.0, -self.totalCollateralDeficit[:, np.newaxis] / surplus)
+        redistributed_collateral = np.where(residual < 0, residual, np.where(surplus == 0, 0, (1 - f) * residual))
+
+        # final total collateral
+        collateral_adjustment = outstanding_amount_impact + redistributed_collateral
+        collateral = feasible_collateral - collateral_adjustment
+        bs.nonFinancialSectorLoan = bs.nonFinancialSectorLoan - np.maximum(0, collateral - bs.liquidAssets)
+        bs.liquidAssets = bs.liquidAssets - np.minimum(bs.liquidAssets, collateral)
+
+    def accrue_interbank_interest(self):
+        self.interbankLendingMatrix *= (1 + self.interbankInterestRate)
+        self.balanceSheet.interbankLoan = np.sum(self.interbankLendingMatrix, axis=2, dtype=np.float64)
+
+    def interbank_contagion(self):
+        bs = self.balanceSheet
+        insolvent_debtor = (bs.capital > 0) & (bs.interbankLoan < 0)
+        if self.clearingGuaranteeAvailable:
+            _max = np.maximum(0, -self.totalCollateralDeficit - self.totalCollateralSurplus)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                recovery = (self.totalInterbankDebt + _max) / self.totalInterbankDebt
+            recovery = np.where(insolvent_debtor, recovery[:, np.newaxis], 1)
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                recovery = (bs.interbankLoan + np.minimum(-bs.interbankLoan, bs.capital)) / bs.interbankLoan
+            recovery = np.where(insolvent_debtor, recovery, 1)
+        self.vetor_recuperacao = recovery
+
+        matrix = self.interbankLendingMatrix
+        matrix[:] = np.where(matrix > 0, matrix * recovery[:, np.newaxis, :], matrix * recovery[:, :, np.newaxis])
+        bs.interbankLoan = np.sum(matrix, axis=2, dtype=np.float64)
+
+        insolvent = bs.capital > 0
+        self.insolvencyDueToContagionPerCycleCounter += np.sum(insolvent, axis=1)
+        self.punish_insolvency(insolvent)
+
+    # Central Bank
+
+    def update_central_bank_strategy(self):
+        list_a = 0.9999 * self.centralBankStrategyA + self.centralBankStrategyProfit
+        _exp = np.exp(list_a - np.max(list_a, axis=1, keepdims=True))
+        self.centralBankStrategyA = list_a
+        self.centralBankStrategyP = _exp / np.sum(_exp, axis=1, keepdims=True)
+        probability_threshold = self.get_random_uniform(1)[:, 0]
+        self.centralBankChosenStrategy = self.choose_strategies(self.centralBankStrategyP, probability_threshold)
+        self.minimumCapitalAdequacyRatio = CentralBankEWAStrategy.get_alpha_values()[self.centralBankChosenStrategy]
+
+    def observe_banks_capital_adequacy(self):
+        minimum_capital_ratio_required = self.minimumCapitalAdequacyRatio[:, np.newaxis]
+        current_capital_ratio = self.get_capital_adequacy_ratio()
+        banks = current_capital_ratio < minimum_capital_ratio_required
+        adjustment_factor = np.where(banks, current_capital_ratio / minimum_capital_ratio_required, 1)
+        bs = self.balanceSheet
+        bs.liquidAssets = np.where(banks, bs.liquidAssets + self.scale_loans(adjustment_factor), bs.liquidAssets)
+        bs.nonFinancialSectorLoan = np.where(banks, self.get_total_loans(), bs.nonFinancialSectorLoan)
+
+    def are_banks_too_big_to_fail(self, banks):
+        # one draw per bank in 'banks', in bank order
+        too_big_to_fail = np.zeros(banks.shape, dtype=bool)
+        if ExogenousFactors.isTooBigToFailPolicyActive:
+            for k, rs in enumerate(self.random):
+                random_uniform = rs.uniform(0, 1, np.count_nonzero(banks[k]))
+                too_big_to_fail[k, banks[k]] = random_uniform < 2 * self.marketShare[k, banks[k]]
+        return too_big_to_fail
+
+    def organize_discount_window_lending(self):
+        bs = self.balanceSheet
+        illiquid = self.liquidityNeeds < 0
+        if ExogenousFactors.isTooBigToFailPolicyActive:
+            eligible = self.are_banks_too_big_to_fail(illiquid)
+        else:
+            # If Central Bank offers lending and TBTF is not active, assume all banks get help
+            eligible = illiquid
+        loan_amount = np.where(eligible, np.minimum(self.liquidityNeeds, 0), 0)
+        bs.discountWindowLoan = np.where(illiquid, loan_amount, bs.discountWindowLoan)
+        bs.deposits = np.where(illiquid, bs.deposits - loan_amount, bs.deposits)
+        self.liquidityNeeds = np.where(illiquid, self.liquidityNeeds - loan_amount, self.liquidityNeeds)
+
+    def bailout(self, banks):
+        self.liquidityNeeds = CentralBank.bailout(self.balanceSheet, self.liquidityNeeds, banks)
+
+    def punish_insolvency(self, banks):
+        self.set_flags('insolvent', self.get_flags('insolvent') | banks)
+        self.insolvencyPerCycleCounter += CentralBank.punish_insolvencies(self.balanceSheet, banks)
+
+    def calculate_central_bank_final_utility(self):
+        if self.isCentralBankIntelligent:
+            total_loans = Util.ordered_sum(self.balanceSheet.nonFinancialSectorLoan, axis=1)
+            potential_total_size = self.numberBanks
+            ratio = total_loans / potential_total_size
+            profit = ratio - (potential_total_size * self.insolvencyPerCycleCounter)
+            self.centralBankStrategyProfit[np.arange(self.numberReplications), self.centralBankChosenStrategy] = profit
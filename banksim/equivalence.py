@@ -0,0 +1,275 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from enum import Enum
+
+import numpy as np
+
+from banksim.ensemble import BankingEnsemble
+from banksim.exogeneous_factors import ExogenousFactors, SimulationType
+from banksim.model import BankingModel
+from banksim.scenario import Scenario
+from banksim.sharding import ShardedModel
+from banksim.strategies.bank_ewa_strategy import BankEWAStrategy
+
+
+def get_random_state_digest(random_state):
+    # Identifies the position of a Mersenne Twister stream: equal digests, same draws consumed so far
+    name, key, position = random_state.get_state()[:3]
+    digest = hashlib.sha256(key.tobytes() + int(position).to_bytes(4, 'little')).digest()
+    return np.frombuffer(digest[:8], dtype=np.int64)[0]
+
+
+class ReferenceEngine:
+    """
+    The object model (BankingModel), against which other engines are checked.
+    """
+
+    name = 'reference'
+
+    @staticmethod
+    def run(simulation_type, seed, number_of_banks, cycles, exogenous_factors=None):
+        # State at the end of every cycle, in the fields of Trace.fields
+        model = BankingModel(simulation_type, exogenous_factors, number_of_banks, seed)
+        schedule = model.schedule
+        banks, central_bank, depositors = schedule.banks, schedule.central_bank, schedule.depositors
+        for i in range(cycles):
+            model.step()
+            state = {field: np.array([getattr(bank.balanceSheet, field) for bank in banks], dtype=float)
+                     for field in Trace.balanceSheetFields}
+            state['liquidityNeeds'] = np.array([bank.liquidityNeeds for bank in banks], dtype=float)
+            state['interbankLendingMatrix'] = schedule.clearing_house.interbankLendingMatrix.copy()
+            state['bankStrategy'] = np.array([ReferenceEngine.get_bank_strategy(bank) for bank in banks])
+            state['centralBankStrategy'] = np.array(
+                central_bank.currentlyChosenStrategy.alphaIndex if central_bank.isIntelligent else -1)
+            state['depositorStrategy'] = depositors.currentlyChosenStrategy.copy() if depositors.isIntelligent \
+                else np.full(len(depositors), -1)
+            state['insolvencies'] = np.array(central_bank.insolvencyPerCycleCounter)
+            state['contagions'] = np.array(central_bank.insolvencyDueToContagionPerCycleCounter)
+            state['randomState'] = get_random_state_digest(np.random)
+            yield state
+        model.running = False
+
+    @staticmethod
+    def get_bank_strategy(bank):
+        # index of the chosen strategy, as in BankingEnsemble, or -1 for a zero intelligence bank (that has none)
+        if not bank.isIntelligent:
+            return -1
+        strategy = bank.currentlyChosenStrategy
+        return strategy.alphaIndex * BankEWAStrategy.get_number_beta_options() + strategy.betaIndex
+
+
+class EnsembleEngine:
+    """
+    BankingEnsemble, one replication per seed.
+    """
+
+    name = 'ensemble'
+
+    @staticmethod
+    def run(simulation_type, seed, number_of_banks, cycles, exogenous_factors=None):
+        ensemble = BankingEnsemble([seed], simulation_type, exogenous_factors, number_of_banks)
+        n = ensemble.numberBanks
+        for i in range(cycles):
+            ensemble.step()
+            state = {field: getattr(ensemble.balanceSheet, field)[0].copy() for field in Trace.balanceSheetFields}
+            state['liquidityNeeds'] = ensemble.liquidityNeeds[0].copy()
+            state['interbankLendingMatrix'] = ensemble.interbankLendingMatrix[0].copy()
+            state['bankStrategy'] = ensemble.bankChosenStrategy[0].copy() if ensemble.areBanksIntelligent \
+                else np.full(n, -1)
+            state['centralBankStrategy'] = np.array(
+                ensemble.centralBankChosenStrategy[0] if ensemble.isCentralBankIntelligent else -1)
+            state['depositorStrategy'] = ensemble.depositorChosenStrategy[0].copy() \
+                if ensemble.areDepositorsIntelligent else np.full(ensemble.deposit.shape[1], -1)
+            state['insolvencies'] = np.array(ensemble.insolvencyPerCycleCounter[0])
+            state['contagions'] = np.array(ensemble.insolvencyDueToContagionPerCycleCounter[0])
+            state['randomState'] = get_random_state_digest(ensemble.random[0])
+            yield state
+
+
+class ShardedEngine:
+    """
+    ShardedModel, with its populations in three worker processes.
+    """
+
+    name = 'sharded'
+    numberShards = 3
+
+    @staticmethod
+    def run(simulation_type, seed, number_of_banks, cycles, exogenous_factors=None):
+        with ShardedModel(seed, simulation_type, exogenous_factors, number_of_banks,
+                          ShardedEngine.numberShards) as model:
+            n = model.numberBanks
+            for i in range(cycles):
+                model.step()
+                state = {field: getattr(model.balanceSheet, field)[0].copy() for field in Trace.balanceSheetFields}
+                state['liquidityNeeds'] = model.liquidityNeeds[0].copy()
+                state['interbankLendingMatrix'] = model.interbankLendingMatrix[0].copy()
+                state['bankStrategy'] = model.bankChosenStrategy[0].copy() if model.areBanksIntelligent \
+                    else np.full(n, -1)
+                state['centralBankStrategy'] = np.array(
+                    model.centralBankChosenStrategy[0] if model.isCentralBankIntelligent else -1)
+                depositor_strategies = model.get_depositor_strategies()
+                state['depositorStrategy'] = depositor_strategies if depositor_strategies is not None \
+                    else np.full(np.sum(model.numberDepositors), -1)
+                state['insolvencies'] = np.array(model.insolvencyPerCycleCounter[0])
+                state['contagions'] = np.array(model.insolvencyDueToContagionPerCycleCounter[0])
+                state['randomState'] = get_random_state_digest(model.random[0])
+                yield state
+
+
+class Divergence:
+    """
+    First difference between two traces: cycle (1-based), field and agent (index into the field).
+    """
+
+    def __init__(self, cycle, field, agent, expected, actual):
+        self.cycle = cycle
+        self.field = field
+        self.agent = agent
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        if self.field == 'randomState':
+            return 'cycle {}: different number of random draws'.format(self.cycle)
+        return 'cycle {}: {}{} expected {!r}, got {!r}'.format(
+            self.cycle, self.field, list(self.agent) if self.agent else '', self.expected, self.actual)
+
+
+class Trace:
+    """
+    Per-cycle state of one run: balance sheets, liquidity needs and strategy choices of every bank, the
+    interbank lending matrix, strategy choices of the central bank and depositors (-1 if they do not
+    learn), insolvency counters and the position of the random stream. Saved as a .npz golden trace.
+    """
+
+    balanceSheetFields = ('deposits', 'discountWindowLoan', 'interbankLoan', 'nonFinancialSectorLoan',
+                          'liquidAssets')
+    # in the order they are compared, the random stream last since any divergence usually moves it too
+    fields = balanceSheetFields + ('liquidityNeeds', 'interbankLendingMatrix', 'bankStrategy',
+                                   'centralBankStrategy', 'depositorStrategy', 'insolvencies', 'contagions',
+                                   'randomState')
+
+    def __init__(self, simulation_type, seed, number_of_banks, cycles, exogenous_factors=None, values=None):
+        self.simulation_type = simulation_type
+        self.seed = seed
+        self.number_of_banks = number_of_banks
+        self.cycles = cycles
+        self.exogenous_factors = dict(exogenous_factors or {})
+        self.values = values
+
+    @classmethod
+    def record(cls, engine, simulation_type, seed, number_of_banks, cycles, exogenous_factors=None):
+        trace = cls(simulation_type, seed, number_of_banks, cycles, exogenous_factors)
+        states = list(trace.replay(engine))
+        trace.values = {field: np.array([state[field] for state in states]) for field in cls.fields}
+        return trace
+
+    def replay(self, engine):
+        # The configuration of the trace run again by an engine: the same seed, so the same draws
+        ExogenousFactors.reset()
+        try:
+            yield from engine.run(self.simulation_type, self.seed, self.number_of_banks, self.cycles,
+                                  self.exogenous_factors)
+        finally:
+            ExogenousFactors.reset()
+
+    def compare(self, engine, rtol=1e-9, atol=1e-12):
+        """
+        Runs the engine and returns the first Divergence from this trace, or None if it stays within tolerance.
+        """
+        for cycle, state in enumerate(self.replay(engine), 1):
+            for field in self.fields:
+                expected, actual = self.values[field][cycle - 1], np.asarray(state[field])
+                if expected.shape != actual.shape:
+                    return Divergence(cycle, field, None, expected.shape, actual.shape)
+                if np.issubdtype(expected.dtype, np.floating):
+                    different = ~np.isclose(actual, expected, rtol=rtol, atol=atol, equal_nan=True)
+                else:
+                    different = actual != expected
+                if np.any(different):
+                    agent = tuple(int(i) for i in np.unravel_index(np.argmax(different), different.shape))
+                    return Divergence(cycle, field, agent, expected[agent].item(), actual[agent].item())
+        return None
+
+    def get_metadata(self):
+        exogenous_factors = {key: value.name if isinstance(value, Enum) else value
+                             for key, value in self.exogenous_factors.items()}
+        return {'simulation_type': self.simulation_type, 'seed': self.seed, 'number_of_banks': self.number_of_banks,
+                'cycles': self.cycles, 'exogenous_factors': exogenous_factors}
+
+    def save(self, path):
+        np.savez_compressed(path, metadata=json.dumps(self.get_metadata()), **self.values)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            metadata = json.loads(str(data['metadata']))
+            values = {field: data[field] for field in cls.fields}
+        metadata['exogenous_factors'] = Scenario.parse_exogenous_factors(metadata['exogenous_factors'])
+        return cls(values=values, **metadata)
+
+
+class GoldenTraces:
+    """
+    Directory of golden traces recorded from the reference engine, one per simulation type and seed, that
+    any other engine can be checked against before it is trusted with production runs.
+    """
+
+    engines = {ReferenceEngine.name: ReferenceEngine, EnsembleEngine.name: EnsembleEngine,
+               ShardedEngine.name: ShardedEngine}
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_paths(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith('.npz'))
+
+    def record(self, seeds=(1, 2, 3), cycles=50, number_of_banks=10, simulation_types=None, exogenous_factors=None):
+        os.makedirs(self.directory, exist_ok=True)
+        for simulation_type in simulation_types or SimulationType.__members__:
+            for seed in seeds:
+                trace = Trace.record(ReferenceEngine, simulation_type, seed, number_of_banks, cycles,
+                                     exogenous_factors)
+                trace.save(os.path.join(self.directory, '{}-{}.npz'.format(simulation_type, seed)))
+
+    def check(self, engine, rtol=1e-9, atol=1e-12):
+        # (path, first divergence or None) for every trace
+        return [(path, Trace.load(path).compare(engine, rtol, atol)) for path in self.get_paths()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m banksim.equivalence',
+                                     description='Records golden traces, or checks an engine against them.')
+    subparsers = parser.add_subparsers(dest='command')
+    # not a keyword of add_subparsers before Python 3.7
+    subparsers.required = True
+    record = subparsers.add_parser('record', help='record golden traces from the reference engine')
+    record.add_argument('directory')
+    record.add_argument('--seeds', type=int, nargs='+', default=[1, 2, 3])
+    record.add_argument('--cycles', type=int, default=50)
+    record.add_argument('--banks', type=int, default=10, help='number of banks')
+    check = subparsers.add_parser('check', help='check an engine against golden traces')
+    check.add_argument('directory')
+    check.add_argument('--engine', default=EnsembleEngine.name, choices=sorted(GoldenTraces.engines))
+    check.add_argument('--rtol', type=float, default=1e-9)
+    check.add_argument('--atol', type=float, default=1e-12)
+    args = parser.parse_args(argv)
+
+    golden_traces = GoldenTraces(args.directory)
+    if args.command == 'record':
+        golden_traces.record(args.seeds, args.cycles, args.banks)
+        return 0
+    failures = 0
+    for path, divergence in golden_traces.check(GoldenTraces.engines[args.engine], args.rtol, args.atol):
+        print('{}: {}'.format(os.path.basename(path), divergence or 'ok'))
+        failures += divergence is not None
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
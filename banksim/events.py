@@ -0,0 +1,158 @@
+import os
+from enum import IntEnum
+
+import numpy as np
+
+
+class EventType(IntEnum):
+    """
+    What happened to a bank, and what the amount of the event is:
+    Insolvency: capital shortfall of a bank found insolvent at the end of the cycle.
+    ContagionInsolvency: capital shortfall of a bank made insolvent by losses on interbank loans.
+    Bailout: liquidity and capital injected into a bank too big to fail.
+    DiscountWindowLoan: amount lent by the central bank.
+    FireSale: face value of the loans sold at a discount.
+    BankRun: deposits withdrawn from a bank more than half of whose depositors withdrew.
+    Liquidation: deposits lost by the depositors of a liquidated bank.
+    DepositInsurancePayout: amount the deposit insurance fund paid to the depositors of a liquidated bank.
+    """
+
+    Insolvency = 0
+    ContagionInsolvency = 1
+    Bailout = 2
+    DiscountWindowLoan = 3
+    FireSale = 4
+    BankRun = 5
+    Liquidation = 6
+    DepositInsurancePayout = 7
+
+
+class EventLog:
+    """
+    Append-only log of fixed-size event records (cycle, type, bank, amount), 17 bytes each.
+
+    Events are written to a preallocated buffer of 'capacity' records, and the buffer is appended to the
+    file at 'path' whenever it is full (or kept in memory if path is None), so recording costs a few array
+    assignments per cycle and the file can be memory-mapped by EventLog.load for post-mortem queries.
+    The insolvency counters of the central bank are the Insolvency plus ContagionInsolvency events of a cycle.
+    """
+
+    dtype = np.dtype([('cycle', '<i4'), ('type', 'u1'), ('bank', '<i4'), ('amount', '<f8')])
+    magic = b'BANKSIM-EVENTS-1'
+
+    def __init__(self, path=None, capacity=65536):
+        self.path = path
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=EventLog.dtype)
+        self.size = 0
+        self.chunks = []
+        if path is not None:
+            with open(path, 'wb') as f:
+                f.write(EventLog.magic)
+
+    def record(self, cycle, event_type, banks, amounts):
+        # One event per bank in 'banks' (indices), with the amounts given by bank or as a single value
+        banks = np.atleast_1d(banks)
+        number_events = len(banks)
+        if number_events == 0:
+            return
+        if self.size + number_events > self.capacity:
+            self.flush()
+        if number_events > self.capacity:
+            records = np.zeros(number_events, dtype=EventLog.dtype)
+        else:
+            records = self.buffer[self.size:self.size + number_events]
+            self.size += number_events
+        records['cycle'] = cycle
+        records['type'] = event_type
+        records['bank'] = banks
+        records['amount'] = amounts
+        if number_events > self.capacity:
+            self.write(records)
+
+    def write(self, records):
+        if self.path is None:
+            self.chunks.append(records.copy())
+        else:
+            # opened for every write, so that a model holding the log can still be pickled
+            with open(self.path, 'ab') as f:
+                f.write(records.tobytes())
+
+    def flush(self):
+        if self.size:
+            self.write(self.buffer[:self.size])
+            self.size = 0
+
+    def get_events(self):
+        """
+        Every event recorded so far, as Events (memory-mapped from the file, if any).
+        """
+        self.flush()
+        if self.path is None:
+            records = np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=EventLog.dtype)
+            return Events(records)
+        return EventLog.load(self.path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            if f.read(len(EventLog.magic)) != EventLog.magic:
+                raise ValueError('{} is not an event log'.format(path))
+        number_events = (os.path.getsize(path) - len(EventLog.magic)) // EventLog.dtype.itemsize
+        if number_events == 0:
+            return Events(np.zeros(0, dtype=EventLog.dtype))
+        return Events(np.memmap(path, dtype=EventLog.dtype, mode='r', offset=len(EventLog.magic),
+                                shape=(number_events,)))
+
+
+class Events:
+    """
+    Recorded events, in cycle order, queried by bank, type and cycle range.
+
+    Cycle ranges are found by binary search, and the events of a bank through an index by bank built on
+    the first query by bank, so queries on a long run touch little more than the events they return.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.cycles = records['cycle']
+        self.bankOrder = None
+        self.bankOffsets = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_bank_index(self):
+        if self.bankOrder is None:
+            banks = self.records['bank']
+            # stable, so that the events of each bank stay in cycle order
+            self.bankOrder = np.argsort(banks, kind='stable')
+            number_banks = int(np.max(banks)) + 1 if len(banks) else 0
+            self.bankOffsets = np.zeros(number_banks + 1, dtype=np.int64)
+            np.cumsum(np.bincount(banks, minlength=number_banks), out=self.bankOffsets[1:])
+        return self.bankOrder, self.bankOffsets
+
+    def get(self, event_type=None, bank=None, cycles=None):
+        """
+        Events of a type, of a bank and within a range of cycles (first, last + 1), any of them None for all.
+        """
+        if bank is not None:
+            order, offsets = self.get_bank_index()
+            if not 0 <= bank < len(offsets) - 1:
+                return np.asarray(self.records[:0])
+            positions = order[offsets[bank]:offsets[bank + 1]]
+            if cycles is not None:
+                bank_cycles = self.cycles[positions]
+                positions = positions[np.searchsorted(bank_cycles, cycles[0]):
+                                      np.searchsorted(bank_cycles, cycles[1])]
+            records = self.records[positions]
+        elif cycles is not None:
+            records = self.records[np.searchsorted(self.cycles, cycles[0]):np.searchsorted(self.cycles, cycles[1])]
+        else:
+            records = self.records
+        if event_type is not None:
+            records = records[records['type'] == event_type]
+        return np.asarray(records)
+
+    def count(self, event_type=None, bank=None, cycles=None):
+        return len(self.get(event_type, bank, cycles))
@@ -29,6 +29,11 @@ class ExogenousFactors:
     interbankInterestRate = 0.01
     liquidAssetsInterestRate = 0
     illiquidAssetDiscountRate = 0.15
+    # if True, illiquidAssetDiscountRate only applies to the first sale: the more banks sell, the bigger the discount
+    isFireSalePriceEndogenous = False
+    fireSalePriceImpact = 1
+    # if True, the loans every bank keeps are marked to the clearing price of a fire sale (see FireSaleMarket)
+    isFireSaleMarkedToMarket = False
     interbankLendingMarketAvailable = True
     banksMaySellNonLiquidAssetsAtDiscountPrices = True
     banksHaveLimitedLiability = False
@@ -48,6 +53,17 @@ class ExogenousFactors:
     isTooBigToFailPolicyActive = False
     isDepositInsuranceAvailable = False
 
+    # Deposit Insurance Fund: risk-based premiums from banks, payouts to insured depositors of liquidated banks
+    isDepositInsuranceFundActive = False
+    # insured amount per depositor (banks have size 1 on average)
+    depositInsuranceCoverage = 0.01
+    # premium per cycle on insured deposits, plus up to depositInsuranceRiskPremiumRate for the least capitalized
+    depositInsurancePremiumRate = 0.001
+    depositInsuranceRiskPremiumRate = 0.004
+    # capital adequacy ratio from which banks pay the base premium only
+    depositInsuranceCapitalBenchmark = 0.08
+    depositInsuranceFundInitialBalance = 0
+
     # Clearing House
     isClearingGuaranteeAvailable = False
     interbankPriority = InterbankPriority.Random
@@ -55,6 +71,8 @@ class ExogenousFactors:
     # Depositors
     areDepositorsZeroIntelligenceAgents = True
     areBankRunsPossible = True
+    # if True, intelligent depositors decide in random order, each seeing the withdrawals of those before it
+    areBankRunsSequential = False
     amountWithdrawn = 1.0
     probabilityofWithdrawal = 0.15
 
@@ -79,3 +97,28 @@ class ExogenousFactors:
 
     # Learning
     DefaultEWADampingFactor = 1
+    # Strategy grids, as (first value, step, number of options) in percentage points
+    bankCapitalRatioOptions = (1, 1, 10)
+    bankLiquidityRatioOptions = (1, 1, 20)
+    centralBankCapitalRatioOptions = (1, 1, 10)
+    depositorSafetyThresholdOptions = (1, 1, 10)
+
+    @classmethod
+    def get_settings(cls):
+        # Current value of every factor, as a dictionary
+        return {key: value for key, value in vars(cls).items()
+                if not key.startswith('_') and not isinstance(value, classmethod)}
+
+    @classmethod
+    def set_settings(cls, settings):
+        for key, value in settings.items():
+            setattr(cls, key, value)
+
+    @classmethod
+    def reset(cls):
+        # Factors are class attributes shared by every model in the process, so restore the defaults before
+        # building a model with different settings
+        cls.set_settings(_default_settings)
+
+
+_default_settings = ExogenousFactors.get_settings()
@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+
+
+class ExposureHistory:
+    """
+    Interbank lending matrix of every cycle, stored sparsely: the matrix is antisymmetric, so only its
+    positive entries (lender, borrower, amount) are kept, 16 bytes per interbank loan instead of 8 N^2 bytes.
+
+    The matrix is rebuilt from scratch every cycle, so each cycle is written as a block of its own rather
+    than as a delta. Blocks go to the file at 'path' (or stay in memory if path is None), and an index of the
+    records of every cycle to 'path.index', so that ExposureHistory.load can memory-map both and read any cycle or
+    range of cycles without loading the rest.
+    """
+
+    dtype = np.dtype([('lender', '<i4'), ('borrower', '<i4'), ('amount', '<f8')])
+    indexDtype = np.dtype([('cycle', '<i8'), ('start', '<i8'), ('stop', '<i8')])
+    magic = b'BANKSIM-EXPOSURE'
+    headerSize = len(magic) + 8
+
+    def __init__(self, number_banks, path=None, capacity=65536):
+        self.numberBanks = number_banks
+        self.path = path
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=ExposureHistory.dtype)
+        self.size = 0
+        # cycle, first and last + 1 record of the cycles in the buffer
+        self.index = []
+        self.numberRecords = 0
+        self.chunks = []
+        self.indexChunks = []
+        if path is not None:
+            with open(path, 'wb') as f:
+                f.write(ExposureHistory.magic)
+                f.write(np.array(number_banks, dtype='<i8').tobytes())
+            open(ExposureHistory.get_index_path(path), 'wb').close()
+
+    @staticmethod
+    def get_index_path(path):
+        return path + '.index'
+
+    def record(self, cycle, matrix):
+        lender, borrower = np.nonzero(matrix > 0)
+        number_loans = len(lender)
+        if self.size + number_loans > self.capacity:
+            self.flush()
+        self.index.append((cycle, self.numberRecords, self.numberRecords + number_loans))
+        self.numberRecords += number_loans
+        if number_loans > self.capacity:
+            records = np.zeros(number_loans, dtype=ExposureHistory.dtype)
+        else:
+            records = self.buffer[self.size:self.size + number_loans]
+            self.size += number_loans
+        records['lender'] = lender
+        records['borrower'] = borrower
+        records['amount'] = matrix[lender, borrower]
+        if number_loans > self.capacity:
+            self.flush()
+            self.write(records, np.zeros(0, dtype=ExposureHistory.indexDtype))
+
+    def write(self, records, index):
+        if self.path is None:
+            self.chunks.append(records.copy())
+            self.indexChunks.append(index)
+        else:
+            # opened for every write, so that a model holding the history can still be pickled
+            with open(self.path, 'ab') as f:
+                f.write(records.tobytes())
+            with open(ExposureHistory.get_index_path(self.path), 'ab') as f:
+                f.write(index.tobytes())
+
+    def flush(self):
+        self.write(self.buffer[:self.size], np.array(self.index, dtype=ExposureHistory.indexDtype))
+        self.size = 0
+        self.index = []
+
+    def get_exposures(self):
+        """
+        Every cycle recorded so far, as Exposures (memory-mapped from the files, if any).
+        """
+        self.flush()
+        if self.path is None:
+            return Exposures(np.concatenate(self.chunks), np.concatenate(self.indexChunks), self.numberBanks)
+        return ExposureHistory.load(self.path)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            if f.read(len(ExposureHistory.magic)) != ExposureHistory.magic:
+                raise ValueError('{} is not an exposure history'.format(path))
+            number_banks = int(np.frombuffer(f.read(8), dtype='<i8')[0])
+        index_path = ExposureHistory.get_index_path(path)
+        return Exposures(ExposureHistory.map(path, ExposureHistory.dtype, ExposureHistory.headerSize),
+                         ExposureHistory.map(index_path, ExposureHistory.indexDtype, 0), number_banks)
+
+    @staticmethod
+    def map(path, dtype, offset):
+        number_records = (os.path.getsize(path) - offset) // dtype.itemsize
+        if number_records == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(number_records,))
+
+
+class Exposures:
+    """
+    Interbank exposures of a range of recorded cycles. exposures[cycle] is the lending matrix of a cycle, and
+    exposures[first:last] the Exposures of the cycles in [first, last), found by binary search in the index:
+    nothing is read until a matrix or its loans are asked for.
+    """
+
+    def __init__(self, records, index, number_banks):
+        self.records = records
+        self.index = index
+        self.numberBanks = number_banks
+
+    @property
+    def cycles(self):
+        return np.asarray(self.index['cycle'])
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_position(self, cycle):
+        position = np.searchsorted(self.index['cycle'], cycle)
+        if position == len(self.index) or self.index['cycle'][position] != cycle:
+            raise KeyError('Cycle {} was not recorded'.format(cycle))
+        return int(position)
+
+    def get_records(self, position):
+        return self.records[self.index['start'][position]:self.index['stop'][position]]
+
+    def get_loans(self, cycle):
+        """
+        Interbank loans of a cycle: lender, borrower and amount, including interest.
+        """
+        return np.asarray(self.get_records(self.get_position(cycle)))
+
+    def get_matrix(self, cycle):
+        loans = self.get_loans(cycle)
+        matrix = np.zeros((self.numberBanks, self.numberBanks))
+        matrix[loans['lender'], loans['borrower']] = loans['amount']
+        matrix[loans['borrower'], loans['lender']] = -loans['amount']
+        return matrix
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None:
+                raise ValueError('Cycle ranges have no step')
+            cycles = self.index['cycle']
+            first = 0 if key.start is None else np.searchsorted(cycles, key.start)
+            last = len(cycles) if key.stop is None else np.searchsorted(cycles, key.stop)
+            return Exposures(self.records, self.index[first:last], self.numberBanks)
+        return self.get_matrix(key)
+
+    def __iter__(self):
+        # (cycle, lending matrix) of every cycle, one at a time
+        for cycle in self.cycles:
+            yield int(cycle), self.get_matrix(cycle)
@@ -0,0 +1,107 @@
+import numpy as np
+
+from banksim.exogeneous_factors import ExogenousFactors
+
+
+class FireSaleMarket:
+    """
+    Market-clearing price for the illiquid assets (loans) that banks sell at once to meet liquidity needs.
+
+    Selling loans worth V (face value) out of the M held by all banks costs a discount rate d(V) given by
+    1 + d(V) = (1 + base_discount_rate) * exp(price_impact * V / M), and a bank needing liquidity L sells
+    min(L * (1 + d), loans) to raise it. The clearing discount rate is the fixed point of both, found by
+    bisection over all banks at once: no bank-by-bank iteration, and O(banks) work per step.
+    Leading axes of the arguments are independent markets (e.g. the replications of a BankingEnsemble).
+    With isFireSaleMarkedToMarket, the loans left on every balance sheet are then revalued at the clearing
+    price (see mark_to_market).
+    """
+
+    numberIterations = 60
+
+    @staticmethod
+    def get_volume(discount_rate, liquidity_needed, loans):
+        # face value sold by all banks at a given discount rate
+        return np.sum(np.minimum(liquidity_needed * (1 + discount_rate[..., np.newaxis]), loans), axis=-1)
+
+    @staticmethod
+    def get_clearing_discount_rate(liquidity_needed, loans, total_loans, base_discount_rate, price_impact):
+        """
+        liquidity_needed and loans are given by bank (last axis), with liquidity_needed 0 for banks not selling,
+        and total_loans is the market depth M.
+        """
+        liquidity_needed = np.asarray(liquidity_needed, dtype=float)
+        loans = np.asarray(loans, dtype=float)
+        total_loans = np.asarray(total_loans, dtype=float)
+        loans_for_sale = np.where(liquidity_needed > 0, loans, 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_impact = np.where(total_loans > 0, price_impact / total_loans, 0)
+
+        def discount_rate_for_volume(volume):
+            return (1 + base_discount_rate) * np.exp(relative_impact * volume) - 1
+
+        # the clearing rate lies between the rates for no sales and for every loan for sale being sold
+        low = np.full(np.shape(total_loans), float(base_discount_rate))
+        high = discount_rate_for_volume(np.sum(loans_for_sale, axis=-1))
+        for i in range(FireSaleMarket.numberIterations):
+            middle = (low + high) / 2
+            volume = FireSaleMarket.get_volume(middle, liquidity_needed, loans_for_sale)
+            too_low = discount_rate_for_volume(volume) > middle
+            low = np.where(too_low, middle, low)
+            high = np.where(too_low, high, middle)
+        return high
+
+    @staticmethod
+    def get_discount_rate(balance_sheet, liquidity_needs, banks):
+        # All banks selling at the same time, so with endogenous prices the discount depends on the total
+        if not ExogenousFactors.isFireSalePriceEndogenous:
+            return ExogenousFactors.illiquidAssetDiscountRate
+        loans = balance_sheet.nonFinancialSectorLoan
+        liquidity_needed = np.where(banks, np.maximum(-liquidity_needs, 0), 0)
+        discount_rate = FireSaleMarket.get_clearing_discount_rate(liquidity_needed, loans, np.sum(loans, axis=-1),
+                                                                  ExogenousFactors.illiquidAssetDiscountRate,
+                                                                  ExogenousFactors.fireSalePriceImpact)
+        return discount_rate[..., np.newaxis]
+
+    @staticmethod
+    def mark_to_market(balance_sheet, discount_rate):
+        """
+        Revalues the loans every bank still holds at the clearing price, relative to the price without a fire
+        sale (illiquidAssetDiscountRate): banks that did not sell lose as well, which is how a fire sale
+        spreads to other balance sheets. Returns the proportion of its loans each bank kept.
+        """
+        bs = balance_sheet
+        value = (1 + ExogenousFactors.illiquidAssetDiscountRate) / (1 + discount_rate)
+        value = np.broadcast_to(value, np.shape(bs.nonFinancialSectorLoan))
+        bs.nonFinancialSectorLoan = bs.nonFinancialSectorLoan * value
+        return value
+
+    @staticmethod
+    def sell(balance_sheet, liquidity_needs, banks):
+        """
+        Masked version of Bank.use_non_liquid_assets_to_pay_depositors_back, for a stacked balance sheet.
+        Returns the new liquidity needs, the proportion of its loans each bank sold (or wrote down, if
+        isFireSaleMarkedToMarket), by which the loans of its corporate clients have to be scaled down, and
+        the face value each bank sold.
+        """
+        bs = balance_sheet
+        banks = banks & (liquidity_needs <= 0)
+        discount = 1 + FireSaleMarket.get_discount_rate(bs, liquidity_needs, banks)
+        liquidity_needed = -liquidity_needs
+        total_loans_to_sell = liquidity_needed * discount
+        enough_loans = bs.nonFinancialSectorLoan > total_loans_to_sell
+        amount_sold = np.where(enough_loans, total_loans_to_sell, bs.nonFinancialSectorLoan)
+        new_liquidity_needs = np.where(enough_loans, 0, liquidity_needs + amount_sold / discount)
+        deposits = np.where(enough_loans, bs.deposits + liquidity_needed,
+                            bs.deposits + (liquidity_needed - new_liquidity_needs))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proportion_of_illiquid_assets_sold = np.where(banks, amount_sold / bs.nonFinancialSectorLoan, 0)
+
+        bs.deposits = np.where(banks, deposits, bs.deposits)
+        bs.nonFinancialSectorLoan = np.where(banks, bs.nonFinancialSectorLoan - amount_sold,
+                                             bs.nonFinancialSectorLoan)
+        if ExogenousFactors.isFireSaleMarkedToMarket:
+            value = FireSaleMarket.mark_to_market(bs, discount - 1)
+            proportion_of_illiquid_assets_sold = 1 - (1 - proportion_of_illiquid_assets_sold) * value
+        return np.where(banks, new_liquidity_needs, liquidity_needs), proportion_of_illiquid_assets_sold, \
+            np.where(banks, amount_sold, 0)
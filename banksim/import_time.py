@@ -0,0 +1,74 @@
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+
+class ImportBenchmark:
+    """
+    Cold-start import time of banksim modules, each import timed in a new interpreter.
+
+    NumPy is imported first and timed apart: it is the only dependency of the engine and most of the time,
+    so the budget is on the time beyond NumPy, which depends less on the machine. Mesa, pandas and networkx
+    must not be imported: the engine runs without them, Mesa comes with banksim.mesa_adapter and pandas on
+    the first summary asked for. The first run of every module is not timed, as it may compile the bytecode.
+    """
+
+    modules = ('banksim.model', 'banksim.ensemble', 'banksim.sharding', 'banksim.cli')
+    deferredModules = ('mesa', 'pandas', 'networkx')
+    script = ('import json, sys, time\n'
+              'start = time.perf_counter()\n'
+              'import numpy\n'
+              'numpy_time = time.perf_counter() - start\n'
+              'import {module}\n'
+              'total_time = time.perf_counter() - start\n'
+              'print(json.dumps([numpy_time, total_time - numpy_time, '
+              'sorted(name for name in {deferred} if name in sys.modules)]))')
+
+    def __init__(self, modules=None, repeats=5, budget=0.1):
+        self.modules = ImportBenchmark.modules if modules is None else tuple(modules)
+        self.repeats = repeats
+        self.budget = budget
+
+    def run(self, module):
+        script = ImportBenchmark.script.format(module=module, deferred=ImportBenchmark.deferredModules)
+        output = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, check=True).stdout
+        return json.loads(output)
+
+    def measure(self, module):
+        """
+        Median import time of NumPy and of the module beyond NumPy, in seconds, and the deferred modules
+        it imported.
+        """
+        self.run(module)
+        runs = [self.run(module) for _ in range(self.repeats)]
+        numpy_time, module_time = np.median([run[:2] for run in runs], axis=0)
+        return {'numpy': float(numpy_time), 'module': float(module_time), 'deferred': runs[-1][2],
+                'ok': bool(module_time <= self.budget and not runs[-1][2])}
+
+    def check(self):
+        return {module: self.measure(module) for module in self.modules}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m banksim.import_time',
+                                     description='Times the cold-start import of banksim modules.')
+    parser.add_argument('modules', nargs='*', default=list(ImportBenchmark.modules))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.1, help='seconds beyond NumPy')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for module, report in ImportBenchmark(args.modules, args.repeats, args.budget).check().items():
+        print('{}: numpy {:.0f} ms, beyond numpy {:.0f} ms{}: {}'.format(
+            module, report['numpy'] * 1000, report['module'] * 1000,
+            ', imported ' + ', '.join(report['deferred']) if report['deferred'] else '',
+            'ok' if report['ok'] else 'over budget'))
+        failures += not report['ok']
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import os
+
+
+def match_lenders_and_borrowers(lenders, borrowers, amount_left, interbank_lending_matrix):
+    # Greedy matching of lenders and borrowers (bank indices, in priority order): each lender lends what it has
+    # left to the first borrower still needing liquidity. amount_left is positive for lenders, negative for
+    # borrowers, by bank index, and is updated with the lending matrix.
+    if len(lenders) == 0 or len(borrowers) == 0:
+        return
+    i = j = 0
+    lender, borrower = lenders[0], borrowers[0]
+    while True:
+        amount_lent = min(amount_left[lender], abs(amount_left[borrower]))
+        amount_left[lender] -= amount_lent
+        amount_left[borrower] += amount_lent
+        interbank_lending_matrix[lender, borrower] = amount_lent
+        interbank_lending_matrix[borrower, lender] = -amount_lent
+        if amount_left[lender] == 0:
+            i += 1
+            if i == len(lenders):
+                break
+            lender = lenders[i]
+        if amount_left[borrower] == 0:
+            j += 1
+            if j == len(borrowers):
+                break
+            borrower = borrowers[j]
+
+
+class Kernels:
+    """
+    Sequential hot loops of the model, as functions of arrays compiled with Numba when it is installed and
+    run as plain Python otherwise. Both backends perform the same floating point operations in the same
+    order, so results are identical.
+
+    Numba is only imported, and a kernel compiled, the first time the kernel is used. Compiled code is cached
+    on disk (in __pycache__, next to this module), so later runs and worker processes load it instead of
+    compiling again. The BANKSIM_KERNELS environment variable chooses a backend: 'auto' (the default),
+    'numba' or 'python'.
+    """
+
+    backends = ('auto', 'numba', 'python')
+    backend = None
+    compiled = {}
+
+    @staticmethod
+    def get_backend():
+        if Kernels.backend is None:
+            requested = os.environ.get('BANKSIM_KERNELS', 'auto')
+            if requested not in Kernels.backends:
+                raise ValueError('BANKSIM_KERNELS must be one of {}, not {}'.format(Kernels.backends, requested))
+            backend = 'python'
+            if requested != 'python':
+                try:
+                    import numba  # noqa: F401
+                    backend = 'numba'
+                except ImportError:
+                    if requested == 'numba':
+                        raise
+            Kernels.backend = backend
+        return Kernels.backend
+
+    @staticmethod
+    def get_kernel(function):
+        if Kernels.get_backend() == 'python':
+            return function
+        if function not in Kernels.compiled:
+            import numba
+            Kernels.compiled[function] = numba.njit(cache=True)(function)
+        return Kernels.compiled[function]
+
+    @staticmethod
+    def match_lenders_and_borrowers(lenders, borrowers, amount_left, interbank_lending_matrix):
+        Kernels.get_kernel(match_lenders_and_borrowers)(lenders, borrowers, amount_left, interbank_lending_matrix)
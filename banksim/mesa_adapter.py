@@ -0,0 +1,13 @@
+from mesa import Model
+
+from banksim.model import BankingModel
+
+
+class MesaBankingModel(BankingModel, Model):
+    """
+    BankingModel as a mesa.Model, for Mesa's visualization server and DataCollector.
+
+    The engine does not import Mesa: BankingModel and its agents derive from the classes of banksim.core,
+    that have the interface and the seeding of Mesa's, so this adapter only adds mesa.Model to the bases and
+    runs exactly as a BankingModel with the same seed. Mesa is imported with this module.
+    """
@@ -1,12 +1,15 @@
-from mesa import Model
+import numpy as np
 
 from banksim.activation import MultiStepActivation
 from banksim.agents.bank import Bank
 from banksim.agents.central_bank import CentralBank
 from banksim.agents.clearing_house import ClearingHouse
-from banksim.agents.corporate_client import CorporateClient
-from banksim.agents.depositor import Depositor
+from banksim.agents.corporate_client import CorporateClientPopulation
+from banksim.agents.deposit_insurer import DepositInsurer
+from banksim.agents.depositor import DepositorPopulation
+from banksim.core import Model
 from banksim.exogeneous_factors import ExogenousFactors, SimulationType, InterbankPriority
+from banksim.util import Util
 
 
 class BankingModel(Model):
@@ -20,8 +23,8 @@ class BankingModel(Model):
     The paper is available online at https://mpra.ub.uni-muenchen.de/73308.
     """
 
-    def __init__(self, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None):
-        super().__init__()
+    def __init__(self, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None, seed=None):
+        super().__init__(seed)
 
         # Simulation data
         self.simulation_type = SimulationType[simulation_type]
@@ -56,8 +59,9 @@ class BankingModel(Model):
         _params = (ExogenousFactors.bankSizeDistribution,
                    not ExogenousFactors.areBanksZeroIntelligenceAgents,
                    ExogenousFactors.DefaultEWADampingFactor)
-        for _ in range(self.numberBanks):
+        for i in range(self.numberBanks):
             bank = Bank(*_params, self)
+            bank.index = i
             self.schedule.add_bank(bank)
         self.normalize_banks()
 
@@ -75,15 +79,30 @@ class BankingModel(Model):
                                          ExogenousFactors.wholesaleCorporateClientLossGivenDefault,
                                          ExogenousFactors.wholesaleCorporateClientLoanInterestRate)
 
-        for bank in self.schedule.banks:
-            for i in range(ExogenousFactors.numberDepositorsPerBank):
-                depositor = Depositor(*_params_depositors, bank, self)
-                bank.depositors.append(depositor)
-                self.schedule.add_depositor(depositor)
-            for i in range(ExogenousFactors.numberCorporateClientsPerBank):
-                corporate_client = CorporateClient(*_params_corporate_clients, bank, self)
-                bank.corporateClients.append(corporate_client)
-                self.schedule.add_corporate_client(corporate_client)
+        # Client populations are sized by market share out of a total budget, so bigger banks get more clients
+        number_depositors = BankingModel.get_number_of_clients_per_bank(
+            self.schedule.banks, ExogenousFactors.numberDepositorsPerBank)
+        number_corporate_clients = BankingModel.get_number_of_clients_per_bank(
+            self.schedule.banks, ExogenousFactors.numberCorporateClientsPerBank)
+
+        for bank, n_depositors, n_corporate_clients in zip(self.schedule.banks, number_depositors,
+                                                           number_corporate_clients):
+            bank.numberDepositors = int(n_depositors)
+            bank.numberCorporateClients = int(n_corporate_clients)
+
+        # Depositors and firms are allocated in bulk, contiguously by bank; agent objects are created on demand
+        self.schedule.add_depositors(DepositorPopulation(number_depositors, *_params_depositors, self))
+        self.schedule.add_corporate_clients(
+            CorporateClientPopulation(number_corporate_clients, *_params_corporate_clients, self))
+
+        # Deposit Insurance Fund
+        if ExogenousFactors.isDepositInsuranceFundActive:
+            _params = (ExogenousFactors.depositInsuranceCoverage,
+                       ExogenousFactors.depositInsurancePremiumRate,
+                       ExogenousFactors.depositInsuranceRiskPremiumRate,
+                       ExogenousFactors.depositInsuranceCapitalBenchmark,
+                       ExogenousFactors.depositInsuranceFundInitialBalance)
+            self.schedule.add_deposit_insurer(DepositInsurer(*_params, self))
 
     def step(self):
         self.schedule.reset_cycle()
@@ -91,10 +110,32 @@ class BankingModel(Model):
         self.schedule.period_1()
         self.schedule.period_2()
 
-    def run_model(self, n):
+    def run_model(self, n, stopping_rule=None):
+        """
+        Runs n cycles, or fewer if a stopping rule (e.g. a ConvergenceMonitor) says the model has settled.
+        Returns the cycle the model stopped at.
+        """
+        if stopping_rule is not None:
+            stopping_rule.reset()
         for i in range(n):
             self.step()
+            if stopping_rule is not None and stopping_rule.update(self):
+                break
         self.running = False
+        return self.schedule.cycle
+
+    def get_strategy_entropy(self):
+        # Mean entropy of the EWA strategy distributions of banks, central bank and depositors
+        # (0 for zero intelligence agents, that do not learn)
+        banks = [bank.strategyP for bank in self.schedule.banks if bank.isIntelligent]
+        banks_entropy = np.mean(Util.get_entropy(banks)) if banks else 0
+        central_bank = self.schedule.central_bank
+        central_bank_entropy = Util.get_entropy(central_bank.strategyP) \
+            if central_bank.isIntelligent else 0
+        depositors = self.schedule.depositors
+        depositors_entropy = np.mean(Util.get_entropy(depositors.strategyP)) \
+            if depositors.isIntelligent and len(depositors) > 0 else 0
+        return banks_entropy, central_bank_entropy, depositors_entropy
 
     def normalize_banks(self):
         # Normalize banks size and Compute market share (in % of total assets)
@@ -104,6 +145,13 @@ class BankingModel(Model):
             bank.marketShare = bank.initialSize / total_size
             bank.initialSize *= factor
 
+    @staticmethod
+    def get_number_of_clients_per_bank(banks, number_clients_per_bank):
+        # The total budget is the same as if every bank had 'number_clients_per_bank' clients
+        total_clients = number_clients_per_bank * len(banks)
+        market_shares = [bank.marketShare for bank in banks]
+        return Util.apportion(total_clients, market_shares, minimum=1)
+
     @staticmethod
     def update_exogeneous_factors(exogenous_factors, number_of_banks):
         if isinstance(exogenous_factors, dict):
@@ -0,0 +1,113 @@
+import argparse
+import sys
+
+import numpy as np
+
+from banksim.ensemble import BankingEnsemble
+from banksim.exogeneous_factors import ExogenousFactors, SimulationType
+
+
+class ErrorBudget:
+    """
+    Error budget of the compact mode of BankingEnsemble against float64, on the same seeds.
+
+    Float32 keeps about 7 significant digits, so after the first cycle, 99% of the balance sheet items
+    (relative to the size of their bank) must be within balanceSheetError of float64. The rest may differ
+    by more: a withdrawal or a liquidity need rounded across a threshold (zero, a capital ratio) sends a
+    bank down another branch. From then on a replication follows another path of the model, so over many
+    cycles only statistics are comparable: the mean insolvency and contagion rates after burn-in must be
+    within rateStandardErrors standard errors (of the difference across replications) of float64.
+    """
+
+    balanceSheetError = 1e-5
+    balanceSheetPercentile = 99
+    rateStandardErrors = 3
+    balanceSheetFields = ('deposits', 'discountWindowLoan', 'interbankLoan', 'nonFinancialSectorLoan',
+                          'liquidAssets')
+
+    def __init__(self, simulation_type='HighSpread', seeds=range(32), cycles=150, burn_in=50, number_of_banks=10,
+                 exogenous_factors=None):
+        if burn_in >= cycles:
+            raise ValueError('burn_in must be smaller than cycles')
+        self.simulation_type = simulation_type
+        self.seeds = list(seeds)
+        self.cycles = cycles
+        self.burnIn = burn_in
+        self.number_of_banks = number_of_banks
+        self.exogenous_factors = exogenous_factors
+
+    def run(self, compact):
+        """
+        Balance sheets after the first cycle (relative to bank size), insolvency and contagion rates of every
+        replication after burn-in, and the memory held by the ensemble.
+        """
+        ExogenousFactors.reset()
+        try:
+            ensemble = BankingEnsemble(self.seeds, self.simulation_type, self.exogenous_factors,
+                                       self.number_of_banks, compact)
+            rates = np.zeros((2, len(self.seeds)))
+            for cycle in range(self.cycles):
+                ensemble.step()
+                if cycle == 0:
+                    bs = ensemble.balanceSheet
+                    balance_sheets = np.array([getattr(bs, field) / ensemble.initialSize
+                                               for field in self.balanceSheetFields])
+                if cycle >= self.burnIn:
+                    rates += (ensemble.insolvencyPerCycleCounter, ensemble.insolvencyDueToContagionPerCycleCounter)
+            rates /= (self.cycles - self.burnIn) * ensemble.numberBanks
+            return balance_sheets, rates, ensemble.get_state_size()
+        finally:
+            ExogenousFactors.reset()
+
+    def check(self):
+        """
+        Errors of the compact mode and whether they are within budget.
+        """
+        expected_balance_sheets, expected_rates, expected_size = self.run(compact=False)
+        balance_sheets, rates, size = self.run(compact=True)
+
+        balance_sheet_error = np.percentile(np.abs(balance_sheets - expected_balance_sheets),
+                                            self.balanceSheetPercentile)
+        # the same seeds make the differences of the rates less noisy than the rates themselves
+        differences = rates - expected_rates
+        standard_errors = np.std(differences, axis=1, ddof=1) / np.sqrt(len(self.seeds))
+        report = {'balanceSheetError': float(balance_sheet_error), 'memoryRatio': expected_size / size}
+        ok = balance_sheet_error <= self.balanceSheetError
+        for name, expected, actual, standard_error in zip(('insolvencies', 'contagions'), expected_rates, rates,
+                                                          standard_errors):
+            difference = float(np.mean(actual) - np.mean(expected))
+            tolerance = float(self.rateStandardErrors * standard_error)
+            report[name] = {'float64': float(np.mean(expected)), 'compact': float(np.mean(actual)),
+                            'difference': difference, 'tolerance': tolerance}
+            ok = ok and abs(difference) <= tolerance
+        report['ok'] = bool(ok)
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m banksim.precision',
+                                     description='Checks the compact mode against float64 runs.')
+    parser.add_argument('--simulation-types', nargs='+', default=list(SimulationType.__members__),
+                        choices=list(SimulationType.__members__))
+    parser.add_argument('--replications', type=int, default=32)
+    parser.add_argument('--cycles', type=int, default=150)
+    parser.add_argument('--burn-in', type=int, default=50)
+    parser.add_argument('--banks', type=int, default=10, help='number of banks')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for simulation_type in args.simulation_types:
+        budget = ErrorBudget(simulation_type, range(args.replications), args.cycles, args.burn_in, args.banks)
+        report = budget.check()
+        print('{}: balance sheets {:.1e}, insolvencies {:+.4f} (+/- {:.4f}), contagions {:+.4f} (+/- {:.4f}), '
+              'memory / {:.2f}: {}'.format(
+                  simulation_type, report['balanceSheetError'],
+                  report['insolvencies']['difference'], report['insolvencies']['tolerance'],
+                  report['contagions']['difference'], report['contagions']['tolerance'],
+                  report['memoryRatio'], 'ok' if report['ok'] else 'over budget'))
+        failures += not report['ok']
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
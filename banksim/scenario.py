@@ -0,0 +1,92 @@
+import os
+from enum import Enum
+
+from banksim.exogeneous_factors import ExogenousFactors, SimulationType
+
+
+class Scenario:
+    """
+    Declarative description of a headless run, read from a YAML or TOML file:
+
+        simulation_type: Basel
+        exogenous_factors: {bankSizeDistribution: LogNormal, isTooBigToFailPolicyActive: true}
+        number_of_banks: 100
+        cycles: 1000
+        seeds: [1, 2, 3]            # or {start: 0, count: 100}
+        processes: 4                # 1 runs everything in this process
+        stopping_rule: {window: 50, tolerance: 0.001, minimum_cycles: 100}
+        cache: .banksim-cache       # optional ResultCache directory
+        outputs:
+          summary: summary.csv      # one row per replication
+          series: series.csv        # one row per replication and cycle, written as replications finish
+          aggregate: aggregate.csv  # mean, quantiles and confidence band per cycle
+
+    Enum factors are given by name. Relative output and cache paths are relative to the scenario file.
+    """
+
+    outputNames = ('summary', 'series', 'aggregate')
+
+    def __init__(self, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None, cycles=100,
+                 seeds=(0,), processes=None, stopping_rule=None, cache=None, outputs=None):
+        if simulation_type not in SimulationType.__members__:
+            raise ValueError('Unknown simulation type {}, expected one of {}'.format(
+                simulation_type, ', '.join(SimulationType.__members__)))
+        self.simulation_type = simulation_type
+        self.exogenous_factors = Scenario.parse_exogenous_factors(exogenous_factors or {})
+        self.number_of_banks = number_of_banks
+        self.cycles = int(cycles)
+        self.seeds = Scenario.parse_seeds(seeds)
+        self.processes = processes
+        self.stopping_rule = stopping_rule
+        self.cache = cache
+        self.outputs = dict(outputs or {})
+        for name in self.outputs:
+            if name not in self.outputNames:
+                raise ValueError('Unknown output {}, expected one of {}'.format(name, ', '.join(self.outputNames)))
+
+    @staticmethod
+    def parse_exogenous_factors(exogenous_factors):
+        settings = ExogenousFactors.get_settings()
+        parsed = {}
+        for key, value in exogenous_factors.items():
+            if key not in settings:
+                raise ValueError('Unknown exogenous factor {}'.format(key))
+            default = settings[key]
+            if isinstance(default, Enum) and isinstance(value, str):
+                value = type(default)[value]
+            parsed[key] = value
+        return parsed
+
+    @staticmethod
+    def parse_seeds(seeds):
+        if isinstance(seeds, dict):
+            start = seeds.get('start', 0)
+            return list(range(start, start + seeds['count']))
+        if isinstance(seeds, int):
+            return [seeds]
+        return list(seeds)
+
+    @classmethod
+    def from_file(cls, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.yaml', '.yml'):
+            import yaml
+            with open(path) as f:
+                settings = yaml.safe_load(f) or {}
+        elif extension == '.toml':
+            try:
+                import tomllib
+            except ImportError:  # Python < 3.11
+                import tomli as tomllib
+            with open(path, 'rb') as f:
+                settings = tomllib.load(f)
+        else:
+            raise ValueError('Scenario files must be .yaml, .yml or .toml, not {}'.format(path))
+
+        # paths in the file are relative to it
+        directory = os.path.dirname(os.path.abspath(path))
+        outputs = settings.get('outputs') or {}
+        settings['outputs'] = {name: os.path.join(directory, output) for name, output in outputs.items()}
+        if settings.get('cache'):
+            settings['cache'] = os.path.join(directory, settings['cache'])
+        return cls(**settings)
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from banksim.calibration import simulate_moments
+from banksim.exogeneous_factors import ExogenousFactors
+
+
+class SensitivityAnalysis:
+    """
+    Global sensitivity of the insolvency and contagion rates to exogenous factors varying within 'bounds':
+    Sobol indices (first order and total, Saltelli and Jansen estimators) or Morris elementary effects.
+
+    Designs are quasi-random (scrambled Halton), and each design point is replicated adaptively: every
+    point first runs 'minimum_replications' seeds, and then only the points whose mean output still has a
+    variance above 'target_variance' get more, up to 'maximum_replications'. Replication j of every point
+    uses the seed seed + j (common random numbers), and all the replications of a round run in parallel.
+
+    Bounds of booleans (False, True) and integers are sampled as booleans and integers.
+    """
+
+    outputNames = ('insolvencies', 'contagions')
+
+    def __init__(self, bounds, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None,
+                 cycles=200, burn_in=50, target_variance=1e-4, minimum_replications=3, maximum_replications=32,
+                 processes=None, cache=None, seed=0):
+        settings = ExogenousFactors.get_settings()
+        for factor, (low, high) in bounds.items():
+            if factor not in settings:
+                raise ValueError('Unknown exogenous factor {}'.format(factor))
+            if not low < high:
+                raise ValueError('Empty bounds for {}: {}, {}'.format(factor, low, high))
+        if burn_in >= cycles:
+            raise ValueError('burn_in must be smaller than cycles')
+        if not 2 <= minimum_replications <= maximum_replications:
+            raise ValueError('Expected 2 <= minimum_replications <= maximum_replications')
+
+        self.bounds = dict(bounds)
+        self.factors = sorted(self.bounds)
+        self.simulation_type = simulation_type
+        self.exogenous_factors = dict(exogenous_factors or {})
+        self.number_of_banks = number_of_banks
+        self.cycles = cycles
+        self.burnIn = burn_in
+        self.targetVariance = target_variance
+        self.minimumReplications = minimum_replications
+        self.maximumReplications = maximum_replications
+        self.processes = processes
+        self.cache = cache
+        self.seed = seed
+        self.randomState = np.random.RandomState(seed)
+        # replications run for each point of the last design
+        self.replications = None
+
+    def get_settings(self):
+        # What determines the outputs of a replication besides the model itself (part of the cache keys)
+        return {'burnIn': self.burnIn}
+
+    def get_factors(self, point):
+        # Exogenous factors of a point of the unit cube
+        factors = dict(self.exogenous_factors)
+        for factor, u in zip(self.factors, point):
+            low, high = self.bounds[factor]
+            if isinstance(low, bool) and isinstance(high, bool):
+                factors[factor] = bool(u >= 0.5)
+            elif isinstance(low, int) and isinstance(high, int):
+                factors[factor] = min(low + int(u * (high - low + 1)), high)
+            else:
+                factors[factor] = low + float(u) * (high - low)
+        return factors
+
+    @staticmethod
+    def get_primes(number_primes):
+        primes = []
+        candidate = 2
+        while len(primes) < number_primes:
+            if all(candidate % p for p in primes if p * p <= candidate):
+                primes.append(candidate)
+            candidate += 1
+        return primes
+
+    @staticmethod
+    def get_halton(number_points, dimension, random_state):
+        """
+        Halton sequence with randomly permuted digits in every dimension (0 kept fixed), which breaks the
+        correlation between dimensions of the plain sequence when there are dozens of them.
+        """
+        points = np.zeros((number_points, dimension))
+        for j, base in enumerate(SensitivityAnalysis.get_primes(dimension)):
+            permutation = np.concatenate([[0], 1 + random_state.permutation(base - 1)])
+            index = np.arange(1, number_points + 1)
+            scale = 1 / base
+            while np.any(index > 0):
+                points[:, j] += permutation[index % base] * scale
+                index //= base
+                scale /= base
+        return points
+
+    def evaluate(self, points):
+        """
+        Mean of every output over the replications of each point, and the variance of those means.
+        """
+        number_points = len(points)
+        candidates = [self.get_factors(point) for point in points]
+        sums = np.zeros((number_points, len(self.outputNames)))
+        squares = np.zeros((number_points, len(self.outputNames)))
+        replications = np.zeros(number_points, dtype=np.int64)
+        wanted = np.full(number_points, self.minimumReplications)
+
+        processes = self.processes or os.cpu_count()
+        pool = None if processes == 1 else multiprocessing.Pool(processes)
+        try:
+            while np.any(wanted > replications):
+                tasks = [(i, seed) for i in np.flatnonzero(wanted > replications)
+                         for seed in range(self.seed + replications[i], self.seed + wanted[i])]
+                for i, seed, outputs in self.run_replications(tasks, candidates, pool):
+                    sums[i] += outputs
+                    squares[i] += np.square(outputs)
+                replications = wanted.copy()
+
+                # sample variance of the outputs, divided by n for the variance of their mean
+                means = sums / replications[:, np.newaxis]
+                variances = np.maximum(squares / replications[:, np.newaxis] - means ** 2, 0) * \
+                    (replications / (replications - 1))[:, np.newaxis]
+                needed = np.ceil(np.max(variances, axis=1) / self.targetVariance).astype(np.int64)
+                # at most doubling per round, since the variances of few replications are rough
+                wanted = np.where(needed > replications, np.minimum(needed, 2 * replications), replications)
+                wanted = np.minimum(wanted, self.maximumReplications)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        self.replications = replications
+        return means, np.max(variances, axis=1) / replications
+
+    def run_replications(self, tasks, candidates, pool):
+        keys = {}
+        pending = []
+        for i, seed in tasks:
+            if self.cache is not None:
+                keys[i, seed] = self.cache.get_key(self.simulation_type, candidates[i], self.number_of_banks, seed,
+                                                   self.cycles, self)
+                result = self.cache.get(keys[i, seed])
+                if result is not None:
+                    yield i, seed, result
+                    continue
+            pending.append((i, self.simulation_type, candidates[i], self.number_of_banks, seed, self.cycles,
+                            self.burnIn))
+        results = map(simulate_moments, pending) if pool is None else pool.imap_unordered(simulate_moments, pending)
+        for i, seed, moments in results:
+            # insolvencies and contagions are the first two moments
+            outputs = moments[:len(self.outputNames)]
+            if self.cache is not None:
+                self.cache.put(keys[i, seed], outputs)
+            yield i, seed, outputs
+
+    def sobol(self, number_points=256):
+        """
+        First order and total Sobol indices of every output, from number_points * (factors + 2) design points.
+        """
+        d = len(self.factors)
+        base = SensitivityAnalysis.get_halton(number_points, 2 * d, self.randomState)
+        a, b = base[:, :d], base[:, d:]
+        # A, B and, for each factor i, A with column i taken from B
+        ab = np.repeat(a[np.newaxis], d, axis=0)
+        ab[np.arange(d), :, np.arange(d)] = b.T
+        outputs, variances = self.evaluate(np.vstack([a, b, ab.reshape(-1, d)]))
+
+        f_a, f_b = outputs[:number_points], outputs[number_points:2 * number_points]
+        f_ab = outputs[2 * number_points:].reshape(d, number_points, -1)
+        variance = np.var(np.vstack([f_a, f_b]), axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            first = np.mean(f_b * (f_ab - f_a), axis=1) / variance
+            total = 0.5 * np.mean((f_a - f_ab) ** 2, axis=1) / variance
+        return {output: {'first': dict(zip(self.factors, first[:, k].tolist())),
+                         'total': dict(zip(self.factors, total[:, k].tolist()))}
+                for k, output in enumerate(self.outputNames)}
+
+    def morris(self, number_trajectories=20, number_levels=4):
+        """
+        Mean absolute (mu_star) and standard deviation (sigma) of the elementary effects of every factor, from
+        number_trajectories * (factors + 1) design points on a grid of number_levels levels.
+        """
+        d = len(self.factors)
+        delta = number_levels / (2 * (number_levels - 1))
+        grid = np.floor(SensitivityAnalysis.get_halton(number_trajectories, d, self.randomState) * number_levels)
+        trajectories = np.zeros((number_trajectories, d + 1, d))
+        steps = np.zeros((number_trajectories, d))
+        orders = np.array([self.randomState.permutation(d) for _ in range(number_trajectories)])
+        for t in range(number_trajectories):
+            point = grid[t] / (number_levels - 1)
+            trajectories[t, 0] = point
+            for j, factor in enumerate(orders[t]):
+                step = delta if point[factor] + delta <= 1 else -delta
+                point = point.copy()
+                point[factor] += step
+                steps[t, factor] = step
+                trajectories[t, j + 1] = point
+        outputs, variances = self.evaluate(trajectories.reshape(-1, d))
+        outputs = outputs.reshape(number_trajectories, d + 1, -1)
+
+        effects = np.zeros((number_trajectories, d, len(self.outputNames)))
+        for t in range(number_trajectories):
+            differences = outputs[t, 1:] - outputs[t, :-1]
+            effects[t, orders[t]] = differences / steps[t, orders[t], np.newaxis]
+        mu_star = np.mean(np.abs(effects), axis=0)
+        sigma = np.std(effects, axis=0, ddof=1) if number_trajectories > 1 else np.zeros_like(mu_star)
+        return {output: {'mu_star': dict(zip(self.factors, mu_star[:, k].tolist())),
+                         'sigma': dict(zip(self.factors, sigma[:, k].tolist()))}
+                for k, output in enumerate(self.outputNames)}
+
+    def get_number_runs(self):
+        return int(np.sum(self.replications)) if self.replications is not None else 0
@@ -0,0 +1,495 @@
+import multiprocessing
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from banksim.agents.bank import BalanceSheet
+from banksim.bank_run import SequentialBankRun
+from banksim.ensemble import BankingEnsemble
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.strategies.bank_ewa_strategy import BankEWAStrategy
+from banksim.strategies.depositor_ewa_strategy import DepositorEWAStrategy
+from banksim.util import Util
+
+
+class Shard:
+    """
+    Depositors, corporate clients and bank EWA information of a contiguous range of banks [start, stop).
+
+    Every draw of the model is a single vector over all banks, depositors or firms, so a shard receives
+    the state of the random stream, draws the whole vector, keeps its slice and hands the state back:
+    its results are those of the single process run, whatever the number of shards.
+    A shard given a seed sequence draws only its slice instead, from a stream of its own, so that shards
+    can draw at the same time; results then depend on the number of shards.
+    """
+
+    def __init__(self, start, stop, number_banks, number_depositors, number_corporate_clients, depositor_range,
+                 corporate_client_range, total_depositors, total_corporate_clients, compact=False,
+                 seed_sequence=None):
+        self.start, self.stop = start, stop
+        self.numberBanks = number_banks
+        self.depositorRange = slice(*depositor_range)
+        self.corporateClientRange = slice(*corporate_client_range)
+        self.totalDepositors = total_depositors
+        self.totalCorporateClients = total_corporate_clients
+        self.hasOwnStream = seed_sequence is not None
+        self.random = np.random.RandomState(np.random.MT19937(seed_sequence) if self.hasOwnStream else None)
+        self.floatType = np.float32 if compact else np.float64
+
+        n = stop - start
+        self.numberDepositors = np.asarray(number_depositors)
+        self.numberCorporateClients = np.asarray(number_corporate_clients)
+        bank_index_type = BankingEnsemble.get_index_type(n, compact)
+        self.depositorBank = np.repeat(np.arange(n), self.numberDepositors).astype(bank_index_type)
+        self.corporateClientBank = np.repeat(np.arange(n), self.numberCorporateClients).astype(bank_index_type)
+        self.firstCorporateClient = Util.get_offsets(self.numberCorporateClients)[:-1]
+
+        d, f = len(self.depositorBank), len(self.corporateClientBank)
+        self.initialDeposit = np.zeros(d, dtype=self.floatType)
+        self.deposit = np.zeros(d, dtype=self.floatType)
+        self.lastPercentageWithdrawn = np.zeros(d, dtype=self.floatType)
+        self.amountEarlyWithdraw = np.zeros(d, dtype=self.floatType)
+        self.amountFinalWithdraw = np.zeros(d, dtype=self.floatType)
+        self.safetyTreshold = np.zeros(d, dtype=self.floatType)
+        self.areDepositorsIntelligent = not ExogenousFactors.areDepositorsZeroIntelligenceAgents
+        if self.areDepositorsIntelligent:
+            number_options = DepositorEWAStrategy.get_number_alpha_options()
+            self.depositorStrategyA = np.zeros((d, number_options), dtype=self.floatType)
+            self.depositorStrategyP = np.zeros((d, number_options), dtype=self.floatType)
+            self.depositorStrategyProfit = np.zeros((d, number_options), dtype=self.floatType)
+            self.depositorStrategyInsolvencyCounter = np.zeros((d, number_options),
+                                                               dtype=np.int32 if compact else np.int64)
+            self.depositorChosenStrategy = np.zeros(
+                d, dtype=BankingEnsemble.get_index_type(number_options, compact))
+
+        self.areBanksIntelligent = not ExogenousFactors.areBanksZeroIntelligenceAgents
+        self.bankEWADampingFactor = ExogenousFactors.DefaultEWADampingFactor
+        if self.areBanksIntelligent:
+            number_strategies = BankEWAStrategy.get_number_strategies()
+            self.bankStrategyA = np.zeros((n, number_strategies), dtype=self.floatType)
+            self.bankStrategyP = np.zeros((n, number_strategies), dtype=self.floatType)
+            self.bankStrategyProfit = np.zeros((n, number_strategies), dtype=self.floatType)
+            self.bankStrategyProfitPercentage = np.zeros((n, number_strategies), dtype=self.floatType)
+            self.bankStrategyProfitPercentageDamped = np.zeros((n, number_strategies), dtype=self.floatType)
+            self.bankChosenStrategy = np.zeros(
+                n, dtype=BankingEnsemble.get_index_type(number_strategies, compact))
+
+        self.loanAmount = np.zeros(f, dtype=self.floatType)
+        self.percentageRepaid = np.zeros(f, dtype=self.floatType)
+        if ExogenousFactors.standardCorporateClients:
+            self.probabilityOfDefault = ExogenousFactors.standardCorporateClientDefaultRate
+            self.lossGivenDefault = ExogenousFactors.standardCorporateClientLossGivenDefault
+            self.loanInterestRate = ExogenousFactors.standardCorporateClientLoanInterestRate
+        else:
+            self.probabilityOfDefault = ExogenousFactors.wholesaleCorporateClientDefaultRate
+            self.lossGivenDefault = ExogenousFactors.wholesaleCorporateClientLossGivenDefault
+            self.loanInterestRate = ExogenousFactors.wholesaleCorporateClientLoanInterestRate
+
+    def get_random_uniform(self, total, part):
+        # this shard's part of a vector of draws over the whole model
+        if self.hasOwnStream:
+            return self.random.uniform(0, 1, part.stop - part.start)
+        return self.random.uniform(0, 1, total)[part]
+
+    def set_random_state(self, random_state):
+        # the state of the model's stream, unless the shard has a stream of its own
+        if not self.hasOwnStream:
+            self.random.set_state(random_state)
+
+    def get_random_state(self):
+        return None if self.hasOwnStream else self.random.get_state()
+
+    def sum_by_bank(self, values, groups):
+        return Util.sum_by_group(values, groups, self.stop - self.start)
+
+    def start_cycle(self, random_state):
+        """
+        Resets the populations and picks the strategies of depositors and banks. Returns the strategies of
+        the banks and the state of the random stream.
+        """
+        self.set_random_state(random_state)
+        self.deposit[:] = self.initialDeposit
+        self.lastPercentageWithdrawn[:] = 0
+        self.loanAmount[:] = 0
+        self.percentageRepaid[:] = 0
+
+        if self.areDepositorsIntelligent:
+            list_a = self.depositorStrategyA + self.depositorStrategyProfit
+            _exp = np.exp(list_a, dtype=np.float64)
+            self.depositorStrategyA = list_a
+            self.depositorStrategyP = (_exp / np.sum(_exp, axis=1, keepdims=True)).astype(self.floatType, copy=False)
+            probability_threshold = self.get_random_uniform(self.totalDepositors, self.depositorRange)
+            self.depositorChosenStrategy = BankingEnsemble.choose_strategies(
+                self.depositorStrategyP, probability_threshold).astype(self.depositorChosenStrategy.dtype, copy=False)
+            self.safetyTreshold = DepositorEWAStrategy.get_alpha_values()[self.depositorChosenStrategy].astype(
+                self.floatType, copy=False)
+
+        if self.areBanksIntelligent:
+            list_a = 0.9999 * self.bankStrategyA + self.bankStrategyProfitPercentageDamped
+            _exp = np.exp(list_a, dtype=np.float64)
+            self.bankStrategyA = list_a
+            self.bankStrategyP = (_exp / np.sum(_exp, axis=1, keepdims=True)).astype(self.floatType, copy=False)
+            probability_threshold = self.get_random_uniform(self.numberBanks, slice(self.start, self.stop))
+            self.bankChosenStrategy = BankingEnsemble.choose_strategies(
+                self.bankStrategyP, probability_threshold).astype(self.bankChosenStrategy.dtype, copy=False)
+            return self.bankChosenStrategy, self.get_random_state()
+        return None, self.get_random_state()
+
+    def setup_balance_sheet(self, non_financial_sector_loan, deposits):
+        loan_per_coporate_client = non_financial_sector_loan / self.numberCorporateClients
+        self.loanAmount = loan_per_coporate_client[self.corporateClientBank].astype(self.floatType, copy=False)
+        deposit_per_depositor = -deposits / self.numberDepositors
+        self.initialDeposit = deposit_per_depositor[self.depositorBank].astype(self.floatType, copy=False)
+        self.deposit = self.initialDeposit.copy()
+        self.lastPercentageWithdrawn[:] = 0
+        return self.get_loans()
+
+    def get_loans(self):
+        # total loans and loan of the first client, by bank
+        return self.sum_by_bank(self.loanAmount, self.corporateClientBank), self.loanAmount[self.firstCorporateClient]
+
+    def scale_loans(self, factor):
+        original_loan_amount = self.loanAmount
+        self.loanAmount = (original_loan_amount * factor[self.corporateClientBank]).astype(self.floatType, copy=False)
+        return (self.sum_by_bank(original_loan_amount - self.loanAmount, self.corporateClientBank),) + \
+            self.get_loans()
+
+    def withdraw_deposits(self, random_state, bank_car, *bank_data):
+        # bank_data, the arguments of a SequentialBankRun over the shard's banks, for sequential runs
+        self.set_random_state(random_state)
+        if self.areDepositorsIntelligent and bank_data:
+            bank_run = SequentialBankRun(*bank_data)
+            order = SequentialBankRun.get_order(
+                self.get_random_uniform(self.totalDepositors, self.depositorRange), self.depositorBank)
+            withdraws = np.zeros(len(self.depositorBank), dtype=bool)
+            withdraws[order] = bank_run.get_withdrawals(
+                self.depositorBank[order], self.deposit[order].astype(np.float64) * ExogenousFactors.amountWithdrawn,
+                DepositorEWAStrategy.get_alpha_values()[self.depositorChosenStrategy[order]])
+            shock = np.where(withdraws, ExogenousFactors.amountWithdrawn, 0)
+        elif self.areDepositorsIntelligent:
+            safety_treshold = DepositorEWAStrategy.get_alpha_values()[self.depositorChosenStrategy]
+            shock = np.where(bank_car[self.depositorBank] > safety_treshold, 0, ExogenousFactors.amountWithdrawn)
+        else:
+            random_uniform = self.get_random_uniform(self.totalDepositors, self.depositorRange)
+            shock = np.where(random_uniform < ExogenousFactors.probabilityofWithdrawal,
+                             ExogenousFactors.amountWithdrawn, 0)
+        shock = shock.astype(self.floatType, copy=False)
+        self.lastPercentageWithdrawn = shock
+        amount_withdrawn = self.deposit * shock
+        self.deposit -= amount_withdrawn
+        self.amountEarlyWithdraw = amount_withdrawn
+
+        withdrawals = np.bincount(self.depositorBank[amount_withdrawn > 0], minlength=self.stop - self.start)
+        return withdrawals, self.sum_by_bank(amount_withdrawn, self.depositorBank), self.get_random_state()
+
+    def collect_loans(self, random_state, deposits_interest_rate):
+        # deposits earn interest first, as in BankingEnsemble.accrue_interest_balance_sheet
+        self.deposit *= deposits_interest_rate
+        self.set_random_state(random_state)
+        defaulted = self.get_random_uniform(self.totalCorporateClients, self.corporateClientRange) <= \
+            self.probabilityOfDefault
+        amount_paid = np.where(defaulted,
+                               self.loanAmount * (1 - self.lossGivenDefault),
+                               self.loanAmount * (1 + self.loanInterestRate))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.percentageRepaid = np.where(self.loanAmount == 0, 0, amount_paid / self.loanAmount)
+        self.loanAmount = amount_paid
+        return self.get_loans() + (self.get_random_state(),)
+
+    def end_cycle(self, strategy_profit, strategy_profit_percentage, percentage_deposits_payable):
+        """
+        Records the profits of the banks' strategies, pays depositors what their bank can and updates
+        their EWA information.
+        """
+        if strategy_profit is not None:
+            chosen = (np.arange(self.stop - self.start), self.bankChosenStrategy)
+            self.bankStrategyProfit[chosen] = strategy_profit
+            self.bankStrategyProfitPercentage[chosen] = strategy_profit_percentage
+            self.bankStrategyProfitPercentageDamped[chosen] = strategy_profit_percentage * self.bankEWADampingFactor
+        self.deposit *= percentage_deposits_payable[self.depositorBank]
+
+        if self.areDepositorsIntelligent:
+            self.amountFinalWithdraw = self.deposit.copy()
+            final_consumption = self.amountEarlyWithdraw + self.amountFinalWithdraw
+            lost_money = final_consumption < self.initialDeposit
+            chosen = (np.arange(len(self.deposit)), self.depositorChosenStrategy)
+            if ExogenousFactors.isDepositInsuranceAvailable:
+                final_consumption = np.where(
+                    lost_money, self.initialDeposit * (1 + ExogenousFactors.depositInterestRate), final_consumption)
+            else:
+                self.depositorStrategyInsolvencyCounter[chosen] += lost_money
+            with np.errstate(divide='ignore'):
+                profit = 100 * np.log(final_consumption / self.initialDeposit)
+            self.depositorStrategyProfit[chosen] = profit
+
+    def get_depositor_strategies(self):
+        return self.depositorChosenStrategy if self.areDepositorsIntelligent else None
+
+
+def serve_shard(connection, settings, arguments):
+    # Runs a Shard in a worker process: every message is a method name and its arguments
+    ExogenousFactors.set_settings(settings)
+    shard = Shard(*arguments)
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        name, args = message
+        try:
+            connection.send((True, getattr(shard, name)(*args)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+    connection.close()
+
+
+class ShardProcess:
+    """
+    A Shard in its own process, reached through a pipe.
+    """
+
+    def __init__(self, settings, arguments):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_shard, args=(child, settings, arguments), daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, name, args):
+        self.connection.send((name, args))
+
+    def receive(self):
+        ok, result = self.connection.recv()
+        if not ok:
+            raise RuntimeError('Shard failed:\n' + result)
+        return result
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join()
+        self.connection.close()
+
+
+class LocalShard:
+    """
+    A Shard in this process, with the interface of ShardProcess (e.g. for debugging).
+    """
+
+    def __init__(self, settings, arguments):
+        self.shard = Shard(*arguments)
+        self.result = None
+
+    def send(self, name, args):
+        self.result = getattr(self.shard, name)(*args)
+
+    def receive(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class ThreadShard:
+    """
+    A Shard in this process whose calls run on a thread pool, so that shards work at the same time
+    wherever NumPy releases the GIL.
+    """
+
+    def __init__(self, settings, arguments, executor):
+        self.shard = Shard(*arguments)
+        self.executor = executor
+        self.future = None
+
+    def send(self, name, args):
+        self.future = self.executor.submit(getattr(self.shard, name), *args)
+
+    def receive(self):
+        return self.future.result()
+
+    def close(self):
+        pass
+
+
+class ShardedModel(BankingEnsemble):
+    """
+    A single BankingModel run with its depositors, corporate clients and bank EWA information partitioned
+    into shards of contiguous banks, each in its own worker process.
+
+    Shards run the withdrawals, loan setup and collection and the EWA updates of their banks. The balance
+    sheets of all banks, the interbank market (matching and contagion) and the central bank stay in this
+    process, which exchanges per-bank vectors with the shards at period boundaries and passes the state of
+    the random stream along, so the run matches BankingModel(seed=seed) exactly.
+    The interbank lending matrix is dense, as in BankingModel, so it bounds the number of banks.
+
+    With threads > 0, the shards stay in this process and run on a pool of that many threads instead, the
+    interbank market and the central bank remaining barriers between their phases. Each shard then draws
+    from its own child stream of the seed, so a run is reproducible for a given seed and number of shards,
+    however the threads are scheduled, but no longer matches BankingModel.
+    """
+
+    def __init__(self, seed=None, simulation_type='HighSpread', exogenous_factors=None, number_of_banks=None,
+                 number_shards=2, processes=True, compact=False, threads=0):
+        super().__init__([seed], simulation_type, exogenous_factors, number_of_banks, compact)
+        n = self.numberBanks
+        number_depositors, number_corporate_clients = self.numberDepositors[0], self.numberCorporateClients[0]
+        depositor_offsets = Util.get_offsets(number_depositors)
+        corporate_client_offsets = Util.get_offsets(number_corporate_clients)
+
+        # shards of contiguous banks with about the same number of depositors and firms
+        load = np.cumsum(number_depositors + number_corporate_clients)
+        cuts = np.searchsorted(load, load[-1] * np.arange(1, number_shards) / number_shards, side='right')
+        self.bounds = [int(_) for _ in np.unique(np.concatenate([[0], np.minimum(cuts, n), [n]]))]
+
+        # the populations live in the shards
+        for name in ('depositorBank', 'corporateClientBank', 'depositorGroup', 'corporateClientGroup',
+                     'firstCorporateClient', 'initialDeposit', 'deposit', 'lastPercentageWithdrawn',
+                     'amountEarlyWithdraw', 'amountFinalWithdraw', 'safetyTreshold', 'depositorStrategyA',
+                     'depositorStrategyP', 'depositorStrategyProfit', 'depositorStrategyInsolvencyCounter',
+                     'depositorChosenStrategy', 'loanAmount', 'percentageRepaid', 'bankStrategyA', 'bankStrategyP',
+                     'bankStrategyProfit', 'bankStrategyProfitPercentage', 'bankStrategyProfitPercentageDamped'):
+            if hasattr(self, name):
+                setattr(self, name, None)
+        self.totalLoans = np.zeros((1, n))
+        self.firstLoanAmount = np.zeros((1, n))
+        self.depositsInterestRate = 1
+        self.bankProfits = (None, None)
+        self.haircuts = None
+
+        settings = ExogenousFactors.get_settings()
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads) if threads > 0 else None
+        number_shards = len(self.bounds) - 1
+        seed_sequences = np.random.SeedSequence(seed).spawn(number_shards) if threads > 0 else [None] * number_shards
+        self.shards = []
+        for start, stop, seed_sequence in zip(self.bounds[:-1], self.bounds[1:], seed_sequences):
+            arguments = (start, stop, n, number_depositors[start:stop], number_corporate_clients[start:stop],
+                         (depositor_offsets[start], depositor_offsets[stop]),
+                         (corporate_client_offsets[start], corporate_client_offsets[stop]),
+                         int(depositor_offsets[-1]), int(corporate_client_offsets[-1]), compact, seed_sequence)
+            if self.executor is not None:
+                self.shards.append(ThreadShard(settings, arguments, self.executor))
+            elif processes:
+                self.shards.append(ShardProcess(settings, arguments))
+            else:
+                self.shards.append(LocalShard(settings, arguments))
+
+    def call_shards(self, name, *args):
+        """
+        Calls a Shard method on every shard at once. Arguments given by bank are sliced for each shard.
+        Returns the results in shard order.
+        """
+        n = self.numberBanks
+        for shard, start, stop in zip(self.shards, self.bounds[:-1], self.bounds[1:]):
+            shard.send(name, [arg[start:stop] if isinstance(arg, np.ndarray) and arg.shape == (n,) else arg
+                              for arg in args])
+        return [shard.receive() for shard in self.shards]
+
+    @staticmethod
+    def concatenate(results):
+        # per-bank results of the shards, as one row of the ensemble
+        return np.concatenate(results)[np.newaxis]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def get_random_state(self):
+        # the state of the model's stream, for shards drawing from it
+        return None if self.threads > 0 else self.random[0].get_state()
+
+    def set_random_state(self, random_state):
+        if random_state is not None:
+            self.random[0].set_state(random_state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def reset_populations(self):
+        # done by the shards at the start of period 0
+        pass
+
+    def period_0(self):
+        results = self.call_shards('start_cycle', self.get_random_state())
+        self.set_random_state(results[0][1])
+        if self.areBanksIntelligent:
+            self.bankChosenStrategy = self.concatenate([strategies for strategies, state in results])
+            self.setup_balance_sheet_intelligent()
+        self.setup_balance_sheet()
+        self.auxBalanceSheet = BalanceSheet()
+        for field, value in vars(self.balanceSheet).items():
+            setattr(self.auxBalanceSheet, field, value.copy())
+
+        if self.isCentralBankIntelligent:
+            self.update_central_bank_strategy()
+        if ExogenousFactors.isCapitalRequirementActive:
+            self.observe_banks_capital_adequacy()
+
+    def setup_balance_sheet(self):
+        bs = self.balanceSheet
+        results = self.call_shards('setup_balance_sheet', bs.nonFinancialSectorLoan[0], bs.deposits[0])
+        self.totalLoans, self.firstLoanAmount = (self.concatenate(_) for _ in zip(*results))
+
+    def get_first_loan_amount(self):
+        return self.firstLoanAmount
+
+    def get_total_loans(self):
+        return self.totalLoans
+
+    def scale_loans(self, factor):
+        if np.all(factor == 1):
+            # multiplying by 1 changes nothing, no need to bother the shards
+            return np.zeros_like(factor)
+        results = self.call_shards('scale_loans', factor[0])
+        reduction, self.totalLoans, self.firstLoanAmount = (self.concatenate(_) for _ in zip(*results))
+        return reduction
+
+    def withdraw_deposits(self):
+        bank_car = self.get_capital_adequacy_ratio()[0] if self.areDepositorsIntelligent else None
+        bank_data = ()
+        if self.areDepositorsIntelligent and ExogenousFactors.areBankRunsSequential:
+            bank_data = [np.ravel(_) for _ in SequentialBankRun.get_bank_data(
+                self.balanceSheet, self.get_real_sector_risk_weighted_assets())]
+        results = self.call_shards('withdraw_deposits', self.get_random_state(), bank_car, *bank_data)
+        withdrawals, amount_withdrawn, states = zip(*results)
+        self.set_random_state(states[0])
+        self.withdrawalsCounter += self.concatenate(withdrawals)
+        self.liquidityNeeds -= self.concatenate(amount_withdrawn)
+
+    def accrue_interest_balance_sheet(self):
+        bs = self.balanceSheet
+        bs.discountWindowLoan = bs.discountWindowLoan * (1 + ExogenousFactors.centralBankLendingInterestRate)
+        bs.liquidAssets = bs.liquidAssets * (1 + self.liquidAssetsInterestRate)
+        self.depositsInterestRate = 1 + self.depositInterestRate
+        bs.deposits = bs.deposits * self.depositsInterestRate
+
+    def collect_loans(self):
+        results = self.call_shards('collect_loans', self.get_random_state(), self.depositsInterestRate)
+        total_loans, first_loan_amount, states = zip(*results)
+        self.set_random_state(states[0])
+        self.totalLoans, self.firstLoanAmount = self.concatenate(total_loans), self.concatenate(first_loan_amount)
+        self.balanceSheet.nonFinancialSectorLoan = self.totalLoans
+
+    def record_bank_profits(self, strategy_profit, strategy_profit_percentage):
+        # sent to the shards with the haircuts at the end of the cycle
+        self.bankProfits = (strategy_profit[0], strategy_profit_percentage[0])
+
+    def apply_haircuts(self, percentage_deposits_payable):
+        self.haircuts = percentage_deposits_payable[0]
+
+    def calculate_depositors_final_utility(self):
+        self.call_shards('end_cycle', *self.bankProfits, self.haircuts)
+        self.bankProfits = (None, None)
+
+    def get_depositor_strategies(self):
+        # chosen strategy of every depositor, or None if they do not learn
+        results = self.call_shards('get_depositor_strategies')
+        return None if results[0] is None else np.concatenate(results)
@@ -0,0 +1,125 @@
+import math
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+
+
+class SharedMetrics:
+    """
+    Per-cycle metrics of many replications in memory-mapped arrays, indexed by (run, cycle, metric).
+
+    Worker processes open the same files and write their rows in place, so nothing but the run index travels
+    back to the parent, which computes aggregates over the finished runs directly on the mapped arrays.
+    Cycles after a replication stopped are NaN.
+    """
+
+    metricNames = ('insolvencies', 'contagions')
+
+    def __init__(self, number_runs, number_cycles, directory=None):
+        self.shape = (number_runs, number_cycles, len(self.metricNames))
+        self.isOwner = directory is None
+        self.directory = tempfile.mkdtemp(prefix='banksim-') if directory is None else directory
+        self.values = np.memmap(self.get_path('values'), dtype=np.float64, mode='w+', shape=self.shape)
+        self.values[:] = np.nan
+        # 0 while the run is not finished
+        self.stopCycles = np.memmap(self.get_path('stop_cycles'), dtype=np.int64, mode='w+', shape=(number_runs,))
+
+    def __getstate__(self):
+        # only the location travels to worker processes
+        return {'shape': self.shape, 'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.directory = state['directory']
+        self.isOwner = False
+        self.values = np.memmap(self.get_path('values'), dtype=np.float64, mode='r+', shape=self.shape)
+        self.stopCycles = np.memmap(self.get_path('stop_cycles'), dtype=np.int64, mode='r+',
+                                    shape=(self.shape[0],))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name + '.dat')
+
+    def close(self):
+        # the owner also removes the files
+        self.values = self.stopCycles = None
+        if self.isOwner:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_cycle(self, run, cycle, metrics):
+        # cycle counts from 1, as the model's
+        self.values[run, cycle - 1] = metrics
+
+    def finish_run(self, run, stop_cycle):
+        self.stopCycles[run] = stop_cycle
+
+    def get_finished_runs(self):
+        return np.flatnonzero(self.stopCycles > 0)
+
+    def get_run_ranges(self):
+        # (start, stop) of every block of consecutive finished runs
+        finished = np.r_[False, self.stopCycles > 0, False]
+        edges = np.flatnonzero(finished[1:] != finished[:-1])
+        return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+    def get_blocks(self, metric):
+        """
+        (run, cycle) values of one metric as views of the mapped array, one per block of consecutive
+        finished runs, so nothing is copied however the finished runs are spread.
+        """
+        index = self.metricNames.index(metric)
+        return [self.values[start:stop, :, index] for start, stop in self.get_run_ranges()]
+
+    def get_values(self, metric):
+        """
+        (finished run, cycle) values of one metric: a view of the mapped array when the finished runs are
+        consecutive (e.g. all of them), otherwise a copy of their blocks (see get_blocks for views).
+        """
+        blocks = self.get_blocks(metric)
+        if len(blocks) == 1:
+            return blocks[0]
+        if not blocks:
+            return self.values[:0, :, self.metricNames.index(metric)]
+        return np.concatenate(blocks)
+
+    def get_mean(self, metric):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(self.get_values(metric), axis=0)
+
+    def get_quantiles(self, metric, quantiles=(0.05, 0.5, 0.95)):
+        # one row per quantile, one column per cycle
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanquantile(self.get_values(metric), quantiles, axis=0)
+
+    @staticmethod
+    def get_normal_quantile(probability):
+        # inverse of the standard normal distribution function, by bisection on math.erf
+        low, high = -40.0, 40.0
+        for _ in range(100):
+            middle = (low + high) / 2
+            if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < probability:
+                low = middle
+            else:
+                high = middle
+        return (low + high) / 2
+
+    def get_confidence_band(self, metric, confidence=0.95):
+        # lower and upper bounds of the confidence interval of the mean, assuming normality
+        values = self.get_values(metric)
+        number_values = np.sum(~np.isnan(values), axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(values, axis=0)
+            standard_error = np.nanstd(values, axis=0, ddof=1) / np.sqrt(number_values)
+        z = SharedMetrics.get_normal_quantile(0.5 + confidence / 2)
+        return mean - z * standard_error, mean + z * standard_error
@@ -1,8 +1,13 @@
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.util import Util
+
+
 class BankEWAStrategy:
-    # capital ratio (capital / assets)
-    numberAlphaOptions = 10
-    # liquidity ratio(liquid assets / deposits)
-    numberBetaOptions = 20
+    """
+    One option of a bank: alpha indexes its capital ratio (capital / assets) and beta its liquidity ratio
+    (liquid assets / deposits), in the grids ExogenousFactors.bankCapitalRatioOptions and
+    bankLiquidityRatioOptions. Options are numbered alphaIndex * number of beta options + betaIndex.
+    """
 
     def __init__(self, alpha_index_option=0, beta_index_option=0):
         self.alphaIndex = alpha_index_option
@@ -10,11 +15,27 @@ class BankEWAStrategy:
         self.strategyProfit = self.strategyProfitPercentage = self.strategyProfitPercentageDamped = 0
         self.A = self.P = self.F = 0
 
-    def get_alpha_value(self):
-        return (self.alphaIndex + 1) / 100
+    @staticmethod
+    def get_alpha_values():
+        # capital ratio of every alpha option
+        return Util.get_grid(ExogenousFactors.bankCapitalRatioOptions)
+
+    @staticmethod
+    def get_beta_values():
+        # liquidity ratio of every beta option
+        return Util.get_grid(ExogenousFactors.bankLiquidityRatioOptions)
+
+    @staticmethod
+    def get_number_alpha_options():
+        return len(BankEWAStrategy.get_alpha_values())
+
+    @staticmethod
+    def get_number_beta_options():
+        return len(BankEWAStrategy.get_beta_values())
 
-    def get_beta_value(self):
-        return (self.betaIndex + 1) / 100
+    @staticmethod
+    def get_number_strategies():
+        return BankEWAStrategy.get_number_alpha_options() * BankEWAStrategy.get_number_beta_options()
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -27,4 +48,5 @@ class BankEWAStrategy:
 
     @classmethod
     def bank_ewa_strategy_list(cls):
-        return [BankEWAStrategy(a, b) for a in range(cls.numberAlphaOptions) for b in range(cls.numberBetaOptions)]
+        return [BankEWAStrategy(a, b) for a in range(cls.get_number_alpha_options())
+                for b in range(cls.get_number_beta_options())]
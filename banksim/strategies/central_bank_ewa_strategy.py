@@ -1,8 +1,14 @@
 import numpy as np
 
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.util import Util
+
 
 class CentralBankEWAStrategy:
-    numberAlphaOptions = 10
+    """
+    One option of the central bank: alpha indexes the minimum capital adequacy ratio it requires, in the
+    grid ExogenousFactors.centralBankCapitalRatioOptions.
+    """
 
     def __init__(self, alpha_index_option=0):
         self.alphaIndex = alpha_index_option
@@ -10,8 +16,13 @@ class CentralBankEWAStrategy:
         self.A = self.P = self.F = 0
         self.numberInsolvencies = self.totalLoans = 0
 
-    def get_alpha_value(self):
-        return (self.alphaIndex + 1) / 100
+    @staticmethod
+    def get_alpha_values():
+        return Util.get_grid(ExogenousFactors.centralBankCapitalRatioOptions)
+
+    @staticmethod
+    def get_number_alpha_options():
+        return len(CentralBankEWAStrategy.get_alpha_values())
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -25,5 +36,5 @@ class CentralBankEWAStrategy:
 
     @classmethod
     def central_bank_ewa_strategy_list(cls):
-        return np.array([CentralBankEWAStrategy(a) for a in range(cls.numberAlphaOptions)],
+        return np.array([CentralBankEWAStrategy(a) for a in range(cls.get_number_alpha_options())],
                         dtype=CentralBankEWAStrategy)
@@ -1,8 +1,14 @@
 import numpy as np
 
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.util import Util
+
 
 class DepositorEWAStrategy:
-    numberAlphaOptions = 10
+    """
+    One option of a depositor: alpha indexes the capital adequacy ratio of its bank below which it withdraws
+    (its safety threshold), in the grid ExogenousFactors.depositorSafetyThresholdOptions.
+    """
 
     def __init__(self, alpha_index_option=0):
         self.alphaIndex = alpha_index_option
@@ -10,8 +16,13 @@ class DepositorEWAStrategy:
         self.insolvencyCounter = self.finalConsumption = 0
         self.A = self.P = self.F = 0
 
-    def get_alpha_value(self):
-        return (self.alphaIndex + 1) / 100
+    @staticmethod
+    def get_alpha_values():
+        return Util.get_grid(ExogenousFactors.depositorSafetyThresholdOptions)
+
+    @staticmethod
+    def get_number_alpha_options():
+        return len(DepositorEWAStrategy.get_alpha_values())
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -25,4 +36,5 @@ class DepositorEWAStrategy:
 
     @classmethod
     def depositor_ewa_strategy_list(cls):
-        return np.array([DepositorEWAStrategy(a) for a in range(cls.numberAlphaOptions)], dtype=DepositorEWAStrategy)
+        return np.array([DepositorEWAStrategy(a) for a in range(cls.get_number_alpha_options())],
+                        dtype=DepositorEWAStrategy)
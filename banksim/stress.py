@@ -0,0 +1,181 @@
+import pickle
+import random
+
+import numpy as np
+
+from banksim.exogeneous_factors import ExogenousFactors
+
+
+class Shock:
+    """
+    Change of one exogenous factor to 'value' for 'duration' cycles, starting 'start' cycles after the
+    schedule is attached to a model (0 is the first cycle run with it).
+
+    The factor 'withdrawalSpike' is not an exogenous factor: it makes the depositors of 'banks' (indices,
+    all banks if None) withdraw at least 'value' of their deposits, on top of the usual liquidity shock.
+    """
+
+    withdrawalSpike = 'withdrawalSpike'
+
+    def __init__(self, factor, value, start=0, duration=1, banks=None):
+        if factor != Shock.withdrawalSpike and factor not in ExogenousFactors.get_settings():
+            raise ValueError('Unknown exogenous factor {}'.format(factor))
+        if banks is not None and factor != Shock.withdrawalSpike:
+            raise ValueError('Only a {} can be limited to some banks'.format(Shock.withdrawalSpike))
+        self.factor = factor
+        self.value = value
+        self.start = int(start)
+        self.duration = int(duration)
+        self.banks = banks
+
+
+class ShockSchedule:
+    """
+    Declarative list of Shocks, e.g.
+
+        ShockSchedule([Shock('withdrawalSpike', 0.5, start=10, duration=3, banks=[0, 1]),
+                       Shock('standardCorporateClientDefaultRate', 0.2, start=10, duration=20),
+                       Shock('interbankLendingMarketAvailable', False, start=15, duration=5),
+                       Shock('isDepositInsuranceAvailable', True, start=30, duration=1000)])
+
+    compiled against a model into one vector of values per cycle for every factor involved.
+    """
+
+    def __init__(self, shocks=(), name=None):
+        self.shocks = list(shocks)
+        self.name = name
+
+    @classmethod
+    def from_settings(cls, settings, name=None):
+        # e.g. from a scenario file: [{factor: withdrawalSpike, value: 0.5, start: 10, banks: [0, 1]}, ...]
+        return cls([Shock(**shock) for shock in settings], name)
+
+    def compile(self, model, number_cycles):
+        """
+        Parameters of the next 'number_cycles' cycles of the model. Outside the shocks, factors keep the
+        value they had when the schedule was compiled.
+        """
+        return CompiledShocks(self, model.schedule.cycle + 1, number_cycles, model.numberBanks)
+
+
+class CompiledShocks:
+    """
+    Per-cycle parameter vectors of a ShockSchedule, applied by the scheduler at the start of every cycle.
+    Applying them costs one assignment per shocked factor and cycle, whatever the number of agents.
+    """
+
+    def __init__(self, schedule, first_cycle, number_cycles, number_banks):
+        self.firstCycle = first_cycle
+        self.numberCycles = number_cycles
+        self.baseline = {}
+        self.factors = {}
+        self.withdrawals = None
+
+        for shock in schedule.shocks:
+            cycles = slice(shock.start, shock.start + shock.duration)
+            if shock.factor == Shock.withdrawalSpike:
+                if self.withdrawals is None:
+                    self.withdrawals = np.zeros((number_cycles, number_banks))
+                banks = slice(None) if shock.banks is None else shock.banks
+                self.withdrawals[cycles, banks] = shock.value
+            else:
+                if shock.factor not in self.factors:
+                    baseline = getattr(ExogenousFactors, shock.factor)
+                    values = [baseline] + [_.value for _ in schedule.shocks if _.factor == shock.factor]
+                    self.baseline[shock.factor] = baseline
+                    self.factors[shock.factor] = np.full(number_cycles, baseline, dtype=np.array(values).dtype)
+                self.factors[shock.factor][cycles] = shock.value
+        # cycles with no spike leave the depositors alone
+        self.withdrawalCycles = None if self.withdrawals is None else np.any(self.withdrawals > 0, axis=1)
+
+    @staticmethod
+    def get_targets(model, factor):
+        # Copies of the factor the model made when it was built, besides ExogenousFactors itself
+        if factor in ('depositInterestRate', 'interbankInterestRate', 'liquidAssetsInterestRate',
+                      'interbankLendingMarketAvailable'):
+            return [(model, factor)]
+        if factor in ('centralBankLendingInterestRate', 'offersDiscountWindowLending', 'minimumCapitalAdequacyRatio'):
+            return [(model.schedule.central_bank, factor)]
+        corporate_clients = 'standard' if ExogenousFactors.standardCorporateClients else 'wholesale'
+        attributes = {corporate_clients + 'CorporateClientDefaultRate': 'probabilityOfDefault',
+                      corporate_clients + 'CorporateClientLossGivenDefault': 'lossGivenDefault',
+                      corporate_clients + 'CorporateClientLoanInterestRate': 'loanInterestRate'}
+        if factor in attributes:
+            return [(model.schedule.corporate_clients, attributes[factor])]
+        return []
+
+    def apply(self, model, cycle):
+        i = cycle - self.firstCycle
+        during = 0 <= i < self.numberCycles
+        for factor, values in self.factors.items():
+            value = values[i] if during else self.baseline[factor]
+            if isinstance(value, np.generic):
+                value = value.item()
+            setattr(ExogenousFactors, factor, value)
+            for target, attribute in CompiledShocks.get_targets(model, factor):
+                setattr(target, attribute, value)
+        if self.withdrawals is not None:
+            spike = during and self.withdrawalCycles[i]
+            model.schedule.depositors.withdrawalSpike = self.withdrawals[i] if spike else None
+
+
+class Baseline:
+    """
+    Frozen state of a model, including the global random state and the exogenous factors, from which any
+    number of identical copies can be restored: a warm-up run once, and every variant starts from it.
+    """
+
+    def __init__(self, model):
+        self.cycle = model.schedule.cycle
+        self.state = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+        self.randomState = np.random.get_state()
+        self.pythonRandomState = random.getstate()
+        self.settings = ExogenousFactors.get_settings()
+
+    def restore(self):
+        ExogenousFactors.set_settings(self.settings)
+        np.random.set_state(self.randomState)
+        random.setstate(self.pythonRandomState)
+        return pickle.loads(self.state)
+
+
+class StressResult:
+    """
+    Share of banks that became insolvent (in total and due to contagion) in each cycle after the baseline.
+    """
+
+    def __init__(self, name, insolvencies, contagions):
+        self.name = name
+        self.insolvencies = insolvencies
+        self.contagions = contagions
+
+
+class StressTest:
+    """
+    Runs shock schedules from one warmed-up baseline.
+
+    Every variant starts from the same state and the same random numbers, so comparing it with an empty
+    ShockSchedule measures the response to the shocks rather than noise (until the shocks change how many
+    random numbers the model draws).
+    """
+
+    def __init__(self, model, warm_up_cycles=0):
+        for i in range(warm_up_cycles):
+            model.step()
+        self.baseline = Baseline(model)
+
+    def run_schedule(self, schedule, cycles):
+        model = self.baseline.restore()
+        model.schedule.add_shocks(schedule.compile(model, cycles))
+        central_bank = model.schedule.central_bank
+        insolvencies, contagions = np.zeros(cycles), np.zeros(cycles)
+        for i in range(cycles):
+            model.step()
+            insolvencies[i] = central_bank.insolvencyPerCycleCounter / model.numberBanks
+            contagions[i] = central_bank.insolvencyDueToContagionPerCycleCounter / model.numberBanks
+        # leave the factors as the baseline had them
+        ExogenousFactors.set_settings(self.baseline.settings)
+        return StressResult(schedule.name, insolvencies, contagions)
+
+    def run(self, schedules, cycles):
+        return [self.run_schedule(schedule, cycles) for schedule in schedules]
@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 
 
@@ -5,13 +7,76 @@ class Util:
     id = 0
 
     @staticmethod
-    def get_random_uniform(max_size):
-        return np.random.uniform(0, max_size)
+    def get_random_uniform(max_size, size=None):
+        return np.random.uniform(0, max_size, size)
 
     @staticmethod
     def get_random_log_normal(mean, standard_deviation):
         return np.random.lognormal(mean, standard_deviation)
 
+    @staticmethod
+    def get_grid(options):
+        # Values of a strategy grid given as (first value, step, number of options), in percentage points
+        return Util.get_grid_values(*options)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_grid_values(first, step, number_options):
+        if number_options < 1 or step <= 0:
+            raise ValueError('Invalid strategy grid ({}, {}, {})'.format(first, step, number_options))
+        # integer grids give exactly (i + 1) / 100 and the like
+        values = (first + step * np.arange(number_options)) / 100
+        # shared by every caller, so read-only
+        values.flags.writeable = False
+        return values
+
+    @staticmethod
+    def apportion(total, weights, minimum=0):
+        # Largest remainder method: integer parts proportional to weights, adding up to total
+        weights = np.asarray(weights, dtype=float)
+        available = total - minimum * len(weights)
+        quotas = available * weights / np.sum(weights)
+        parts = np.floor(quotas).astype(np.int64)
+        shortfall = int(available - np.sum(parts))
+        if shortfall > 0:
+            largest_remainders = np.argsort(parts - quotas, kind='stable')[:shortfall]
+            parts[largest_remainders] += 1
+        return parts + minimum
+
+    @staticmethod
+    def get_offsets(counts):
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets
+
+    @staticmethod
+    def get_positions(offsets, groups):
+        # Positions [offsets[g], offsets[g + 1]) of every group g in 'groups', one after the other
+        starts = offsets[groups]
+        counts = offsets[groups + 1] - starts
+        first = Util.get_offsets(counts)[:-1]
+        return np.repeat(starts - first, counts) + np.arange(np.sum(counts))
+
+    @staticmethod
+    def sum_by_group(values, groups, number_groups):
+        # np.bincount adds values up in order, giving the same result as sum() over each group
+        return np.bincount(groups, weights=values, minlength=number_groups)
+
+    @staticmethod
+    def ordered_sum(values, axis=0):
+        # Same result as sum(values); np.sum uses pairwise summation and may differ in the last bits
+        if np.shape(values)[axis] == 0:
+            return 0
+        return np.take(np.add.accumulate(values, axis=axis), -1, axis=axis)
+
+    @staticmethod
+    def get_entropy(probabilities, axis=-1):
+        # Shannon entropy (in nats) of probability vectors, taking 0 * log(0) as 0
+        probabilities = np.asarray(probabilities, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(probabilities > 0, probabilities * np.log(probabilities), 0)
+        return -np.sum(terms, axis=axis)
+
     @classmethod
     def get_unique_id(cls):
         cls.id += 1
@@ -1,9 +1,9 @@
 from mesa.datacollection import DataCollector
 
-from banksim.model import BankingModel
+from banksim.mesa_adapter import MesaBankingModel
 
 
-class MyModel(BankingModel):
+class MyModel(MesaBankingModel):
     """
     BankSim is a banking agent-based simulation framework developed in Python 3+.
 
@@ -0,0 +1,11 @@
+import pytest
+
+from banksim.exogeneous_factors import ExogenousFactors
+
+
+@pytest.fixture(autouse=True)
+def reset_exogenous_factors():
+    # settings are class-global, so a test must not see those of the previous one
+    ExogenousFactors.reset()
+    yield
+    ExogenousFactors.reset()
@@ -0,0 +1,26 @@
+import numpy as np
+
+from banksim.batch import BatchRunner
+from banksim.cache import ResultCache
+from banksim.shared_metrics import SharedMetrics
+
+
+def test_duplicate_seeds_fill_every_run(tmp_path):
+    seeds = [3, 3, 5, 3]
+    for cache in (None, ResultCache(str(tmp_path))):
+        # with a cache, the second pass reads the replications back
+        for _ in range(2):
+            with SharedMetrics(len(seeds), 20) as metrics:
+                results = list(BatchRunner('HighSpread', None, 10, None, 1, cache).run(seeds, 20, metrics))
+                assert sorted(result.run for result in results) == [0, 1, 2, 3]
+                assert all(seeds[result.run] == result.seed for result in results)
+                assert list(metrics.get_finished_runs()) == [0, 1, 2, 3]
+                np.testing.assert_array_equal(metrics.values[0], metrics.values[1])
+                np.testing.assert_array_equal(metrics.values[0], metrics.values[3])
+
+
+def test_run_all_keeps_the_order_of_repeated_seeds():
+    results = BatchRunner('HighSpread', None, 10, None, 1).run_all([3, 5, 3], 5)
+    assert [result.seed for result in results] == [3, 5, 3]
+    assert [result.run for result in results] == [0, 1, 2]
+    assert results[0].insolvencies == results[2].insolvencies
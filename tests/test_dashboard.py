@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+from banksim.dashboard import Dashboard
+from banksim.model import BankingModel
+
+
+class Writer:
+    # stands in for the asyncio stream of a browser
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def get_messages(self):
+        return [json.loads(event[len(b'data: '):]) for event in self.data.split(b'\n\n')
+                if event.startswith(b'data: ')]
+
+
+def test_finished_after_the_last_cycle_was_sent():
+    # the client sees the last cycle before run_model marks the run finished
+    model = BankingModel('HighSpread', number_of_banks=5, seed=1)
+    dashboard = Dashboard(model, 2, interval=0)
+    for _ in range(2):
+        model.step()
+        dashboard.state.record(model)
+    last_cycle, message = dashboard.state.get_delta_message(0)
+    assert last_cycle == 2 and not message['finished']
+    assert dashboard.state.get_delta_message(last_cycle)[1] is None
+
+    dashboard.state.finished = True
+    last_cycle, message = dashboard.state.get_delta_message(last_cycle)
+    assert last_cycle == 2 and message['finished'] and message['points'] == []
+    assert dashboard.state.get_delta_message(last_cycle, True)[1] is None
+
+
+def test_stream_ends_when_finished_after_the_last_cycle():
+    model = BankingModel('HighSpread', number_of_banks=5, seed=1)
+    dashboard = Dashboard(model, 2, interval=0)
+
+    async def stream():
+        writer = Writer()
+        task = asyncio.ensure_future(dashboard.stream_events(writer))
+        await asyncio.sleep(0)
+        for _ in range(2):
+            model.step()
+            dashboard.state.record(model)
+        # lets the stream send the last cycle before the run is finished
+        for _ in range(5):
+            await asyncio.sleep(0)
+        with dashboard.state.lock:
+            dashboard.state.finished = True
+        await asyncio.wait_for(task, 5)
+        return writer.get_messages()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        messages = loop.run_until_complete(stream())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    assert [message['finished'] for message in messages[:-1]] == [False] * (len(messages) - 1)
+    assert messages[-1]['finished'] and messages[-1]['cycle'] == 2
+    assert any(message['cycle'] == 2 and not message['finished'] for message in messages)
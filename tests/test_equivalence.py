@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from banksim.equivalence import EnsembleEngine, ReferenceEngine, ShardedEngine, Trace
+
+ZERO_INTELLIGENCE_BANKS = {'areBanksZeroIntelligenceAgents': True}
+ZERO_INTELLIGENCE = dict(ZERO_INTELLIGENCE_BANKS, isCentralBankZeroIntelligenceAgent=True,
+                         areDepositorsZeroIntelligenceAgents=True)
+
+
+@pytest.mark.parametrize('exogenous_factors', [ZERO_INTELLIGENCE_BANKS, ZERO_INTELLIGENCE])
+@pytest.mark.parametrize('engine', [EnsembleEngine, ShardedEngine])
+def test_zero_intelligence_banks(engine, exogenous_factors, tmp_path):
+    trace = Trace.record(ReferenceEngine, 'HighSpread', 1, 10, 20, exogenous_factors)
+    assert np.all(trace.values['bankStrategy'] == -1)
+    path = str(tmp_path / 'trace.npz')
+    trace.save(path)
+    assert Trace.load(path).compare(engine) is None
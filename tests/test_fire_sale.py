@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from banksim.agents.bank import BalanceSheet
+from banksim.equivalence import EnsembleEngine, ReferenceEngine, Trace
+from banksim.exogeneous_factors import ExogenousFactors
+from banksim.fire_sale import FireSaleMarket
+from banksim.model import BankingModel
+
+
+def get_balance_sheet():
+    # bank 0 needs liquidity, banks 1 and 2 do not sell
+    balance_sheet = BalanceSheet()
+    balance_sheet.deposits = np.array([-80., -80., -60.])
+    balance_sheet.nonFinancialSectorLoan = np.array([60., 50., 40.])
+    balance_sheet.liquidAssets = np.array([0., 20., 10.])
+    return balance_sheet, np.array([-30., 5., 0.1])
+
+
+def sell(marked_to_market, endogenous=True):
+    ExogenousFactors.isFireSalePriceEndogenous = endogenous
+    ExogenousFactors.isFireSaleMarkedToMarket = marked_to_market
+    balance_sheet, liquidity_needs = get_balance_sheet()
+    loans = balance_sheet.nonFinancialSectorLoan
+    capital = balance_sheet.capital
+    needs, proportion, amount_sold = FireSaleMarket.sell(balance_sheet, liquidity_needs, liquidity_needs < 0)
+    return balance_sheet, loans, capital, needs, proportion, amount_sold
+
+
+def test_without_mark_to_market_only_the_seller_changes():
+    balance_sheet, loans, capital, needs, proportion, amount_sold = sell(False)
+    assert amount_sold[0] > 0 and needs[0] == 0
+    np.testing.assert_array_equal(balance_sheet.nonFinancialSectorLoan[1:], loans[1:])
+    np.testing.assert_array_equal(balance_sheet.capital[1:], capital[1:])
+    np.testing.assert_array_equal(proportion[1:], 0)
+
+
+def test_mark_to_market_spreads_the_loss_to_every_bank():
+    unmarked = sell(False)
+    balance_sheet, loans, capital, needs, proportion, amount_sold = sell(True)
+    # the sale itself is the same
+    np.testing.assert_array_equal(amount_sold, unmarked[5])
+    np.testing.assert_array_equal(needs, unmarked[3])
+
+    ExogenousFactors.isFireSalePriceEndogenous = True
+    bs, liquidity_needs = get_balance_sheet()
+    discount_rate = FireSaleMarket.get_discount_rate(bs, liquidity_needs, liquidity_needs < 0)[0]
+    assert discount_rate > ExogenousFactors.illiquidAssetDiscountRate
+    value = (1 + ExogenousFactors.illiquidAssetDiscountRate) / (1 + discount_rate)
+    np.testing.assert_allclose(balance_sheet.nonFinancialSectorLoan, (loans - amount_sold) * value)
+    # banks that did not sell lose the write-down of their loans (capital is negative equity)
+    np.testing.assert_allclose(balance_sheet.capital[1:] - capital[1:], loans[1:] * (1 - value))
+    # the loans of corporate clients are scaled down by the returned proportion
+    np.testing.assert_allclose(loans * (1 - proportion), balance_sheet.nonFinancialSectorLoan)
+
+
+def test_mark_to_market_needs_an_endogenous_price():
+    balance_sheet, loans, capital, needs, proportion, amount_sold = sell(True, endogenous=False)
+    np.testing.assert_array_equal(balance_sheet.nonFinancialSectorLoan, loans - amount_sold)
+
+
+@pytest.mark.parametrize('marked_to_market', [False, True])
+def test_corporate_client_loans_follow_the_banks(marked_to_market):
+    exogenous_factors = {'isFireSalePriceEndogenous': True, 'isFireSaleMarkedToMarket': marked_to_market}
+    model = BankingModel('HighSpread', exogenous_factors, 10, seed=5)
+    corporate_clients = model.schedule.corporate_clients
+    for _ in range(5):
+        model.step()
+        for bank in model.schedule.banks:
+            assert corporate_clients.get_total_loans(bank.index) == pytest.approx(
+                bank.balanceSheet.nonFinancialSectorLoan)
+
+
+def test_engines_agree_with_mark_to_market():
+    exogenous_factors = {'isFireSalePriceEndogenous': True, 'isFireSaleMarkedToMarket': True,
+                         'offersDiscountWindowLending': False, 'fireSalePriceImpact': 5}
+    trace = Trace.record(ReferenceEngine, 'HighSpread', 1, 10, 20, exogenous_factors)
+    assert trace.compare(EnsembleEngine) is None
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from banksim.agents.bank import BalanceSheet
+from banksim.agents.central_bank import CentralBank
+from banksim.model import BankingModel
+
+# liquid assets, loans, interbank loan, discount window loan, deposits
+CASES = {
+    'creditor bank': ((10, 50, 20, -30, -100), dict(interbankLoan=0, discountWindowLoan=0, deposits=-50)),
+    'full interbank repayment': ((10, 50, -20, -10, -100), dict(interbankLoan=0, discountWindowLoan=0, deposits=-30)),
+    'partial interbank repayment': ((5, 25, -40, -10, -100), dict(interbankLoan=-20, discountWindowLoan=0, deposits=0)),
+    'partial discount window repayment': ((5, 10, -20, -30, -50),
+                                          dict(interbankLoan=-20, discountWindowLoan=-15, deposits=0)),
+}
+
+
+def get_balance_sheet(liquid_assets, loans, interbank_loan, discount_window_loan, deposits):
+    balance_sheet = BalanceSheet()
+    balance_sheet.liquidAssets = liquid_assets
+    balance_sheet.nonFinancialSectorLoan = loans
+    balance_sheet.interbankLoan = interbank_loan
+    balance_sheet.discountWindowLoan = discount_window_loan
+    balance_sheet.deposits = deposits
+    return balance_sheet
+
+
+def stack(cases):
+    return BalanceSheet.stack([get_balance_sheet(*case) for case in cases])
+
+
+def liquidate_bank(case):
+    # Bank.liquidate on a bank of a model, which also applies the haircut to its depositors
+    bank = BankingModel('HighSpread', number_of_banks=2, seed=1).schedule.banks[0]
+    bank.balanceSheet = get_balance_sheet(*case)
+    bank.liquidate()
+    return bank.balanceSheet
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_waterfall(name):
+    case, expected = CASES[name]
+    stacked = stack([case])
+    percentage_deposits_payable = CentralBank.liquidate(stacked, np.array([True]))
+    assert percentage_deposits_payable[0] == pytest.approx(expected['deposits'] / case[4])
+    for balance_sheet in (liquidate_bank(case), stacked):
+        assert np.all(balance_sheet.liquidAssets == 0)
+        assert np.all(balance_sheet.nonFinancialSectorLoan == 0)
+        for field, value in expected.items():
+            assert np.all(getattr(balance_sheet, field) == pytest.approx(value)), field
+
+
+def test_banks_not_liquidated_are_unchanged():
+    cases = [case for case, _ in CASES.values()]
+    banks = np.array([True, False, True, False])
+    balance_sheet = stack(cases)
+    percentage_deposits_payable = CentralBank.liquidate(balance_sheet, banks)
+    unmasked = stack(cases)
+    CentralBank.liquidate(unmasked, np.ones(len(cases), dtype=bool))
+    original = stack(cases)
+    for field in BalanceSheet.fields:
+        np.testing.assert_array_equal(getattr(balance_sheet, field)[~banks], getattr(original, field)[~banks])
+        np.testing.assert_array_equal(getattr(balance_sheet, field)[banks], getattr(unmasked, field)[banks])
+    np.testing.assert_array_equal(percentage_deposits_payable[~banks], 1)
+
+
+def test_vectorized_liquidation_matches_bank_liquidation():
+    random_state = np.random.RandomState(0)
+    cases = np.column_stack([random_state.uniform(0, 20, 200), random_state.uniform(0, 60, 200),
+                             random_state.uniform(-50, 50, 200), random_state.uniform(-40, 0, 200),
+                             random_state.uniform(-120, -1, 200)])
+    cases[::7, 3] = 0  # no discount window loan
+    cases[::11, 2] = 0  # no interbank position
+    balance_sheet = stack(cases)
+    CentralBank.liquidate(balance_sheet, np.ones(len(cases), dtype=bool))
+    for i, case in enumerate(cases):
+        expected = liquidate_bank(case)
+        for field in BalanceSheet.fields:
+            assert getattr(balance_sheet, field)[i] == pytest.approx(getattr(expected, field), abs=1e-12), field
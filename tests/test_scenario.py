@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+from banksim.scenario import Scenario
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'HeadlessExecution')
+
+
+@pytest.mark.parametrize('name', ['basel.yaml', 'high_spread.toml'])
+def test_shipped_scenarios_load(name):
+    scenario = Scenario.from_file(os.path.join(EXAMPLES, name))
+    assert scenario.outputs
+    for path in scenario.outputs.values():
+        assert os.path.dirname(path) == EXAMPLES
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from banksim.shared_metrics import SharedMetrics
+
+
+def fill(metrics, runs):
+    for run in runs:
+        for cycle in range(1, 4):
+            metrics.write_cycle(run, cycle, (run + cycle / 10, -run))
+        metrics.finish_run(run, 3)
+
+
+def test_consecutive_finished_runs_are_read_without_copying():
+    with SharedMetrics(5, 3) as metrics:
+        fill(metrics, [1, 2, 3])
+        values = metrics.get_values('insolvencies')
+        assert np.shares_memory(values, metrics.values)
+        np.testing.assert_array_equal(values, metrics.values[1:4, :, 0])
+        np.testing.assert_allclose(metrics.get_mean('insolvencies'), [2.1, 2.2, 2.3])
+
+
+def test_scattered_finished_runs_have_a_view_per_block():
+    with SharedMetrics(6, 3) as metrics:
+        fill(metrics, [0, 1, 4])
+        assert metrics.get_run_ranges() == [(0, 2), (4, 5)]
+        blocks = metrics.get_blocks('contagions')
+        assert all(np.shares_memory(block, metrics.values) for block in blocks)
+        values = metrics.get_values('contagions')
+        np.testing.assert_array_equal(values, metrics.values[[0, 1, 4], :, 1])
+        np.testing.assert_array_equal(np.concatenate(blocks), values)
+
+
+def test_no_finished_runs():
+    with SharedMetrics(3, 4) as metrics:
+        assert metrics.get_values('insolvencies').shape == (0, 4)
+
+
+def test_normal_quantile():
+    assert SharedMetrics.get_normal_quantile(0.5) == pytest.approx(0, abs=1e-12)
+    assert SharedMetrics.get_normal_quantile(0.975) == pytest.approx(1.959963984540054, abs=1e-12)
+    assert SharedMetrics.get_normal_quantile(0.005) == pytest.approx(-2.5758293035489004, abs=1e-12)
+
+
+def test_confidence_band():
+    with SharedMetrics(4, 3) as metrics:
+        fill(metrics, range(4))
+        lower, upper = metrics.get_confidence_band('insolvencies')
+        values = metrics.get_values('insolvencies')
+        half_width = 1.959963984540054 * np.std(values, axis=0, ddof=1) / 2
+        np.testing.assert_allclose(lower, np.mean(values, axis=0) - half_width)
+        np.testing.assert_allclose(upper, np.mean(values, axis=0) + half_width)